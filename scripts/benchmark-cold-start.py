@@ -0,0 +1,184 @@
+# pylint: disable=invalid-name
+"""
+Measure Lambda-style cold starts of the Files API.
+
+Every iteration runs in a fresh Python interpreter, like a new Lambda execution environment, and reports:
+
+- import time of `files_api.main`,
+- `create_app()` time,
+- `prime_app()` time (unless `--no-prime`),
+- the latency of the first request to each route.
+
+By default S3 is mocked in-process with moto, so the numbers isolate the app's own cold-start cost.
+Pass `--real-aws --bucket <name>` to measure against a real bucket, and `--generate` to include the
+generate route (point `OPENAI_BASE_URL` at the mock OpenAI server unless you want to pay for it).
+
+Set budgets to turn the report into a check that fails (exit code 1) when a cold start regresses:
+
+    python ./scripts/benchmark-cold-start.py --iterations 5 --max-import-ms 800 --max-first-request-ms 100
+"""
+
+import argparse
+import json
+import statistics
+import sys
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Union,
+)
+
+from files_api.cold_start import run_in_fresh_interpreter
+
+# Runs in the fresh interpreter. Prints one JSON object with all timings in milliseconds.
+CHILD_SCRIPT = """
+import json, os, sys, time
+from contextlib import nullcontext
+
+config = json.loads(sys.argv[1])
+mock = nullcontext()
+if not config["real_aws"]:
+    from moto import mock_aws  # imported before timing starts: it is not part of the app's cold start
+    mock = mock_aws()
+
+with mock:
+    import boto3
+    if not config["real_aws"]:
+        boto3.client("s3").create_bucket(Bucket=config["bucket"])
+
+    timings = {}
+    start = time.perf_counter()
+    from files_api.main import create_app
+    from files_api.settings import Settings
+    timings["import"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    app = create_app(settings=Settings(s3_bucket_name=config["bucket"]))
+    timings["create_app"] = (time.perf_counter() - start) * 1000
+
+    if config["prime"]:
+        from files_api.priming import prime_app
+        start = time.perf_counter()
+        prime_app(app)
+        timings["prime_app"] = (time.perf_counter() - start) * 1000
+
+    from fastapi.testclient import TestClient
+    client = TestClient(app)
+    path = "cold-start-benchmark/file.txt"
+    requests = [
+        ("PUT /v1/files/{path}", "put", f"/v1/files/{path}", {"files": {"file_content": ("f.txt", b"x" * 1024)}}),
+        ("GET /v1/files", "get", "/v1/files", {}),
+        ("HEAD /v1/files/{path}", "head", f"/v1/files/{path}", {}),
+        ("GET /v1/files/{path}", "get", f"/v1/files/{path}", {}),
+        ("DELETE /v1/files/{path}", "delete", f"/v1/files/{path}", {}),
+    ]
+    if config["generate"]:
+        requests.append((
+            "POST /v1/files/generated/{path}",
+            "post",
+            "/v1/files/generated/cold-start-benchmark/generated.txt",
+            {"params": {"prompt": "Say hi", "file_type": "Text"}},
+        ))
+    for name, method, url, kwargs in requests:
+        start = time.perf_counter()
+        response = getattr(client, method)(url, **kwargs)
+        timings[f"first {name}"] = (time.perf_counter() - start) * 1000
+        assert response.status_code < 400, f"{name} failed with {response.status_code}: {response.text}"
+
+print(json.dumps(timings))
+"""
+
+
+class Args(NamedTuple):
+    """CLI arguments for the script."""
+
+    iterations: int
+    bucket: str
+    real_aws: bool
+    prime: bool
+    generate: bool
+    max_import_ms: Union[float, None]
+    max_first_request_ms: Union[float, None]
+
+
+def main() -> None:
+    args = parse_args()
+    runs = [run_fresh_interpreter(args) for _ in range(args.iterations)]
+
+    print(f"Cold starts: {args.iterations} fresh interpreters (milliseconds)\n")
+    print(f"{'phase':<40} {'median':>9} {'min':>9} {'max':>9}")
+    for phase in runs[0]:
+        samples = [run[phase] for run in runs]
+        print(f"{phase:<40} {statistics.median(samples):>9.1f} {min(samples):>9.1f} {max(samples):>9.1f}")
+
+    failures = check_budgets(runs, args)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+
+
+def run_fresh_interpreter(args: Args) -> Dict[str, float]:
+    """Run one cold start in a new Python process and return its timings."""
+    config = {"bucket": args.bucket, "real_aws": args.real_aws, "prime": args.prime, "generate": args.generate}
+    env: Dict[str, str] = {}
+    if not args.real_aws:
+        env.update(
+            AWS_ACCESS_KEY_ID="testing",
+            AWS_SECRET_ACCESS_KEY="testing",
+            AWS_SESSION_TOKEN="testing",
+            AWS_DEFAULT_REGION="us-east-1",
+        )
+    return run_in_fresh_interpreter(CHILD_SCRIPT, json.dumps(config), env=env)
+
+
+def check_budgets(runs: List[Dict[str, float]], args: Args) -> List[str]:
+    """Compare the median timings against the budgets and describe every budget that was exceeded."""
+    failures = []
+    if args.max_import_ms is not None:
+        median_import_ms = statistics.median(run["import"] for run in runs)
+        if median_import_ms > args.max_import_ms:
+            failures.append(f"import took {median_import_ms:.1f} ms, budget is {args.max_import_ms} ms")
+    if args.max_first_request_ms is not None:
+        for phase in runs[0]:
+            if phase.startswith("first "):
+                median_ms = statistics.median(run[phase] for run in runs)
+                if median_ms > args.max_first_request_ms:
+                    failures.append(f"{phase} took {median_ms:.1f} ms, budget is {args.max_first_request_ms} ms")
+    return failures
+
+
+def parse_args() -> Args:
+    """
+    Parse command-line arguments.
+
+    :return: Parsed command-line arguments as a NamedTuple.
+    """
+    parser = argparse.ArgumentParser(description="Measure cold starts of the Files API")
+    parser.add_argument("--iterations", type=int, default=5, help="Number of fresh interpreters to run")
+    parser.add_argument("--bucket", default="cold-start-benchmark", help="S3 bucket to use")
+    parser.add_argument("--real-aws", action="store_true", help="Use real AWS instead of mocking S3 with moto")
+    parser.add_argument("--no-prime", action="store_true", help="Skip prime_app(), like before priming existed")
+    parser.add_argument("--generate", action="store_true", help="Also measure the generate route (needs OpenAI)")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Fail if the median import is slower")
+    parser.add_argument(
+        "--max-first-request-ms",
+        type=float,
+        default=None,
+        help="Fail if the median first request to any route is slower",
+    )
+    args = parser.parse_args()
+    return Args(
+        iterations=args.iterations,
+        bucket=args.bucket,
+        real_aws=args.real_aws,
+        prime=not args.no_prime,
+        generate=args.generate,
+        max_import_ms=args.max_import_ms,
+        max_first_request_ms=args.max_first_request_ms,
+    )
+
+
+if __name__ == "__main__":
+    main()
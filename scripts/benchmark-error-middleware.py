@@ -0,0 +1,198 @@
+# pylint: disable=invalid-name
+"""
+Benchmark the overhead of the catch-all error handling middleware on requests and streamed downloads.
+
+Compares two apps that differ only in how unhandled exceptions are caught:
+
+- "http-middleware": the previous `@app.middleware("http")` function, i.e. Starlette's
+  `BaseHTTPMiddleware`, which runs the app in a separate task and relays the body through a stream.
+- "pure-asgi": `files_api.errors.BroadExceptionMiddleware`, which passes the ASGI messages through.
+
+Each app has a small JSON route, for the fixed cost per request, and a `StreamingResponse` route like
+`GET /v1/files/{file_path}`, for the download throughput. Requests are sent straight to the ASGI app,
+so no server or network is measured.
+
+Usage:
+
+    python ./scripts/benchmark-error-middleware.py --requests 2000 --size-mib 64 --chunk-kib 64
+"""
+
+import argparse
+import asyncio
+import time
+from typing import (
+    AsyncIterator,
+    Dict,
+    NamedTuple,
+)
+
+from fastapi import (
+    FastAPI,
+    Request,
+)
+from fastapi.responses import (
+    JSONResponse,
+    StreamingResponse,
+)
+from starlette.types import (
+    Message,
+    Scope,
+)
+
+from files_api.errors import BroadExceptionMiddleware
+
+
+class Args(NamedTuple):
+    """CLI arguments for the script."""
+
+    requests: int
+    size_mib: int
+    chunk_kib: int
+    repeat: int
+
+
+class Results(NamedTuple):
+    """Timings of one app."""
+
+    microseconds_per_request: float
+    download_mib_per_second: float
+
+
+async def handle_broad_exceptions(request: Request, call_next):
+    """The previous catch-all handler, registered with `@app.middleware("http")`."""
+    try:
+        return await call_next(request)
+    except Exception:  # pylint: disable=broad-except
+        return JSONResponse(status_code=500, content={"message": "An unexpected error occurred."})
+
+
+def main() -> None:
+    args = parse_args()
+    results: Dict[str, Results] = {}
+    for name, app in [
+        ("http-middleware", make_app(args, pure_asgi=False)),
+        ("pure-asgi", make_app(args, pure_asgi=True)),
+    ]:
+        results[name] = asyncio.run(benchmark(app, args))
+
+    print(
+        f"{args.requests} small requests, and downloads of {args.size_mib} MiB in {args.chunk_kib} KiB chunks, "
+        f"best of {args.repeat} runs:"
+    )
+    for name, result in results.items():
+        print(
+            f"  {name:>15}: {result.microseconds_per_request:8.1f} µs / request"
+            f"  {result.download_mib_per_second:10.1f} MiB/s downloaded"
+        )
+    before, after = results["http-middleware"], results["pure-asgi"]
+    print(
+        f"  {'speedup':>15}: {before.microseconds_per_request / after.microseconds_per_request:8.1f}x"
+        f"              {after.download_mib_per_second / before.download_mib_per_second:10.1f}x"
+    )
+
+
+def make_app(args: Args, pure_asgi: bool) -> FastAPI:
+    """Build an app with a small JSON route and a streamed download route, behind the given middleware."""
+    app = FastAPI()
+    chunk = b"x" * (args.chunk_kib * 1024)
+    num_chunks = args.size_mib * 1024 // args.chunk_kib
+
+    @app.get("/ping")
+    async def ping() -> dict:
+        return {"message": "pong"}
+
+    @app.get("/download")
+    async def download() -> StreamingResponse:
+        async def chunks() -> AsyncIterator[bytes]:
+            for _ in range(num_chunks):
+                yield chunk
+
+        return StreamingResponse(content=chunks(), media_type="application/octet-stream")
+
+    if pure_asgi:
+        app.add_middleware(BroadExceptionMiddleware)
+    else:
+        app.middleware("http")(handle_broad_exceptions)
+    return app
+
+
+async def benchmark(app: FastAPI, args: Args) -> Results:
+    """Return the best timings of ``args.repeat`` runs."""
+    # the first request builds the middleware stack
+    await send_request(app, "/ping")
+
+    best_request_seconds = min([await time_requests(app, args.requests) for _ in range(args.repeat)])
+    best_download_seconds = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        downloaded_bytes = await send_request(app, "/download")
+        best_download_seconds = min(best_download_seconds, time.perf_counter() - start)
+    assert downloaded_bytes == args.size_mib * 1024 * 1024, "the whole file must be downloaded"
+
+    return Results(
+        microseconds_per_request=best_request_seconds / args.requests * 1_000_000,
+        download_mib_per_second=args.size_mib / best_download_seconds,
+    )
+
+
+async def time_requests(app: FastAPI, num_requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(num_requests):
+        await send_request(app, "/ping")
+    return time.perf_counter() - start
+
+
+async def send_request(app: FastAPI, path: str) -> int:
+    """Send a GET request to the ASGI app, like a server would, and return the number of body bytes received."""
+    scope: Scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 12345),
+        "server": ("localhost", 80),
+    }
+    request_sent = False
+    body_size = 0
+
+    async def receive() -> Message:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # the client stays connected until the response is complete
+        await asyncio.Event().wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        nonlocal body_size
+        if message["type"] == "http.response.body":
+            body_size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return body_size
+
+
+def parse_args() -> Args:
+    """
+    Parse command-line arguments.
+
+    :return: Parsed command-line arguments as a NamedTuple.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the error handling middleware")
+    parser.add_argument("--requests", type=int, default=2000, help="Number of small requests per timed run")
+    parser.add_argument("--size-mib", type=int, default=64, help="Size of the streamed download in MiB")
+    parser.add_argument("--chunk-kib", type=int, default=64, help="Size of the chunks of the download in KiB")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed runs per app")
+    args = parser.parse_args()
+    return Args(requests=args.requests, size_mib=args.size_mib, chunk_kib=args.chunk_kib, repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# pylint: disable=invalid-name
+"""
+Benchmark the cost of serializing `GET /v1/files` responses, per 1000 listed files.
+
+Compares:
+
+- "pydantic": the previous path. A `FileMetadata` is built for every S3 object, wrapped in a
+  `GetFilesResponse`, then validated against the route's response model and serialized again,
+  which is what FastAPI does with a model returned from a route.
+- "fast-path": `files_api.serialization.serialize_get_files_response`, which turns the S3 listing
+  dicts straight into JSON bytes.
+
+Usage:
+
+    python ./scripts/benchmark-list-serialization.py --items 1000 --repeat 200
+"""
+
+import argparse
+import json
+import timeit
+from datetime import (
+    datetime,
+    timedelta,
+)
+from typing import (
+    Callable,
+    List,
+    NamedTuple,
+)
+
+from dateutil.tz import tzutc
+from pydantic import TypeAdapter
+
+from files_api.schemas import (
+    FileMetadata,
+    GetFilesResponse,
+)
+from files_api.serialization import serialize_get_files_response
+
+
+class Args(NamedTuple):
+    """CLI arguments for the script."""
+
+    items: int
+    repeat: int
+
+
+def main() -> None:
+    args = parse_args()
+    files = make_s3_listing(n_items=args.items)
+    response_adapter = TypeAdapter(GetFilesResponse)
+
+    def pydantic_path() -> bytes:
+        response = GetFilesResponse(
+            files=[
+                FileMetadata(file_path=file["Key"], last_modified=file["LastModified"], size_bytes=file["Size"])
+                for file in files
+            ],
+            next_page_token="next_page_token_value",
+        )
+        # what FastAPI does with a returned model: dump, re-validate against the response model, render
+        validated = response_adapter.validate_python(response.model_dump(exclude_unset=True))
+        content = response_adapter.dump_python(validated, mode="json", exclude_unset=True)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def fast_path() -> bytes:
+        return serialize_get_files_response(files=files, next_page_token="next_page_token_value")
+
+    assert json.loads(pydantic_path()) == json.loads(fast_path()), "both paths must produce the same JSON"
+
+    results = {
+        name: time_per_1000_items(fn, args) for name, fn in [("pydantic", pydantic_path), ("fast-path", fast_path)]
+    }
+    print(f"Serializing {args.items} files, best of {args.repeat} runs, normalized per 1000 files:")
+    for name, seconds in results.items():
+        print(f"  {name:>10}: {seconds * 1000:8.3f} ms / 1000 files")
+    print(f"  {'speedup':>10}: {results['pydantic'] / results['fast-path']:8.1f}x")
+
+
+def time_per_1000_items(fn: Callable[[], bytes], args: Args) -> float:
+    """Return the best observed time of ``fn`` in seconds, normalized to 1000 items."""
+    best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+    return best * 1000 / args.items
+
+
+def make_s3_listing(n_items: int) -> List[dict]:
+    """Build objects shaped like the `Contents` of a `list_objects_v2` response."""
+    start = datetime(2024, 1, 1, tzinfo=tzutc())
+    return [
+        {
+            "Key": f"path/to/directory/file-{i:06d}.txt",
+            "LastModified": start + timedelta(seconds=i),
+            "ETag": f'"{i:032x}"',
+            "Size": i * 7,
+            "StorageClass": "STANDARD",
+        }
+        for i in range(n_items)
+    ]
+
+
+def parse_args() -> Args:
+    """
+    Parse command-line arguments.
+
+    :return: Parsed command-line arguments as a NamedTuple.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark GET /v1/files response serialization")
+    parser.add_argument("--items", type=int, default=1000, help="Number of files per listing page")
+    parser.add_argument("--repeat", type=int, default=200, help="Number of timed runs per path")
+    args = parser.parse_args()
+    return Args(items=args.items, repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
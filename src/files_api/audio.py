@@ -0,0 +1,182 @@
+"""
+Split long texts for speech synthesis and join the synthesized pieces back into one audio file.
+
+Text-to-speech models limit the length of their input and synthesize serially, so a long narration is
+split at sentence boundaries into pieces that are synthesized concurrently. Joining the pieces depends on
+the audio format:
+
+- pcm: raw samples, concatenated as they are,
+- wav: a RIFF header followed by raw samples; the samples are concatenated under a new header,
+- mp3 and aac (ADTS): sequences of self-contained frames, concatenated after dropping the ID3 tags that
+  would otherwise end up in the middle of the stream,
+- opus: Ogg streams, which could only be chained if every piece had its own serial number; nothing
+  guarantees that of separately synthesized pieces, so, like FLAC texts, Opus texts are never split,
+- flac: a single stream with a global header, which cannot be joined without re-encoding.
+
+The pieces are joined as a stream (see `AudioJoiner`), so the joined file can be uploaded while later
+pieces are still being synthesized.
+"""
+
+import re
+import struct
+from typing import (
+    List,
+    Optional,
+    Tuple,
+)
+
+# formats whose pieces can be joined into one file without re-encoding
+JOINABLE_SPEECH_FORMATS = frozenset({"mp3", "aac", "wav", "pcm"})
+
+# the whitespace after a ., ! or ? that ends a sentence, possibly followed by a closing quote or bracket
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?])\s+|(?<=[.!?][\"')\]])\s+")
+
+ID3V2_HEADER_SIZE = 10
+ID3V1_TAG_SIZE = 128
+# the size a WAV header declares for a stream whose length is unknown when the header is written
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def split_text_into_chunks(text: str, max_chars: int) -> List[str]:
+    """
+    Split a text at sentence boundaries into chunks of at most ``max_chars`` characters.
+
+    Consecutive sentences are packed into the same chunk while they fit. A sentence longer than
+    ``max_chars`` is split between words, and a word longer than that is split anywhere.
+    """
+    chunks: List[str] = []
+    current = ""
+    for sentence in split_long_pieces(SENTENCE_BOUNDARY_PATTERN.split(text.strip()), max_chars):
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_long_pieces(pieces: List[str], max_chars: int) -> List[str]:
+    """Split the pieces longer than ``max_chars`` between words, or anywhere if a single word is too long."""
+    result: List[str] = []
+    for piece in pieces:
+        piece = piece.strip()
+        if len(piece) <= max_chars:
+            if piece:
+                result.append(piece)
+            continue
+        current = ""
+        for word in piece.split():
+            while len(word) > max_chars:
+                if current:
+                    result.append(current)
+                    current = ""
+                result.append(word[:max_chars])
+                word = word[max_chars:]
+            if current and len(current) + 1 + len(word) > max_chars:
+                result.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        if current:
+            result.append(current)
+    return result
+
+
+class AudioJoiner:
+    """
+    Join audio files of the same format, synthesized from consecutive pieces of a text, into one stream.
+
+    The files are added one at a time, in order, and each one returns the bytes it adds to the stream. The
+    length of a joined WAV stream is unknown when its header is written, so the header declares placeholder
+    sizes, like the WAV streams OpenAI sends.
+
+    :param response_format: The format of the audio files, one of `JOINABLE_SPEECH_FORMATS`.
+
+    :raises ValueError: If files of this format cannot be joined.
+    """
+
+    def __init__(self, response_format: str):
+        if response_format not in JOINABLE_SPEECH_FORMATS:
+            raise ValueError(f"Audio in the {response_format!r} format cannot be joined without re-encoding it")
+        self.response_format = response_format
+        self._num_files = 0
+        self._wav_fmt_chunk: Optional[bytes] = None
+
+    def add(self, audio_file: bytes) -> bytes:
+        """Add the next audio file, and return the bytes that continue the joined stream."""
+        is_first = self._num_files == 0
+        self._num_files += 1
+        if self.response_format == "wav":
+            return self._add_wav_file(audio_file)
+        if self.response_format in {"mp3", "aac"} and not is_first:
+            return strip_id3_tags(audio_file)
+        return audio_file
+
+    def _add_wav_file(self, wav_file: bytes) -> bytes:
+        fmt_chunk, samples = parse_wav_file(wav_file)
+        if self._wav_fmt_chunk is None:
+            self._wav_fmt_chunk = fmt_chunk
+            return build_wav_header(fmt_chunk, data_size=WAV_UNKNOWN_SIZE) + samples
+        if fmt_chunk != self._wav_fmt_chunk:
+            raise ValueError("WAV files with different sample formats cannot be joined")
+        return samples
+
+
+def strip_id3_tags(audio: bytes) -> bytes:
+    """Remove a leading ID3v2 tag and a trailing ID3v1 tag from an MP3 (or ADTS) stream."""
+    if audio[:3] == b"ID3" and len(audio) >= ID3V2_HEADER_SIZE:
+        # the tag size is a 28-bit "synchsafe" integer: 7 bits per byte
+        size = 0
+        for byte in audio[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        footer_size = ID3V2_HEADER_SIZE if audio[5] & 0x10 else 0
+        tag_end = ID3V2_HEADER_SIZE + size + footer_size
+        audio = audio[tag_end:]
+    if len(audio) >= ID3V1_TAG_SIZE and audio[-ID3V1_TAG_SIZE:][:3] == b"TAG":
+        audio = audio[:-ID3V1_TAG_SIZE]
+    return audio
+
+
+def build_wav_header(fmt_chunk: bytes, data_size: int) -> bytes:
+    """Build everything a WAV file holds before its ``data_size`` bytes of samples, with ``fmt_chunk`` as format."""
+    riff_size = WAV_UNKNOWN_SIZE if data_size == WAV_UNKNOWN_SIZE else 4 + (8 + len(fmt_chunk)) + (8 + data_size)
+    return b"".join(
+        [
+            b"RIFF",
+            struct.pack("<I", riff_size),
+            b"WAVE",
+            b"fmt ",
+            struct.pack("<I", len(fmt_chunk)),
+            fmt_chunk,
+            b"data",
+            struct.pack("<I", data_size),
+        ]
+    )
+
+
+def parse_wav_file(wav_file: bytes) -> Tuple[bytes, bytes]:
+    """
+    Return the contents of the ``fmt `` and ``data`` chunks of a WAV file.
+
+    Streamed WAV files may declare placeholder sizes (e.g. 0xFFFFFFFF) because their length was unknown when
+    the header was written, so a ``data`` chunk simply extends to the end of the file if it claims more.
+    """
+    if wav_file[:4] != b"RIFF" or wav_file[8:12] != b"WAVE":
+        raise ValueError("Not a WAV file")
+    fmt_chunk = b""
+    position = 12
+    while position + 8 <= len(wav_file):
+        body_start = position + 8
+        chunk_header = wav_file[position:body_start]
+        chunk_id = chunk_header[:4]
+        (chunk_size,) = struct.unpack("<I", chunk_header[4:])
+        body_end = min(body_start + chunk_size, len(wav_file))
+        if chunk_id == b"data":
+            return fmt_chunk, wav_file[body_start:body_end]
+        if chunk_id == b"fmt ":
+            fmt_chunk = wav_file[body_start:body_end]
+        # chunks are padded to an even number of bytes
+        position = body_start + chunk_size + (chunk_size % 2)
+    raise ValueError("WAV file without a data chunk")
@@ -1,13 +1,56 @@
 """
 AWS Lambda handler using Mangum as an ASGI adapter for the FastAPI application.
 
+The same handler consumes the SQS queue of generation jobs (see `files_api.jobs.SQSJobQueue`), when the
+function is the target of its event source mapping.
+
 Repository: https://github.com/jordaneremieff/mangum
 """
 
+import asyncio
+from typing import Any
+
 from mangum import Mangum
 
+from files_api.jobs import SQSJobQueue
 from files_api.main import create_app
+from files_api.metrics import (
+    flush_metrics_as_emf,
+    get_app_caches,
+)
+from files_api.priming import prime_app
 
 APP = create_app()
 
-handler = Mangum(APP)
+# runs in the Lambda init phase, so the first invocation finds warm clients and connections
+PRIMING_TIMINGS = prime_app(APP)
+
+# Mangum would run the lifespan (and so close the shared clients) around every invocation;
+# an execution environment is frozen between invocations, not shut down, so the clients stay open
+MANGUM_HANDLER = Mangum(APP, lifespan="off")
+
+
+def handler(event: dict, context: Any) -> dict:
+    """Handle an invocation, then print the metrics it changed as CloudWatch Embedded Metric Format log lines."""
+    try:
+        if is_sqs_event(event):
+            return handle_generation_jobs(event)
+        return MANGUM_HANDLER(event, context)
+    finally:
+        if APP.state.settings.metrics_enabled:
+            flush_metrics_as_emf(namespace=APP.state.settings.metrics_namespace, caches=get_app_caches(APP))
+
+
+def is_sqs_event(event: dict) -> bool:
+    """Whether the invocation delivers messages of an SQS event source mapping."""
+    records = event.get("Records") or [{}]
+    return records[0].get("eventSource") == "aws:sqs"
+
+
+def handle_generation_jobs(event: dict) -> dict:
+    """Run the generation jobs delivered by the SQS event source mapping of the job queue."""
+    job_queue = APP.state.generation_job_queue
+    if not isinstance(job_queue, SQSJobQueue):
+        raise RuntimeError("Received SQS messages, but GENERATION_JOB_QUEUE_URL is not set")
+    # the loop Mangum runs the app on, so the jobs reuse the connections of the shared clients
+    return asyncio.get_event_loop().run_until_complete(job_queue.process_sqs_event(event))
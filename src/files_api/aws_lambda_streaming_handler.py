@@ -0,0 +1,302 @@
+"""
+AWS Lambda entry point that streams responses to the client instead of buffering them.
+
+`aws_lambda_handler.handler` (Mangum) collects the whole response, base64-encodes it and returns it as one
+payload, so a large download is held in memory (several times over), nothing reaches the client until the
+last byte was read from S3, and files beyond the payload limit fail. This entry point uses Lambda response
+streaming behind a Lambda Function URL (``InvokeMode: RESPONSE_STREAM``) instead: every body chunk the app
+sends is forwarded to the client as soon as it is produced.
+
+The managed Python runtime has no streaming API, so this module implements the (small) Lambda Runtime API
+loop itself and is meant to run as a custom runtime, e.g. with a ``bootstrap`` file containing::
+
+    #!/bin/sh
+    exec python -m files_api.aws_lambda_streaming_handler
+
+(On the ``python3.12`` managed runtime, the same script can be used as ``AWS_LAMBDA_EXEC_WRAPPER``.)
+
+The pieces are separated so they can be tested without Lambda:
+
+- `build_asgi_scope` turns a Function URL event (payload format 2.0) into an ASGI HTTP scope,
+- `stream_asgi_response` runs the app and writes the streamed HTTP integration response to any writer,
+- `handle_next_invocation` speaks the Runtime API, so it can be pointed at a simulated Runtime API. It
+  reports invocations that fail before their response started to the Runtime API's ``/error`` endpoint.
+
+Docs: https://docs.aws.amazon.com/lambda/latest/dg/runtimes-custom.html#runtimes-custom-response-streaming
+"""
+
+import asyncio
+import base64
+import http.client
+import json
+import logging
+import os
+import queue
+import threading
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+from urllib.parse import unquote
+
+from fastapi import FastAPI
+from starlette.types import Message
+
+from files_api.metrics import (
+    flush_metrics_as_emf,
+    get_app_caches,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+RUNTIME_API_VERSION = "2018-06-01"
+HTTP_INTEGRATION_RESPONSE_CONTENT_TYPE = "application/vnd.awslambda.http-integration-response"
+# separates the JSON prelude (status code, headers, cookies) from the body in a streamed HTTP integration response
+PRELUDE_DELIMITER = b"\x00" * 8
+# number of body chunks buffered between the app and the Runtime API before the app is slowed down
+MAX_BUFFERED_CHUNKS = 16
+
+Writer = Callable[[bytes], Awaitable[None]]
+
+
+def build_asgi_scope(event: dict) -> dict:
+    """Build an ASGI HTTP scope from a Lambda Function URL event (payload format version 2.0)."""
+    http_context = event["requestContext"]["http"]
+    headers = [(key.lower().encode("latin-1"), value.encode("latin-1")) for key, value in event["headers"].items()]
+    if event.get("cookies"):
+        headers.append((b"cookie", "; ".join(event["cookies"]).encode("latin-1")))
+    raw_path = event.get("rawPath") or http_context["path"]
+    server_name = event["headers"].get("host", "lambda")
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": http_context["method"],
+        "scheme": event["headers"].get("x-forwarded-proto", "https"),
+        "path": unquote(raw_path),
+        "raw_path": raw_path.encode("utf-8"),
+        "root_path": "",
+        "query_string": event.get("rawQueryString", "").encode("utf-8"),
+        "headers": headers,
+        "client": (http_context.get("sourceIp", ""), 0),
+        "server": (server_name, int(event["headers"].get("x-forwarded-port", 443))),
+    }
+
+
+def get_request_body(event: dict) -> bytes:
+    """Return the request body of a Lambda Function URL event as bytes."""
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        return base64.b64decode(body)
+    return body.encode("utf-8")
+
+
+def build_prelude(status_code: int, raw_headers: List[List[bytes]]) -> bytes:
+    """Build the JSON prelude (followed by its delimiter) of a streamed HTTP integration response."""
+    headers: Dict[str, str] = {}
+    cookies: List[str] = []
+    for raw_key, raw_value in raw_headers:
+        key, value = raw_key.decode("latin-1").lower(), raw_value.decode("latin-1")
+        if key == "set-cookie":
+            cookies.append(value)
+        else:
+            headers[key] = f"{headers[key]},{value}" if key in headers else value
+    prelude = {"statusCode": status_code, "headers": headers, "cookies": cookies}
+    return json.dumps(prelude).encode("utf-8") + PRELUDE_DELIMITER
+
+
+async def stream_asgi_response(app: FastAPI, event: dict, write: Writer) -> None:
+    """
+    Run the app for a Function URL event and write the response as a streamed HTTP integration response.
+
+    The prelude is written as soon as the app starts its response, and every body chunk as soon as the app
+    sends it, so the client starts receiving bytes before the app has finished producing them.
+
+    :param app: The ASGI app to run.
+    :param event: A Lambda Function URL event (payload format version 2.0).
+    :param write: Coroutine function called with each piece of the streamed response, in order.
+    """
+    request_body = get_request_body(event)
+    request_body_sent = False
+    response_complete = asyncio.Event()
+
+    async def receive() -> Message:
+        nonlocal request_body_sent
+        if not request_body_sent:
+            request_body_sent = True
+            return {"type": "http.request", "body": request_body, "more_body": False}
+        # the whole request was delivered; wait until the response is done, then report the disconnect
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            await write(build_prelude(message["status"], message.get("headers", [])))
+        elif message["type"] == "http.response.body":
+            if message.get("body"):
+                await write(message["body"])
+            if not message.get("more_body", False):
+                response_complete.set()
+
+    try:
+        await app(build_asgi_scope(event), receive, send)
+    finally:
+        response_complete.set()
+
+
+def handle_next_invocation(app: FastAPI, loop: asyncio.AbstractEventLoop, runtime_api: str) -> None:
+    """
+    Fetch the next invocation from the Lambda Runtime API and stream the app's response back to it.
+
+    An invocation that fails before the app started its response is reported to the Runtime API as an error,
+    so Lambda answers with an error instead of an empty or invalid streamed response. Once the response
+    started streaming, a failure can only cut it short; it is logged.
+
+    :param app: The ASGI app to run.
+    :param loop: A running event loop, shared by all invocations so that async clients created by the app
+        stay bound to a live loop.
+    :param runtime_api: ``host:port`` of the Runtime API, i.e. the ``AWS_LAMBDA_RUNTIME_API`` variable.
+    """
+    connection = http.client.HTTPConnection(runtime_api)
+    try:
+        connection.request("GET", f"/{RUNTIME_API_VERSION}/runtime/invocation/next")
+        next_response = connection.getresponse()
+        request_id = next_response.getheader("Lambda-Runtime-Aws-Request-Id")
+        next_body = next_response.read()
+        try:
+            stream_invocation_response(app, loop, connection, request_id, event=json.loads(next_body))
+        except Exception as err:  # pylint: disable=broad-except
+            # the Lambda runtime contract: every invocation ends with a response or an error, never neither
+            LOGGER.exception("Invocation %s failed", request_id)
+            report_invocation_error(runtime_api, request_id, err)
+    finally:
+        connection.close()
+
+    if app.state.settings.metrics_enabled:
+        flush_metrics_as_emf(namespace=app.state.settings.metrics_namespace, caches=get_app_caches(app))
+
+
+def stream_invocation_response(
+    app: FastAPI,
+    loop: asyncio.AbstractEventLoop,
+    connection: http.client.HTTPConnection,
+    request_id: str,
+    event: dict,
+) -> None:
+    """
+    Run the app for an invocation and upload its response to the Runtime API as it is produced.
+
+    The app runs on ``loop`` (in another thread) while this thread uploads the chunks it produces, so the
+    request to the Runtime API is a chunked upload that lasts as long as the app keeps sending. The upload
+    only starts once the app sent the prelude of its response.
+
+    :raises Exception: The app's error if it failed before starting its response, or the upload's error.
+    """
+    chunks: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=MAX_BUFFERED_CHUNKS)
+    # set when the upload failed: nothing consumes the chunks anymore, so the app must stop producing them
+    upload_failed = threading.Event()
+
+    async def write(chunk: bytes) -> None:
+        if upload_failed.is_set():
+            raise ConnectionError(f"The response stream of invocation {request_id} was closed")
+        # a blocking put (off the event loop) applies backpressure when the client reads slower than S3
+        await asyncio.get_running_loop().run_in_executor(None, chunks.put, chunk)
+
+    async def produce() -> None:
+        try:
+            await stream_asgi_response(app, event, write)
+        finally:
+            if not upload_failed.is_set():
+                await asyncio.get_running_loop().run_in_executor(None, chunks.put, None)
+
+    future = asyncio.run_coroutine_threadsafe(produce(), loop)
+
+    prelude = chunks.get()
+    if prelude is None:
+        # the app finished without starting a response, so there is nothing to stream: fail the invocation
+        future.result()
+        raise RuntimeError("The app did not send a response")
+
+    def iter_chunks() -> Iterator[bytes]:
+        yield prelude
+        while (chunk := chunks.get()) is not None:
+            yield chunk
+
+    try:
+        connection.request(
+            "POST",
+            f"/{RUNTIME_API_VERSION}/runtime/invocation/{request_id}/response",
+            body=iter_chunks(),
+            headers={
+                "Lambda-Runtime-Function-Response-Mode": "streaming",
+                "Content-Type": HTTP_INTEGRATION_RESPONSE_CONTENT_TYPE,
+                "Transfer-Encoding": "chunked",
+            },
+            encode_chunked=True,
+        )
+        connection.getresponse().read()
+    except Exception:
+        # stop the app, and unblock a put it may be waiting in, since the queue is no longer consumed
+        upload_failed.set()
+        future.cancel()
+        drain_queue(chunks)
+        raise
+
+    # surfaces errors raised by the app after the response was already (partially) streamed
+    error = future.exception()
+    if error is not None:
+        LOGGER.error("Invocation %s failed while streaming its response", request_id, exc_info=error)
+
+
+def drain_queue(chunks: "queue.Queue[Optional[bytes]]") -> None:
+    """Remove every item from a queue without waiting."""
+    try:
+        while True:
+            chunks.get_nowait()
+    except queue.Empty:
+        pass
+
+
+def report_invocation_error(runtime_api: str, request_id: str, error: BaseException) -> None:
+    """Report a failed invocation to the Runtime API, which then fails the request (e.g. with a 502)."""
+    body = json.dumps({"errorMessage": str(error), "errorType": type(error).__name__, "stackTrace": []})
+    connection = http.client.HTTPConnection(runtime_api)
+    try:
+        connection.request(
+            "POST",
+            f"/{RUNTIME_API_VERSION}/runtime/invocation/{request_id}/error",
+            body=body.encode("utf-8"),
+            headers={"Lambda-Runtime-Function-Error-Type": "Unhandled", "Content-Type": "application/json"},
+        )
+        connection.getresponse().read()
+    except (OSError, http.client.HTTPException):
+        # e.g. the invocation already has a (partial) response; Lambda times it out or fails it on its own
+        LOGGER.exception("Could not report the failure of invocation %s", request_id)
+    finally:
+        connection.close()
+
+
+def run_forever(app: FastAPI, runtime_api: Optional[str] = None) -> None:
+    """Serve invocations from the Lambda Runtime API until the execution environment is shut down."""
+    runtime_api = runtime_api or os.environ["AWS_LAMBDA_RUNTIME_API"]
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="asgi-event-loop", daemon=True).start()
+    while True:
+        try:
+            handle_next_invocation(app, loop=loop, runtime_api=runtime_api)
+        except Exception:  # pylint: disable=broad-except
+            # e.g. the Runtime API dropped the connection while handing out an invocation; keep serving
+            LOGGER.exception("Could not handle the next invocation")
+
+
+if __name__ == "__main__":
+    from files_api.main import create_app
+    from files_api.priming import prime_app
+
+    APP = create_app()
+    prime_app(APP)
+    run_forever(APP)
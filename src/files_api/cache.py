@@ -0,0 +1,76 @@
+"""A small in-process cache with per-entry expiry and LRU eviction."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Generic,
+    Hashable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+ValueT = TypeVar("ValueT")
+
+
+class TTLCache(Generic[ValueT]):
+    """
+    Thread-safe mapping whose entries expire ``ttl_seconds`` after they were set.
+
+    When full, the least recently used entry is evicted. The cache lives in the memory of a single
+    process (or Lambda execution environment), so it is a latency optimization, never a source of truth.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        # bumped by every `clear()`, so values computed from data read before a clear can be discarded
+        self.generation = 0
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[ValueT]:
+        """Return the value stored for ``key``, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: ValueT, generation: Optional[int] = None) -> None:
+        """
+        Store ``value`` for ``key``, evicting the least recently used entry if the cache is full.
+
+        :param generation: If given, the ``generation`` read before ``value`` was computed. The value is
+            dropped if the cache was cleared since, as it may be stale.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
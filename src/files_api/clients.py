@@ -0,0 +1,143 @@
+"""
+Long-lived clients shared by every request an app serves.
+
+Creating a boto3 client loads and parses the S3 service model and resolves credentials, and every new
+client (boto3, OpenAI or httpx) starts with an empty connection pool, so each request that built its own paid
+for DNS lookups and TCP/TLS handshakes again. The clients here are created once per app, stored on
+``app.state``, and reused by all requests (boto3 clients are thread-safe, so background threads can use
+them too).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Optional,
+)
+
+import boto3
+from botocore.config import Config
+from fastapi import FastAPI
+
+from files_api.settings import Settings
+from files_api.tracing import inject_traceparent
+
+try:
+    from mypy_boto3_s3 import S3Client
+except ImportError:
+    ...
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI
+
+
+def get_shared_s3_client(app: FastAPI) -> "S3Client":
+    """Return the app's S3 client, creating it on first use."""
+    s3_client = getattr(app.state, "s3_client", None)
+    if s3_client is None:
+        settings: Settings = app.state.settings
+        s3_client = boto3.client(
+            "s3",
+            config=Config(max_pool_connections=settings.s3_max_pool_connections, tcp_keepalive=True),
+        )
+        app.state.s3_client = s3_client
+    return s3_client
+
+
+def get_shared_openai_client(app: FastAPI) -> "AsyncOpenAI":
+    """
+    Return the app's OpenAI client, creating it on first use.
+
+    Servers create it in the app's lifespan; on AWS Lambda, where the lifespan does not run, the first
+    generation (or priming) does.
+    """
+    openai_client = getattr(app.state, "openai_client", None)
+    if openai_client is None:
+        openai_client = create_openai_client(settings=app.state.settings)
+        app.state.openai_client = openai_client
+    return openai_client
+
+
+def create_openai_client(settings: Settings) -> "AsyncOpenAI":
+    """Create an OpenAI client whose connection pool, timeouts and retries are tuned by ``settings``."""
+    # imported here, since importing `openai` takes hundreds of milliseconds (see `files_api.generate`);
+    # the OpenAI client is built on `httpx2`, not `httpx`, so its limits must be `httpx2.Limits` too
+    import httpx2  # pylint: disable=import-outside-toplevel
+    from openai import (  # pylint: disable=import-outside-toplevel
+        AsyncOpenAI,
+        DefaultAsyncHttpxClient,
+        Timeout,
+    )
+
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx2.Limits(
+            max_connections=settings.openai_max_connections,
+            max_keepalive_connections=settings.openai_max_keepalive_connections,
+            keepalive_expiry=settings.openai_keepalive_expiry_seconds,
+        ),
+        http2=settings.openai_http2,
+        event_hooks={"request": [inject_traceparent]},
+    )
+    # base_url and api_key default to the OPENAI_BASE_URL and OPENAI_API_KEY environment variables
+    return AsyncOpenAI(
+        http_client=http_client,
+        timeout=Timeout(settings.openai_timeout_seconds, connect=settings.openai_connect_timeout_seconds),
+        max_retries=settings.openai_max_retries,
+    )
+
+
+def get_shared_http_client(app: FastAPI) -> "httpx.AsyncClient":
+    """Return the app's async HTTP client for calls to third-party URLs, creating it on first use."""
+    http_client = getattr(app.state, "http_client", None)
+    if http_client is None:
+        import httpx  # pylint: disable=import-outside-toplevel
+
+        settings: Settings = app.state.settings
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_connections,
+            ),
+            timeout=httpx.Timeout(
+                settings.http_read_timeout_seconds,
+                connect=settings.http_connect_timeout_seconds,
+            ),
+            follow_redirects=True,
+            event_hooks={"request": [inject_traceparent]},
+        )
+        app.state.http_client = http_client
+    return http_client
+
+
+def get_shared_image_process_pool(app: FastAPI) -> Optional[ProcessPoolExecutor]:
+    """
+    Return the app's pool of processes post-processing images, creating it on first use.
+
+    Returns None if images are to be processed in a worker thread (``image_processing_workers`` is 0).
+    """
+    settings: Settings = app.state.settings
+    if settings.image_processing_workers <= 0:
+        return None
+    image_process_pool = getattr(app.state, "image_process_pool", None)
+    if image_process_pool is None:
+        image_process_pool = ProcessPoolExecutor(max_workers=settings.image_processing_workers)
+        app.state.image_process_pool = image_process_pool
+    return image_process_pool
+
+
+async def close_shared_clients(app: FastAPI) -> None:
+    """Close the app's async clients (and process pool) that were created, releasing their resources."""
+    http_client = getattr(app.state, "http_client", None)
+    if http_client is not None:
+        app.state.http_client = None
+        await http_client.aclose()
+
+    openai_client = getattr(app.state, "openai_client", None)
+    if openai_client is not None:
+        app.state.openai_client = None
+        await openai_client.close()
+
+    image_process_pool = getattr(app.state, "image_process_pool", None)
+    if image_process_pool is not None:
+        app.state.image_process_pool = None
+        image_process_pool.shutdown(wait=False, cancel_futures=True)
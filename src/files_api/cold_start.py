@@ -0,0 +1,32 @@
+"""
+Measure cold starts: run Python code in a fresh interpreter, like a new Lambda execution environment.
+
+Shared by the cold-start tests and ``scripts/benchmark-cold-start.py``; the app itself never imports it.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from typing import (
+    Mapping,
+    Optional,
+)
+
+
+def run_in_fresh_interpreter(script: str, *args: str, env: Optional[Mapping[str, str]] = None) -> dict:
+    """
+    Run a Python script in a new Python process and return the JSON object it printed last.
+
+    :param script: Source of the script, which prints its results as a JSON object on its last line.
+    :param args: Command-line arguments passed to the script (``sys.argv[1:]``).
+    :param env: Environment variables to set on top of the current environment.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        env={**os.environ, **(env or {})},
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
@@ -8,22 +8,57 @@ from fastapi import (
     status,
 )
 from fastapi.responses import JSONResponse
+from starlette.types import (
+    ASGIApp,
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+
+class BroadExceptionMiddleware:
+    """
+    Handle any exception that goes unhandled by a more specific exception handler.
+
+    A pure ASGI middleware: unlike `@app.middleware("http")`, which runs the app in a separate task and
+    relays every body chunk through an in-memory stream, it passes the messages of the response through as
+    they are, so streamed downloads pay nothing for it.
+
+    Docs: https://www.starlette.io/middleware/#pure-asgi-middleware
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
 
+        async def send_and_track_response_start(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
 
-# Fast API Docs on Middleware: https://fastapi.tiangolo.com/tutorial/middleware/
-async def handle_broad_exceptions(request: Request, call_next):
-    """Handle any exception that goes unhandled by a more specific exception handler."""
-    try:
-        return await call_next(request)
-    except Exception:  # pylint: disable=broad-except
-        traceback.print_exc()
-        return JSONResponse(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content={
-                "message": "An unexpected error occurred.",
-                "detail": "Internal Server Error",
-            },
-        )
+        try:
+            await self.app(scope, receive, send_and_track_response_start)
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc()
+            if response_started:
+                # part of the response was sent already, so the server can only abort it
+                raise
+            response = JSONResponse(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                content={
+                    "message": "An unexpected error occurred.",
+                    "detail": "Internal Server Error",
+                },
+            )
+            await response(scope, receive, send)
 
 
 # Fast API Docs on Error Handlers:
@@ -1,18 +1,53 @@
+import base64
 import os
+from contextlib import (
+    AsyncExitStack,
+    asynccontextmanager,
+)
 from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Final,
     Literal,
     Optional,
     Tuple,
     Union,
 )
 
-from openai import AsyncOpenAI
-from openai.types.chat import ChatCompletion
+from files_api.timing import (
+    measure,
+    timed,
+)
+from files_api.tracing import (
+    start_span,
+    traced,
+)
+
+# `openai` takes hundreds of milliseconds to import, so it is only imported once a file is generated.
+# Requests that never generate anything (most of them) should not pay for it on a Lambda cold start.
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from openai.types.chat import ChatCompletion
 
 SYSTEM_PROMPT = "You are an autocompletion tool that produces text files given constraints."
 
+TEXT_MODEL = "gpt-3.5-turbo"
+TEXT_MAX_TOKENS = 100  # avoid burning your credits
+IMAGE_MODEL = "dall-e-3"
+# Final, so that they keep the literal types the OpenAI client accepts for these parameters
+IMAGE_SIZE: Final = "1024x1024"
+IMAGE_QUALITY: Final = "standard"
+TEXT_TO_SPEECH_MODEL = "tts-1"
+TEXT_TO_SPEECH_VOICE = "echo"
+
+ImageResponseFormat = Literal["url", "b64_json"]
+SpeechResponseFormat = Literal["mp3", "opus", "aac", "flac", "wav", "pcm"]
+SPEECH_CHUNK_SIZE_BYTES = 64 * 1024
+
+
+def get_openai_client() -> "AsyncOpenAI":
+    from openai import AsyncOpenAI  # pylint: disable=import-outside-toplevel
 
-def get_openai_client() -> AsyncOpenAI:
     # point to a local mock of OpenAI, se these env vars in your .env file while testing
     # base_url="http://localhost:1080", api_key="mocked_key"
     base_url = os.getenv("OPENAI_BASE_URL")
@@ -22,46 +57,114 @@ def get_openai_client() -> AsyncOpenAI:
     return client
 
 
-async def get_text_chat_completion(prompt: str, openai_client: Optional[AsyncOpenAI] = None) -> str:
+@traced("openai.chat_completion", size_of_result=len, model=TEXT_MODEL)
+@timed("openai-text", model=TEXT_MODEL)
+async def get_text_chat_completion(prompt: str, openai_client: Optional["AsyncOpenAI"] = None) -> str:
     """Generate a text chat completion from a given prompt."""
     # get the OpenAI client
     client = openai_client or get_openai_client()
 
     # get the completion
-    response: ChatCompletion = await client.chat.completions.create(
-        model="gpt-3.5-turbo",
+    response: "ChatCompletion" = await client.chat.completions.create(
+        model=TEXT_MODEL,
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
-        max_tokens=100,  # avoid burning your credits
+        max_tokens=TEXT_MAX_TOKENS,
         n=1,  # number of responses
     )
 
     return response.choices[0].message.content or ""
 
 
-async def generate_image(prompt: str, openai_client: Optional[AsyncOpenAI] = None) -> Union[str, None]:
-    """Generate an image from a given prompt."""
+def estimate_chat_completion_tokens(prompt: str) -> int:
+    """
+    Estimate the tokens a chat completion counts against the rate limit: its prompt, and its maximum output.
+
+    A token is about 4 characters of English text, which is what OpenAI's rate limiter assumes too.
+    """
+    return (len(SYSTEM_PROMPT) + len(prompt)) // 4 + TEXT_MAX_TOKENS
+
+
+async def stream_text_chat_completion(
+    prompt: str, openai_client: Optional["AsyncOpenAI"] = None
+) -> AsyncIterator[str]:
+    """Generate a text chat completion from a given prompt, yielding its text as it is produced."""
+    # get the OpenAI client
+    client = openai_client or get_openai_client()
+
+    # get the completion, as a stream of chunks (timed until the stream starts)
+    with measure("openai-text", model=TEXT_MODEL), start_span(
+        "openai.chat_completion", model=TEXT_MODEL, prompt_chars=len(prompt), stream=True
+    ):
+        stream = await client.chat.completions.create(
+            model=TEXT_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=TEXT_MAX_TOKENS,
+            n=1,  # number of responses
+            stream=True,
+        )
+
+    async with stream:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+@traced("openai.image", model=IMAGE_MODEL)
+@timed("openai-image", model=IMAGE_MODEL)
+async def generate_image(
+    prompt: str,
+    openai_client: Optional["AsyncOpenAI"] = None,
+    response_format: ImageResponseFormat = "url",
+) -> Union[str, None]:
+    """
+    Generate an image from a given prompt.
+
+    Returns the URL of the image, or the base64-encoded image itself if ``response_format`` is "b64_json".
+    """
     # get the OpenAI client
     client = openai_client or get_openai_client()
 
     # get image response from OpenAI
     image_response = await client.images.generate(
-        model="dall-e-3",
+        model=IMAGE_MODEL,
         prompt=prompt,
-        size="1024x1024",
-        quality="standard",
+        size=IMAGE_SIZE,
+        quality=IMAGE_QUALITY,
         n=1,
+        response_format=response_format,
     )
 
+    if response_format == "b64_json":
+        return image_response.data[0].b64_json or None
     return image_response.data[0].url or None
 
 
+async def aiter_base64_decoded(b64_data: str, chunk_size_bytes: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    """
+    Decode base64 data chunk by chunk, so the decoded bytes never have to exist as one more full-size copy.
+
+    :param b64_data: The base64-encoded data, e.g. the `b64_json` of a generated image.
+    :param chunk_size_bytes: Approximate size of the decoded chunks.
+    """
+    # 4 base64 characters encode 3 bytes, so slices that are a multiple of 4 characters decode independently
+    b64_chunk_size = max(chunk_size_bytes // 3, 1) * 4
+    for start in range(0, len(b64_data), b64_chunk_size):
+        end = start + b64_chunk_size
+        yield base64.b64decode(b64_data[start:end])
+
+
+@traced("openai.speech", size_of_result=lambda result: len(result[0]), model=TEXT_TO_SPEECH_MODEL)
+@timed("openai-speech", model=TEXT_TO_SPEECH_MODEL)
 async def generate_text_to_speech(
     prompt: str,
-    openai_client: Optional[AsyncOpenAI] = None,
-    response_format: Literal["mp3", "opus", "aac", "flac", "wav", "pcm"] = "mp3",
+    openai_client: Optional["AsyncOpenAI"] = None,
+    response_format: SpeechResponseFormat = "mp3",
 ) -> Tuple[bytes, str]:
     """
     Generate text-to-speech audio from a given prompt.
@@ -73,8 +176,8 @@ async def generate_text_to_speech(
 
     # get audio response from OpenAI
     audio_response = await client.audio.speech.with_raw_response.create(
-        model="tts-1",
-        voice="echo",
+        model=TEXT_TO_SPEECH_MODEL,
+        voice=TEXT_TO_SPEECH_VOICE,
         input=prompt,
         response_format=response_format,
     )
@@ -84,3 +187,35 @@ async def generate_text_to_speech(
     file_mime_type: str = audio_response.headers.get("Content-Type")
 
     return file_content_bytes, file_mime_type
+
+
+@asynccontextmanager
+async def stream_text_to_speech(
+    prompt: str,
+    openai_client: Optional["AsyncOpenAI"] = None,
+    response_format: SpeechResponseFormat = "mp3",
+) -> AsyncIterator[Tuple[AsyncIterator[bytes], str]]:
+    """
+    Generate text-to-speech audio from a given prompt, reading the audio as it arrives.
+
+    Yields an async iterator over the audio's chunks and the MIME type as a string. The audio has to be
+    consumed before the context exits, which closes the HTTP response.
+    """
+    # get the OpenAI client
+    client = openai_client or get_openai_client()
+
+    # get audio response from OpenAI, without reading its body yet (timed until the response starts)
+    async with AsyncExitStack() as stack:
+        with measure("openai-speech", model=TEXT_TO_SPEECH_MODEL), start_span(
+            "openai.speech", model=TEXT_TO_SPEECH_MODEL, prompt_chars=len(prompt), stream=True
+        ):
+            audio_response = await stack.enter_async_context(
+                client.audio.speech.with_streaming_response.create(
+                    model=TEXT_TO_SPEECH_MODEL,
+                    voice=TEXT_TO_SPEECH_VOICE,
+                    input=prompt,
+                    response_format=response_format,
+                )
+            )
+        file_mime_type = audio_response.headers.get("Content-Type", "application/octet-stream")
+        yield audio_response.iter_bytes(chunk_size=SPEECH_CHUNK_SIZE_BYTES), file_mime_type
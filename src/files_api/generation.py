@@ -0,0 +1,653 @@
+"""
+Generate files with OpenAI and store them in S3.
+
+Generating a file takes seconds and costs money, while the same (templated) prompts are requested again and
+again. So every generated file is remembered in a generation cache: a pointer from a hash of everything that
+determines the output (file type, prompt, models, voice, size, file extension) to the S3 object holding it.
+A repeated request is then served with a server-side `copy_object` of that object to the new path instead of
+calling OpenAI again. The copy is conditional on the object's ETag, so a pointer to an object that was since
+overwritten or deleted is dropped and the file is generated anew.
+"""
+
+import asyncio
+import base64
+import contextvars
+import hashlib
+import json
+import logging
+import mimetypes
+import posixpath
+from collections import deque
+from functools import partial
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from botocore.exceptions import ClientError
+from fastapi import FastAPI
+
+from files_api import (
+    audio,
+    generate,
+    images,
+)
+from files_api.cache import TTLCache
+from files_api.clients import (
+    get_shared_http_client,
+    get_shared_image_process_pool,
+    get_shared_openai_client,
+    get_shared_s3_client,
+)
+from files_api.openai_scheduler import OpenAIScheduler
+from files_api.s3.read_objects import (
+    aiter_s3_object_body,
+    fetch_s3_object,
+)
+from files_api.s3.write_objects import (
+    copy_s3_object,
+    upload_s3_object,
+    upload_s3_object_from_async_stream,
+)
+from files_api.schemas import (
+    BulkGenerationItemResult,
+    GeneratedFileType,
+    GenerateFilesQueryParams,
+    GenerationJobStatus,
+)
+from files_api.settings import Settings
+from files_api.timing import measure
+
+try:
+    from mypy_boto3_s3 import S3Client
+except ImportError:
+    ...
+
+LOGGER = logging.getLogger(__name__)
+
+# number of audio chunks buffered for a client that plays the audio while it is generated
+TEE_BUFFER_CHUNKS = 16
+TEE_CLIENT_TIMEOUT_SECONDS = 30.0
+# tasks that outlive the request that started them; the event loop only keeps weak references to tasks
+BACKGROUND_TASKS: Set[asyncio.Task] = set()
+
+
+class SpeechStreamError(Exception):
+    """Raised to the client of a streamed speech generation whose audio stream could not be completed."""
+
+
+class GeneratedObject(NamedTuple):
+    """Pointer to an S3 object holding a generated file."""
+
+    object_key: str
+    etag: str
+
+
+def generation_cache_key(params: GenerateFilesQueryParams) -> str:
+    """Hash everything that determines the content of a generated file."""
+    file_extension = posixpath.splitext(params.file_path)[1].lower()
+    if params.file_type == GeneratedFileType.TEXT:
+        model_params = {"model": generate.TEXT_MODEL, "system_prompt": generate.SYSTEM_PROMPT}
+    elif params.file_type == GeneratedFileType.IMAGE:
+        model_params = {"model": generate.IMAGE_MODEL, "size": generate.IMAGE_SIZE, "quality": generate.IMAGE_QUALITY}
+    else:
+        model_params = {"model": generate.TEXT_TO_SPEECH_MODEL, "voice": generate.TEXT_TO_SPEECH_VOICE}
+    key_params = {
+        "file_type": params.file_type.value,
+        "prompt": params.prompt,
+        "file_extension": file_extension,
+        **model_params,
+    }
+    return hashlib.sha256(json.dumps(key_params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+async def generate_file(app: FastAPI, params: GenerateFilesQueryParams, use_cache: bool = True) -> bool:
+    """
+    Generate a file and store it in the app's bucket at ``params.file_path``.
+
+    :param app: The app whose settings, clients and generation cache to use.
+    :param params: What to generate and where to store it.
+    :param use_cache: Whether a previously generated file may be copied instead of generating a new one.
+
+    :return: Whether the file was copied from the generation cache.
+    """
+    if use_cache and await copy_from_generation_cache(app, params):
+        return True
+    await generate_and_upload_file(app, params)
+    await remember_generated_file(app, params)
+    return False
+
+
+async def copy_from_generation_cache(app: FastAPI, params: GenerateFilesQueryParams) -> bool:
+    """
+    Copy a file previously generated with the same parameters to ``params.file_path``.
+
+    :return: Whether there was such a file, i.e. whether generating the file can be skipped.
+    """
+    settings: Settings = app.state.settings
+    if not settings.generation_cache_enabled:
+        return False
+    generation_cache: TTLCache[GeneratedObject] = app.state.generation_cache
+    generated_object = generation_cache.get(generation_cache_key(params))
+    if generated_object is None:
+        return False
+    copied = await asyncio.to_thread(
+        copy_generated_object,
+        bucket_name=settings.s3_bucket_name,
+        generated_object=generated_object,
+        destination_key=params.file_path,
+        s3_client=get_shared_s3_client(app),
+    )
+    if copied and params.file_type == GeneratedFileType.IMAGE and generated_object.object_key != params.file_path:
+        await asyncio.to_thread(
+            copy_image_variants,
+            bucket_name=settings.s3_bucket_name,
+            source_key=generated_object.object_key,
+            destination_key=params.file_path,
+            variants=list(settings.image_variant_sizes),
+            s3_client=get_shared_s3_client(app),
+        )
+    return copied
+
+
+async def remember_generated_file(app: FastAPI, params: GenerateFilesQueryParams) -> None:
+    """Record the file just generated at ``params.file_path`` in the generation cache."""
+    settings: Settings = app.state.settings
+    if not settings.generation_cache_enabled:
+        return
+    head = await asyncio.to_thread(
+        get_shared_s3_client(app).head_object, Bucket=settings.s3_bucket_name, Key=params.file_path
+    )
+    generation_cache: TTLCache[GeneratedObject] = app.state.generation_cache
+    generation_cache.set(generation_cache_key(params), GeneratedObject(object_key=params.file_path, etag=head["ETag"]))
+
+
+def copy_generated_object(
+    bucket_name: str,
+    generated_object: GeneratedObject,
+    destination_key: str,
+    s3_client: "S3Client",
+) -> bool:
+    """
+    Copy a previously generated object to ``destination_key``.
+
+    :return: False if the object no longer exists or was replaced, so the file has to be generated again.
+    """
+    try:
+        head = s3_client.head_object(Bucket=bucket_name, Key=generated_object.object_key)
+        if head["ETag"] != generated_object.etag:
+            return False
+        if generated_object.object_key == destination_key:
+            # S3 refuses to copy an object onto itself, and it is already in place
+            return True
+        # the ETag condition also catches the object being replaced between the two calls
+        copy_s3_object(
+            bucket_name=bucket_name,
+            source_key=generated_object.object_key,
+            destination_key=destination_key,
+            source_etag=generated_object.etag,
+            s3_client=s3_client,
+        )
+        return True
+    except ClientError as err:
+        if err.response["Error"]["Code"] in {"404", "NoSuchKey", "412", "PreconditionFailed"}:
+            return False
+        raise
+
+
+def copy_image_variants(
+    bucket_name: str,
+    source_key: str,
+    destination_key: str,
+    variants: List[str],
+    s3_client: "S3Client",
+) -> None:
+    """Copy the variants of a generated image along with it, skipping those that were not rendered."""
+    for variant in variants:
+        try:
+            copy_s3_object(
+                bucket_name=bucket_name,
+                source_key=images.variant_object_key(source_key, variant),
+                destination_key=images.variant_object_key(destination_key, variant),
+                s3_client=s3_client,
+            )
+        except ClientError as err:
+            if err.response["Error"]["Code"] not in {"404", "NoSuchKey"}:
+                raise
+
+
+async def generate_and_upload_file(app: FastAPI, params: GenerateFilesQueryParams) -> None:
+    """
+    Call OpenAI to generate a file and upload it to the app's bucket at ``params.file_path``.
+
+    Uploads run in worker threads, so the event loop keeps generating other files meanwhile.
+    """
+    settings: Settings = app.state.settings
+    s3_client = get_shared_s3_client(app)
+    scheduler: OpenAIScheduler = app.state.openai_scheduler
+    # the scheduler retries the calls, within the rate limits
+    openai_client = get_shared_openai_client(app).with_options(max_retries=0)
+    guessed_content_type: Optional[str] = mimetypes.guess_type(params.file_path)[0]
+
+    if params.file_type == GeneratedFileType.TEXT:
+        file_content = await scheduler.call(
+            generate.TEXT_MODEL,
+            lambda: generate.get_text_chat_completion(prompt=params.prompt, openai_client=openai_client),
+            tokens=generate.estimate_chat_completion_tokens(params.prompt),
+            coalesce_key=params.prompt,
+        )
+        await asyncio.to_thread(
+            upload_s3_object,
+            bucket_name=settings.s3_bucket_name,
+            object_key=params.file_path,
+            file_content=file_content.encode("utf-8"),
+            content_type="text/plain",
+            s3_client=s3_client,
+        )
+    elif params.file_type == GeneratedFileType.IMAGE:
+        image = await scheduler.call(
+            generate.IMAGE_MODEL,
+            lambda: generate.generate_image(
+                prompt=params.prompt,
+                openai_client=openai_client,
+                response_format=settings.image_response_format,
+            ),
+            coalesce_key=(params.prompt, settings.image_response_format),
+        )
+
+        if settings.image_post_processing_enabled and images.is_image_processing_available():
+            await upload_processed_image(app, params, image=image)  # type: ignore
+            return
+
+        if settings.image_response_format == "b64_json":
+            # The image came back inline with the API response, no download needed
+            await upload_s3_object_from_async_stream(
+                bucket_name=settings.s3_bucket_name,
+                object_key=params.file_path,
+                chunks=generate.aiter_base64_decoded(image),  # type: ignore
+                content_type=guessed_content_type,
+                s3_client=s3_client,
+            )
+            return
+
+        # Stream the image from the URL straight into S3, without blocking the event loop or buffering it whole
+        http_client = get_shared_http_client(app)
+        async with http_client.stream("GET", image) as image_response:  # type: ignore
+            image_response.raise_for_status()
+            await upload_s3_object_from_async_stream(
+                bucket_name=settings.s3_bucket_name,
+                object_key=params.file_path,
+                chunks=image_response.aiter_bytes(),
+                content_type=guessed_content_type,
+                s3_client=s3_client,
+            )
+    else:
+        await upload_generated_speech(app, params)
+
+
+async def upload_processed_image(app: FastAPI, params: GenerateFilesQueryParams, image: str) -> None:
+    """
+    Re-encode a generated image to the format of ``params.file_path`` and upload it, along with its variants.
+
+    The pixel work runs in the app's image process pool (see `files_api.images`). Should it fail, e.g. on an
+    image Pillow cannot read, the image is uploaded as OpenAI returned it.
+
+    :param app: The app whose settings, clients and process pool to use.
+    :param params: What was generated (an image) and where to store it.
+    :param image: The image as OpenAI returned it: base64-encoded, or its URL, see ``image_response_format``.
+    """
+    settings: Settings = app.state.settings
+    s3_client = get_shared_s3_client(app)
+    if settings.image_response_format == "b64_json":
+        image_bytes = await asyncio.to_thread(base64.b64decode, image)
+    else:
+        with measure("image-download"):
+            image_response = await get_shared_http_client(app).get(image)
+        image_response.raise_for_status()
+        image_bytes = image_response.content
+
+    process = partial(
+        images.process_image,
+        image_bytes,
+        file_extension=posixpath.splitext(params.file_path)[1],
+        variant_sizes=settings.image_variant_sizes,
+        jpeg_quality=settings.image_jpeg_quality,
+    )
+    try:
+        image_process_pool = get_shared_image_process_pool(app)
+        with measure("image-processing"):
+            if image_process_pool is None:
+                encoded_images = await asyncio.to_thread(process)
+            else:
+                encoded_images = await asyncio.get_running_loop().run_in_executor(image_process_pool, process)
+    except Exception:  # pylint: disable=broad-except
+        LOGGER.exception("Post-processing the image generated for %s failed, storing it as is", params.file_path)
+        encoded_images = {"": image_bytes}
+
+    content_type = mimetypes.guess_type(params.file_path)[0]
+    await asyncio.gather(
+        *(
+            asyncio.to_thread(
+                upload_s3_object,
+                bucket_name=settings.s3_bucket_name,
+                object_key=images.variant_object_key(params.file_path, variant) if variant else params.file_path,
+                file_content=file_content,
+                content_type=content_type,
+                s3_client=s3_client,
+            )
+            for variant, file_content in encoded_images.items()
+        )
+    )
+
+
+async def upload_generated_speech(
+    app: FastAPI,
+    params: GenerateFilesQueryParams,
+    tee: Optional[Callable[[AsyncIterator[bytes], str], AsyncIterator[bytes]]] = None,
+) -> None:
+    """
+    Generate text-to-speech audio and upload it while it is being generated.
+
+    The audio is never held in memory as a whole: its chunks go into a multipart upload as they arrive from
+    OpenAI, with the content type OpenAI reports for them.
+
+    :param app: The app whose settings and clients to use.
+    :param params: What to generate (a Text-to-Speech file) and where to store it.
+    :param tee: Called with the audio chunks and their content type as soon as OpenAI answers; returns the
+        chunks to upload, e.g. after copying each one to another consumer.
+    """
+    settings: Settings = app.state.settings
+    response_format = params.file_path.split(".")[-1]
+    if len(params.prompt) > settings.tts_chunk_max_chars and response_format in audio.JOINABLE_SPEECH_FORMATS:
+        await upload_generated_long_speech(app, params, tee=tee)
+        return
+    scheduler: OpenAIScheduler = app.state.openai_scheduler
+    async with scheduler.slot(generate.TEXT_TO_SPEECH_MODEL), generate.stream_text_to_speech(
+        prompt=params.prompt,
+        openai_client=get_shared_openai_client(app),
+        response_format=response_format,  # type: ignore
+    ) as (audio_chunks, content_type):
+        content_type = content_type or mimetypes.guess_type(params.file_path)[0] or "application/octet-stream"
+        await upload_s3_object_from_async_stream(
+            bucket_name=settings.s3_bucket_name,
+            object_key=params.file_path,
+            chunks=tee(audio_chunks, content_type) if tee else audio_chunks,
+            content_type=content_type,
+            s3_client=get_shared_s3_client(app),
+        )
+
+
+async def upload_generated_long_speech(
+    app: FastAPI,
+    params: GenerateFilesQueryParams,
+    tee: Optional[Callable[[AsyncIterator[bytes], str], AsyncIterator[bytes]]] = None,
+) -> None:
+    """
+    Generate text-to-speech audio for a long prompt in pieces synthesized concurrently, and upload it as one file.
+
+    The prompt is split at sentence boundaries (see `files_api.audio`), so generating it takes about as long as
+    its slowest piece instead of the sum of all of them. The pieces are joined and uploaded in order as soon as
+    they and the pieces before them are done, so only the pieces that finished ahead of their turn are held in
+    memory, and the upload (and the client, see ``tee``) starts with the first piece.
+
+    :param app: The app whose settings and clients to use.
+    :param params: What to generate (a Text-to-Speech file in one of `audio.JOINABLE_SPEECH_FORMATS`) and
+        where to store it.
+    :param tee: See `upload_generated_speech`; called once the first piece is ready.
+    """
+    settings: Settings = app.state.settings
+    response_format = params.file_path.split(".")[-1]
+    scheduler: OpenAIScheduler = app.state.openai_scheduler
+    openai_client = get_shared_openai_client(app).with_options(max_retries=0)
+    semaphore = asyncio.Semaphore(settings.tts_concurrency)
+
+    async def synthesize(text: str) -> Tuple[bytes, str]:
+        async with semaphore:
+            return await scheduler.call(
+                generate.TEXT_TO_SPEECH_MODEL,
+                lambda: generate.generate_text_to_speech(
+                    prompt=text, openai_client=openai_client, response_format=response_format  # type: ignore
+                ),
+                coalesce_key=(text, response_format),
+            )
+
+    # the pieces still to be joined, in order
+    pieces = deque(
+        asyncio.ensure_future(synthesize(text))
+        for text in audio.split_text_into_chunks(params.prompt, settings.tts_chunk_max_chars)
+    )
+    try:
+        _, content_type = await pieces[0]
+        content_type = content_type or mimetypes.guess_type(params.file_path)[0] or "application/octet-stream"
+
+        async def audio_chunks() -> AsyncIterator[bytes]:
+            joiner = audio.AudioJoiner(response_format)
+            while pieces:
+                piece, _ = await pieces[0]
+                pieces.popleft()
+                joined = joiner.add(piece)
+                for start in range(0, len(joined), generate.SPEECH_CHUNK_SIZE_BYTES):
+                    end = start + generate.SPEECH_CHUNK_SIZE_BYTES
+                    yield joined[start:end]
+
+        await upload_s3_object_from_async_stream(
+            bucket_name=settings.s3_bucket_name,
+            object_key=params.file_path,
+            chunks=tee(audio_chunks(), content_type) if tee else audio_chunks(),
+            content_type=content_type,
+            s3_client=get_shared_s3_client(app),
+        )
+    finally:
+        # if the upload failed, don't keep synthesizing pieces that will never be joined
+        for piece in pieces:
+            piece.cancel()
+
+
+async def run_generation_job(app: FastAPI, params: GenerateFilesQueryParams) -> bool:
+    """Process a generation job of the app's job queue, see `files_api.jobs`."""
+    generated_from_cache = await generate_file(app, params=params, use_cache=params.use_cache)
+    app.state.listing_page_cache.clear()
+    return generated_from_cache
+
+
+async def generate_files(
+    app: FastAPI, items: List[GenerateFilesQueryParams], max_concurrency: int
+) -> AsyncIterator[BulkGenerationItemResult]:
+    """
+    Generate many files concurrently, yielding the result of each one as soon as it is done.
+
+    A failing item does not stop the others; its error is part of its result. Leaving the iteration early
+    (e.g. because the client disconnected) cancels the items that have not finished.
+
+    :param app: The app whose settings, clients and generation cache to use.
+    :param items: What to generate and where to store it.
+    :param max_concurrency: Maximum number of items generated at the same time.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def generate_item(index: int, params: GenerateFilesQueryParams) -> BulkGenerationItemResult:
+        async with semaphore:
+            try:
+                generated_from_cache = await run_generation_job(app, params)
+            except Exception as err:  # pylint: disable=broad-except
+                LOGGER.exception("Generating %s failed", params.file_path)
+                return BulkGenerationItemResult(
+                    index=index,
+                    file_path=params.file_path,
+                    status=GenerationJobStatus.FAILED,
+                    error=str(err) or type(err).__name__,
+                )
+        return BulkGenerationItemResult(
+            index=index,
+            file_path=params.file_path,
+            status=GenerationJobStatus.SUCCEEDED,
+            generated_from_cache=generated_from_cache,
+        )
+
+    tasks = [asyncio.create_task(generate_item(index, params)) for index, params in enumerate(items)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_text_file_generation(
+    app: FastAPI, params: GenerateFilesQueryParams, use_cache: bool = True
+) -> AsyncIterator[str]:
+    """
+    Generate a text file, yielding its text as OpenAI produces it.
+
+    The text is collected while it streams through and uploaded to ``params.file_path`` once the completion
+    has ended, so the object only ever holds a complete file. If the iteration is abandoned before that
+    (e.g. the client disconnected), nothing is uploaded.
+
+    :param app: The app whose settings, clients and generation cache to use.
+    :param params: What to generate (a text file) and where to store it.
+    :param use_cache: Whether a previously generated file may be copied instead of generating a new one;
+        its whole text is then yielded at once.
+    """
+    settings: Settings = app.state.settings
+    s3_client = get_shared_s3_client(app)
+
+    if use_cache and await copy_from_generation_cache(app, params):
+        cached_object = await asyncio.to_thread(
+            fetch_s3_object, bucket_name=settings.s3_bucket_name, object_key=params.file_path, s3_client=s3_client
+        )
+        yield await asyncio.to_thread(lambda: cached_object["Body"].read().decode("utf-8"))
+        app.state.listing_page_cache.clear()
+        return
+
+    scheduler: OpenAIScheduler = app.state.openai_scheduler
+    text_pieces: List[str] = []
+    async with scheduler.slot(generate.TEXT_MODEL, tokens=generate.estimate_chat_completion_tokens(params.prompt)):
+        async for text in generate.stream_text_chat_completion(
+            prompt=params.prompt, openai_client=get_shared_openai_client(app)
+        ):
+            text_pieces.append(text)
+            yield text
+
+    await asyncio.to_thread(
+        upload_s3_object,
+        bucket_name=settings.s3_bucket_name,
+        object_key=params.file_path,
+        file_content="".join(text_pieces).encode("utf-8"),
+        content_type="text/plain",
+        s3_client=s3_client,
+    )
+    app.state.listing_page_cache.clear()
+    await remember_generated_file(app, params)
+
+
+async def start_speech_file_generation(
+    app: FastAPI, params: GenerateFilesQueryParams, use_cache: bool = True
+) -> Tuple[AsyncIterator[bytes], str, bool]:
+    """
+    Start generating a Text-to-Speech file, and return its audio as it is generated, to play it right away.
+
+    Returns once OpenAI has started answering. The generation and upload continue in a background task,
+    which feeds a copy of every chunk to the returned iterator. Should the consumer of the iterator go away
+    (e.g. the client disconnected), the upload still completes. Should the consumer fall behind by more than
+    ``TEE_CLIENT_TIMEOUT_SECONDS``, or the generation fail after the audio started streaming, the iterator
+    raises `SpeechStreamError` instead of ending, so the client is not handed truncated audio as complete.
+
+    :return: The audio chunks, their content type and whether the file was copied from the generation cache.
+    """
+    settings: Settings = app.state.settings
+    s3_client = get_shared_s3_client(app)
+
+    if use_cache and await copy_from_generation_cache(app, params):
+        cached_object = await asyncio.to_thread(
+            fetch_s3_object, bucket_name=settings.s3_bucket_name, object_key=params.file_path, s3_client=s3_client
+        )
+        app.state.listing_page_cache.clear()
+        return (
+            aiter_s3_object_body(cached_object["Body"], chunk_size_bytes=generate.SPEECH_CHUNK_SIZE_BYTES),
+            cached_object["ContentType"],
+            True,
+        )
+
+    content_type_ready: "asyncio.Future[str]" = asyncio.get_running_loop().create_future()
+    # audio chunks, then None if the whole audio was uploaded, or the error that cut the stream short
+    client_chunks: "asyncio.Queue[Union[bytes, Exception, None]]" = asyncio.Queue(maxsize=TEE_BUFFER_CHUNKS)
+    client_attached = True
+
+    def close_client_stream(end: Optional[Exception]) -> None:
+        """Stop feeding the client, dropping what it has not read yet, so its next read gets ``end``."""
+        nonlocal client_attached
+        client_attached = False
+        while not client_chunks.empty():
+            client_chunks.get_nowait()
+        client_chunks.put_nowait(end)
+
+    async def feed_client(chunk: Optional[bytes]) -> None:
+        if client_attached:
+            try:
+                await asyncio.wait_for(client_chunks.put(chunk), timeout=TEE_CLIENT_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                # the client stopped reading (or never started), don't let it hold up the upload; it missed
+                # chunks, so its stream must not end as if it were complete
+                close_client_stream(SpeechStreamError("The client did not keep up with the generated audio"))
+
+    async def tee(audio_chunks: AsyncIterator[bytes], content_type: str) -> AsyncIterator[bytes]:
+        content_type_ready.set_result(content_type)
+        async for chunk in audio_chunks:
+            await feed_client(chunk)
+            yield chunk
+
+    async def generate_and_upload() -> None:
+        try:
+            await upload_generated_speech(app, params, tee=tee)
+            app.state.listing_page_cache.clear()
+            await remember_generated_file(app, params)
+        except Exception as err:  # pylint: disable=broad-except
+            if not content_type_ready.done():
+                content_type_ready.set_exception(err)
+                return
+            LOGGER.exception("Generating %s failed after its audio started streaming", params.file_path)
+            if client_attached:
+                close_client_stream(SpeechStreamError(f"Generating {params.file_path} failed: {err}"))
+            return
+        await feed_client(None)
+
+    run_in_background(generate_and_upload())
+    content_type = await content_type_ready
+
+    async def aiter_client_chunks() -> AsyncIterator[bytes]:
+        nonlocal client_attached
+        try:
+            while (chunk := await client_chunks.get()) is not None:
+                if isinstance(chunk, Exception):
+                    # once the response started, raising is the only way to tell the client it is incomplete:
+                    # the server aborts the response instead of ending it
+                    raise chunk
+                yield chunk
+        finally:
+            # stop feeding the client, and unblock the producer if it waits for room in the queue
+            client_attached = False
+            while not client_chunks.empty():
+                client_chunks.get_nowait()
+
+    return aiter_client_chunks(), content_type, False
+
+
+def run_in_background(coroutine: Coroutine[Any, Any, None]) -> None:
+    """
+    Run a coroutine in a task that outlives the current request, holding on to it until it is done.
+
+    The task runs in an empty context rather than a copy of the request's, so what it times and traces is
+    not recorded into the request's `RequestTimings` and trace, which are long gone by the time it finishes.
+    """
+    # created from within the empty context, which the task copies (`create_task(context=...)` needs Python 3.11)
+    task = contextvars.Context().run(asyncio.create_task, coroutine)
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
@@ -0,0 +1,83 @@
+"""
+Post-process generated images: re-encode them to the format their path asks for, and render smaller variants.
+
+OpenAI returns PNGs of a fixed size, whatever the requested path. Stored as they are, a ``.jpg`` path holds
+a multi-megabyte PNG, and a client showing a thumbnail downloads the full image. So a generated image is
+decoded once and encoded with size-optimized settings to the format of its path, along with optional
+downscaled variants (e.g. a thumbnail and a preview) stored next to it: ``cat.jpg`` gets ``cat.thumbnail.jpg``.
+
+Decoding, resizing and encoding pixels is CPU-bound, so `process_image` runs in a process pool (see
+`files_api.clients.get_shared_image_process_pool`) and never blocks the event loop. Pillow is an optional
+dependency (the ``images`` extra): without it, images are stored as OpenAI returned them.
+"""
+
+import importlib.util
+import io
+import posixpath
+from typing import (
+    Dict,
+    Mapping,
+)
+
+# the Pillow format to encode each file extension in
+IMAGE_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG"}
+
+
+def is_image_processing_available() -> bool:
+    """Whether Pillow is installed, without importing it."""
+    return importlib.util.find_spec("PIL") is not None
+
+
+def variant_object_key(object_key: str, variant: str) -> str:
+    """Return the key of a variant of an image, next to it: ``path/cat.jpg`` -> ``path/cat.thumbnail.jpg``."""
+    root, extension = posixpath.splitext(object_key)
+    return f"{root}.{variant}{extension}"
+
+
+def process_image(
+    image_bytes: bytes,
+    file_extension: str,
+    variant_sizes: Mapping[str, int],
+    jpeg_quality: int = 85,
+) -> Dict[str, bytes]:
+    """
+    Re-encode an image to the format of ``file_extension`` and render downscaled variants of it.
+
+    Runs in a worker process, so it only takes and returns picklable values.
+
+    :param image_bytes: The encoded image, in any format Pillow reads.
+    :param file_extension: The extension of the path the image is stored at, one of `IMAGE_FORMATS`.
+    :param variant_sizes: The variants to render, by name, each fitting in a square of that many pixels.
+        Variants at least as large as the image are not rendered.
+    :param jpeg_quality: The quality of JPEG images, from 1 to 95.
+
+    :return: The encoded image under the key "", and each variant under its name.
+    """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    image_format = IMAGE_FORMATS[file_extension.lower()]
+    with Image.open(io.BytesIO(image_bytes)) as image_file:
+        image_file.load()
+        image: Image.Image = image_file
+        if image_format == "JPEG" and image_file.mode != "RGB":
+            # JPEG has no alpha channel nor palette
+            image = image_file.convert("RGB")
+
+        encoded_images = {"": encode_image(image, image_format, jpeg_quality)}
+        for variant, size in variant_sizes.items():
+            if max(image.size) <= size:
+                continue
+            variant_image = image.copy()
+            variant_image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            encoded_images[variant] = encode_image(variant_image, image_format, jpeg_quality)
+    return encoded_images
+
+
+def encode_image(image, image_format: str, jpeg_quality: int) -> bytes:
+    """Encode a Pillow image, favoring size: optimized Huffman tables for JPEG, maximum compression for PNG."""
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        image.save(buffer, format="JPEG", quality=jpeg_quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,379 @@
+"""
+Run file generations as background jobs instead of holding the HTTP request open.
+
+A generation (OpenAI call, download, S3 upload) can outlast API Gateway and Lambda timeouts. With jobs, the
+request only enqueues the work and answers `202 Accepted` with a job id; a pool of workers processes the
+queue and the client polls the job's status.
+
+`JobQueue` is the extension point:
+
+- `InProcessJobQueue` keeps the queue and the job statuses in the memory of the process, which suits a
+  long-running server and tests.
+- `SQSJobQueue` sends jobs to an SQS queue and keeps their statuses as JSON objects in S3, so any process can
+  run a job and any process can report its status. This is what a deployment that scales out needs, e.g.
+  Lambda, where an execution environment is frozen between invocations and every invocation may land in
+  another one. There, the queue is consumed by an SQS event source mapping, see `files_api.aws_lambda_handler`.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import time
+import uuid
+from abc import (
+    ABC,
+    abstractmethod,
+)
+from functools import cached_property
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+import boto3
+from botocore.exceptions import ClientError
+
+from files_api.cache import TTLCache
+from files_api.s3.read_objects import fetch_s3_object
+from files_api.s3.write_objects import upload_s3_object
+from files_api.schemas import (
+    GenerateFilesQueryParams,
+    GenerationJobStatus,
+)
+
+if TYPE_CHECKING:
+    from mypy_boto3_s3 import S3Client
+    from mypy_boto3_sqs import SQSClient
+
+LOGGER = logging.getLogger(__name__)
+
+# Generates the file described by the params; returns whether it was copied from the generation cache.
+JobHandler = Callable[[GenerateFilesQueryParams], Awaitable[bool]]
+
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted to a queue that has no room left."""
+
+
+class GenerationJob(NamedTuple):
+    """The state of a generation job."""
+
+    job_id: str
+    params: GenerateFilesQueryParams
+    status: GenerationJobStatus
+    created_at: float
+    updated_at: float
+    generated_from_cache: Optional[bool] = None
+    error: Optional[str] = None
+
+    def to_json(self) -> str:
+        fields = dict(zip(GenerationJob._fields, self))
+        return json.dumps({**fields, "params": self.params.model_dump(mode="json")})
+
+    @classmethod
+    def from_json(cls, document: str) -> "GenerationJob":
+        fields = json.loads(document)
+        return cls(
+            **{
+                **fields,
+                "params": GenerateFilesQueryParams.model_validate(fields["params"]),
+                "status": GenerationJobStatus(fields["status"]),
+            }
+        )
+
+
+class JobQueue(ABC):
+    """A queue of generation jobs, processed in the background by ``handler``."""
+
+    def __init__(self, handler: JobHandler):
+        self.handler = handler
+
+    @abstractmethod
+    async def submit(self, params: GenerateFilesQueryParams) -> GenerationJob:
+        """
+        Enqueue a generation job.
+
+        :raises JobQueueFullError: If the queue cannot take more jobs right now.
+        """
+
+    @abstractmethod
+    async def get_job(self, job_id: str) -> Optional[GenerationJob]:
+        """Return the current state of a job, or None if it is unknown (or expired)."""
+
+    async def start(self) -> None:
+        """Start processing jobs."""
+
+    async def stop(self) -> None:
+        """Stop processing jobs."""
+
+
+class InProcessJobQueue(JobQueue):
+    """
+    A bounded `asyncio.Queue` processed by worker tasks in the same process and event loop.
+
+    Queued and running jobs are kept until they finish, so they are never evicted to make room; at most
+    ``maxsize + num_workers`` of them exist at a time. Only finished jobs are forgotten, once they expired or
+    when more than ``max_jobs`` finished jobs are remembered.
+
+    :param handler: Processes a job.
+    :param maxsize: Maximum number of jobs waiting to be processed.
+    :param num_workers: Number of jobs processed concurrently.
+    :param job_ttl_seconds: How long the state of a finished job can be looked up.
+    :param max_jobs: Maximum number of finished jobs whose state is remembered.
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        maxsize: int,
+        num_workers: int,
+        job_ttl_seconds: float,
+        max_jobs: int = 10_000,
+    ):
+        super().__init__(handler)
+        self.maxsize = maxsize
+        self.num_workers = num_workers
+        self._active_jobs: Dict[str, GenerationJob] = {}
+        self._finished_jobs: TTLCache[GenerationJob] = TTLCache(maxsize=max_jobs, ttl_seconds=job_ttl_seconds)
+        self._queue: Optional["asyncio.Queue[str]"] = None
+        self._workers: List[asyncio.Task] = []
+
+    async def submit(self, params: GenerateFilesQueryParams) -> GenerationJob:
+        # workers start on first use too, for apps that run without a lifespan
+        await self.start()
+        job = new_generation_job(params)
+        try:
+            self._queue.put_nowait(job.job_id)  # type: ignore
+        except asyncio.QueueFull as err:
+            raise JobQueueFullError(f"The job queue is full ({self.maxsize} jobs are waiting)") from err
+        self._active_jobs[job.job_id] = job
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[GenerationJob]:
+        return self._active_jobs.get(job_id) or self._finished_jobs.get(job_id)
+
+    async def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._workers = start_workers(self._work, self.num_workers)
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def _work(self) -> None:
+        """Process jobs from the queue, one at a time, forever."""
+        while True:
+            job_id = await self._queue.get()  # type: ignore
+            job = self._active_jobs[job_id] = self._active_jobs[job_id]._replace(
+                status=GenerationJobStatus.RUNNING, updated_at=time.time()
+            )
+            try:
+                finished_job = await run_job(self.handler, job)
+            except asyncio.CancelledError:
+                self._finish(job._replace(status=GenerationJobStatus.FAILED, error="The server shut down"))
+                raise
+            self._finish(finished_job)
+
+    def _finish(self, job: GenerationJob) -> None:
+        self._finished_jobs.set(job.job_id, job)
+        self._active_jobs.pop(job.job_id, None)
+
+
+class SQSJobQueue(JobQueue):
+    """
+    Jobs sent as messages to an SQS queue, with their statuses stored as JSON objects in S3.
+
+    Messages are either delivered by an SQS event source mapping (on Lambda: see `process_message`), or
+    received by ``num_workers`` polling tasks (on a server). A job that fails is marked as failed and not
+    retried, like with `InProcessJobQueue`; its message is only retried by SQS if its status could not be
+    stored. An S3 lifecycle rule on ``status_key_prefix`` should expire the statuses after ``job_ttl_seconds``.
+
+    :param handler: Processes a job.
+    :param queue_url: URL of the SQS queue.
+    :param status_bucket_name: Name of the S3 bucket the job statuses are stored in.
+    :param job_ttl_seconds: How long the state of a job can be looked up.
+    :param get_s3_client: Returns the S3 client to store the job statuses with.
+    :param num_workers: Number of tasks receiving and processing messages; 0 to only process the messages
+        passed to `process_message`.
+    :param status_key_prefix: Prefix of the keys of the job statuses in the bucket.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        handler: JobHandler,
+        queue_url: str,
+        *,
+        status_bucket_name: str,
+        job_ttl_seconds: float,
+        get_s3_client: Callable[[], "S3Client"],
+        num_workers: int = 0,
+        status_key_prefix: str = "generation-jobs/",
+    ):
+        super().__init__(handler)
+        self.queue_url = queue_url
+        self.status_bucket_name = status_bucket_name
+        self.job_ttl_seconds = job_ttl_seconds
+        self.get_s3_client = get_s3_client
+        self.num_workers = num_workers
+        self.status_key_prefix = status_key_prefix
+        self._workers: List[asyncio.Task] = []
+
+    @cached_property
+    def sqs_client(self) -> "SQSClient":
+        # created on first use, so that apps which never submit or receive a job don't pay for it
+        return boto3.client("sqs")
+
+    async def submit(self, params: GenerateFilesQueryParams) -> GenerationJob:
+        job = new_generation_job(params)
+        # stored first, so that the job can be polled as soon as a worker may pick it up
+        await self._store(job)
+        await asyncio.to_thread(self.sqs_client.send_message, QueueUrl=self.queue_url, MessageBody=job.to_json())
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[GenerationJob]:
+        try:
+            response = await asyncio.to_thread(
+                fetch_s3_object,
+                bucket_name=self.status_bucket_name,
+                object_key=self._status_key(job_id),
+                s3_client=self.get_s3_client(),
+            )
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") == "NoSuchKey":
+                return None
+            raise
+        job = GenerationJob.from_json(response["Body"].read().decode("utf-8"))
+        if job.updated_at + self.job_ttl_seconds < time.time():
+            return None
+        return job
+
+    async def process_message(self, message_body: str) -> None:
+        """
+        Run the job sent in a message, storing its status as it progresses.
+
+        :raises Exception: Only if a status could not be stored, so that SQS delivers the message again.
+        """
+        job = GenerationJob.from_json(message_body)
+        job = job._replace(status=GenerationJobStatus.RUNNING, updated_at=time.time())
+        await self._store(job)
+        await self._store(await run_job(self.handler, job))
+
+    async def process_sqs_event(self, event: dict) -> dict:
+        """
+        Process the messages of an SQS event source mapping's event, concurrently.
+
+        :return: The partial batch response listing the messages to deliver again (the event source mapping
+            must have `ReportBatchItemFailures` enabled), so that the others are not processed twice.
+        """
+        records = event["Records"]
+        results = await asyncio.gather(
+            *(self.process_message(record["body"]) for record in records), return_exceptions=True
+        )
+        failures = []
+        for record, result in zip(records, results):
+            if isinstance(result, Exception):
+                LOGGER.error("Failed to process generation job message %s", record["messageId"], exc_info=result)
+                failures.append({"itemIdentifier": record["messageId"]})
+        return {"batchItemFailures": failures}
+
+    async def start(self) -> None:
+        if not self._workers:
+            self._workers = start_workers(self._work, self.num_workers)
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _work(self) -> None:
+        """Receive messages from the queue and process them, one at a time, forever."""
+        while True:
+            try:
+                response = await asyncio.to_thread(
+                    self.sqs_client.receive_message,
+                    QueueUrl=self.queue_url,
+                    MaxNumberOfMessages=1,
+                    WaitTimeSeconds=20,
+                )
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Failed to receive generation jobs from %s", self.queue_url)
+                await asyncio.sleep(5)
+                continue
+            for message in response.get("Messages", []):
+                try:
+                    await self.process_message(message["Body"])
+                except Exception:  # pylint: disable=broad-except
+                    # left in the queue: SQS delivers it again once its visibility timeout expires
+                    LOGGER.exception("Failed to process generation job message %s", message["MessageId"])
+                    continue
+                await asyncio.to_thread(
+                    self.sqs_client.delete_message, QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"]
+                )
+
+    async def _store(self, job: GenerationJob) -> None:
+        await asyncio.to_thread(
+            upload_s3_object,
+            bucket_name=self.status_bucket_name,
+            object_key=self._status_key(job.job_id),
+            file_content=job.to_json().encode("utf-8"),
+            content_type="application/json",
+            s3_client=self.get_s3_client(),
+        )
+
+    def _status_key(self, job_id: str) -> str:
+        return f"{self.status_key_prefix}{job_id}.json"
+
+
+def start_workers(work: Callable[[], Coroutine[Any, Any, None]], num_workers: int) -> List[asyncio.Task]:
+    """
+    Start ``num_workers`` tasks running ``work``.
+
+    The workers may be started by the first request that submits a job, so they run in an empty context
+    instead of a copy of that request's: otherwise, every job would be timed and traced into that request's
+    `RequestTimings` and trace, without bound.
+    """
+    # each task is created from within an empty context, which it copies (`create_task(context=...)` needs
+    # Python 3.11)
+    return [
+        contextvars.Context().run(asyncio.create_task, work(), name=f"generation-job-worker-{i}")
+        for i in range(num_workers)
+    ]
+
+
+def new_generation_job(params: GenerateFilesQueryParams) -> GenerationJob:
+    """Describe a new, queued job."""
+    now = time.time()
+    return GenerationJob(
+        job_id=uuid.uuid4().hex,
+        params=params,
+        status=GenerationJobStatus.QUEUED,
+        created_at=now,
+        updated_at=now,
+    )
+
+
+async def run_job(handler: JobHandler, job: GenerationJob) -> GenerationJob:
+    """Run a job with ``handler``, returning its state once it succeeded or failed."""
+    try:
+        generated_from_cache = await handler(job.params)
+    except Exception as err:  # pylint: disable=broad-except
+        LOGGER.exception("Generation job %s failed", job.job_id)
+        return job._replace(
+            status=GenerationJobStatus.FAILED, updated_at=time.time(), error=str(err) or type(err).__name__
+        )
+    return job._replace(
+        status=GenerationJobStatus.SUCCEEDED, updated_at=time.time(), generated_from_cache=generated_from_cache
+    )
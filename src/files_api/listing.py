@@ -0,0 +1,153 @@
+"""
+Random-access listing pages, page read-ahead and metadata enrichment for `GET /v1/files`.
+
+Any page of a listing can be fetched from its cursor (see `files_api.listing_cursors`) independently of the
+pages before it, so the server can fetch the *next* page speculatively while the client is still looking at
+the current one.
+
+`list_objects_v2` does not return content types or user metadata, so listings that ask for them are
+enriched with concurrent `head_object` calls whose results are cached per object version (ETag).
+"""
+
+import logging
+from typing import (
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+from files_api.cache import TTLCache
+from files_api.listing_cursors import ListingCursor
+from files_api.s3.read_objects import (
+    DEFAULT_HEAD_OBJECT_CONCURRENCY,
+    fetch_s3_objects_head_metadata,
+    fetch_s3_objects_metadata,
+)
+
+try:
+    from mypy_boto3_s3 import S3Client
+    from mypy_boto3_s3.type_defs import ObjectTypeDef
+except ImportError:
+    ...
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ObjectHeadMetadata(NamedTuple):
+    """The parts of a `head_object` response that a listing does not return."""
+
+    content_type: Optional[str]
+    metadata: Dict[str, str]
+
+
+class ListingPage(NamedTuple):
+    """A page of objects and the cursor of the page that follows it, if any."""
+
+    files: List["ObjectTypeDef"]
+    next_cursor: Optional[ListingCursor]
+
+
+def fetch_listing_page(
+    bucket_name: str,
+    cursor: ListingCursor,
+    s3_client: Optional["S3Client"] = None,
+) -> ListingPage:
+    """
+    Fetch the page of objects a cursor points to.
+
+    :param bucket_name: Name of the S3 bucket to list objects from.
+    :param cursor: Position of the page to fetch.
+    :param s3_client: Optional S3 client to use. If not provided, a new client will be created.
+    """
+    files, next_continuation_token = fetch_s3_objects_metadata(
+        bucket_name=bucket_name,
+        prefix=cursor.prefix,
+        max_keys=cursor.page_size,
+        start_after=cursor.start_after,
+        s3_client=s3_client,
+    )
+    next_cursor = None
+    if files and next_continuation_token:
+        next_cursor = cursor._replace(start_after=files[-1]["Key"])
+    return ListingPage(files=files, next_cursor=next_cursor)
+
+
+def get_listing_page(
+    page_cache: TTLCache[ListingPage],
+    bucket_name: str,
+    cursor: ListingCursor,
+    s3_client: Optional["S3Client"] = None,
+) -> ListingPage:
+    """Return the page a cursor points to, serving it from ``page_cache`` when it was read ahead."""
+    page = page_cache.get((bucket_name, cursor))
+    if page is None:
+        page = fetch_listing_page(bucket_name=bucket_name, cursor=cursor, s3_client=s3_client)
+    return page
+
+
+def prefetch_listing_page(
+    page_cache: TTLCache[ListingPage],
+    bucket_name: str,
+    cursor: ListingCursor,
+    s3_client: Optional["S3Client"] = None,
+) -> None:
+    """
+    Fetch a page speculatively and store it in ``page_cache`` so the next request is served from memory.
+
+    Failures are logged and otherwise ignored: the page will simply be fetched again on demand.
+    The page is not stored if ``page_cache`` was cleared (i.e. a file changed) while it was being fetched.
+    """
+    generation = page_cache.generation
+    try:
+        page = fetch_listing_page(bucket_name=bucket_name, cursor=cursor, s3_client=s3_client)
+    except Exception:  # pylint: disable=broad-except
+        LOGGER.warning("Failed to read ahead listing page %s", cursor, exc_info=True)
+        return
+    page_cache.set((bucket_name, cursor), page, generation=generation)
+
+
+def fetch_objects_head_metadata(
+    metadata_cache: TTLCache[ObjectHeadMetadata],
+    bucket_name: str,
+    files: List["ObjectTypeDef"],
+    max_concurrency: int = DEFAULT_HEAD_OBJECT_CONCURRENCY,
+    s3_client: Optional["S3Client"] = None,
+) -> Dict[str, ObjectHeadMetadata]:
+    """
+    Fetch the content type and user metadata of listed objects, using ``metadata_cache`` where possible.
+
+    Cache entries are keyed by the object's ETag, so an object that was overwritten is never served
+    stale metadata. Objects that disappeared since they were listed are left out of the result.
+
+    :param metadata_cache: Cache of previously fetched object metadata.
+    :param bucket_name: Name of the S3 bucket the objects were listed from.
+    :param files: Objects as returned by `list_objects_v2`.
+    :param max_concurrency: Maximum number of `head_object` calls in flight at the same time.
+    :param s3_client: Optional S3 client to use. If not provided, a new client will be created.
+
+    :return: Mapping of object key to its metadata.
+    """
+    head_metadata: Dict[str, ObjectHeadMetadata] = {}
+    missing_keys: List[str] = []
+    for file in files:
+        cached = metadata_cache.get((bucket_name, file["Key"], file.get("ETag")))
+        if cached is None:
+            missing_keys.append(file["Key"])
+        else:
+            head_metadata[file["Key"]] = cached
+
+    head_responses = fetch_s3_objects_head_metadata(
+        bucket_name=bucket_name,
+        object_keys=missing_keys,
+        max_concurrency=max_concurrency,
+        s3_client=s3_client,
+    )
+    for object_key, head_response in head_responses.items():
+        object_head_metadata = ObjectHeadMetadata(
+            content_type=head_response.get("ContentType"),
+            metadata=head_response.get("Metadata", {}),
+        )
+        metadata_cache.set((bucket_name, object_key, head_response.get("ETag")), object_head_metadata)
+        head_metadata[object_key] = object_head_metadata
+    return head_metadata
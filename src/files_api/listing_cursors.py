@@ -0,0 +1,53 @@
+"""
+Listing cursors, the ``page_token`` handed out by `GET /v1/files`.
+
+Instead of wrapping an S3 continuation token (which can only move forward and forgets the prefix), a cursor
+encodes everything needed to fetch a page on its own: the prefix, the page size and the key the page starts
+after.
+
+Only the standard library is used here, so that `files_api.schemas` can validate page tokens without importing
+the S3 layer.
+"""
+
+import base64
+import binascii
+import json
+from typing import (
+    NamedTuple,
+    Optional,
+)
+
+
+class ListingCursor(NamedTuple):
+    """Position of a page within a listing."""
+
+    prefix: str
+    page_size: int
+    start_after: Optional[str] = None
+
+
+def encode_listing_cursor(cursor: ListingCursor) -> str:
+    """Encode a cursor as an opaque, URL-safe page token."""
+    payload = {"p": cursor.prefix, "n": cursor.page_size, "s": cursor.start_after}
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_listing_cursor(page_token: str) -> ListingCursor:
+    """
+    Decode a page token produced by `encode_listing_cursor`.
+
+    :raises ValueError: If the token is not a valid listing cursor.
+    """
+    try:
+        padding = "=" * (-len(page_token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(page_token + padding))
+        cursor = ListingCursor(prefix=payload["p"], page_size=payload["n"], start_after=payload["s"])
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError) as err:
+        raise ValueError("page_token is not a valid page token") from err
+
+    if not isinstance(cursor.prefix, str) or not isinstance(cursor.page_size, int) or cursor.page_size < 1:
+        raise ValueError("page_token is not a valid page token")
+    if cursor.start_after is not None and not isinstance(cursor.start_after, str):
+        raise ValueError("page_token is not a valid page token")
+    return cursor
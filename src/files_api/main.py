@@ -1,24 +1,71 @@
 """FastAPI application for managing files in an S3 bucket."""
 
+from contextlib import asynccontextmanager
+from functools import partial
 from textwrap import dedent
-from typing import Union
+from typing import (
+    AsyncIterator,
+    Union,
+)
 
 import pydantic
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
 
+from files_api.cache import TTLCache
+from files_api.clients import (
+    close_shared_clients,
+    get_shared_openai_client,
+    get_shared_s3_client,
+)
 from files_api.errors import (
-    handle_broad_exceptions,
+    BroadExceptionMiddleware,
     handle_pydantic_validation_error,
 )
+from files_api.generation import run_generation_job
+from files_api.jobs import (
+    InProcessJobQueue,
+    JobQueue,
+    SQSJobQueue,
+)
+from files_api.metrics import (
+    MetricsMiddleware,
+    enable_metrics,
+)
+from files_api.openai_scheduler import OpenAIScheduler
+from files_api.profiling import ProfilingMiddleware
 from files_api.routes import ROUTER
-from files_api.settings import Settings
+from files_api.settings import (
+    Settings,
+    is_running_in_aws_lambda,
+)
+from files_api.timing import ServerTimingMiddleware
+from files_api.tracing import (
+    Tracer,
+    TracingMiddleware,
+)
 
 
 def custom_generate_unique_id(route: APIRoute):
     return f"{route.tags[0]}-{route.name}"
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Create the app's OpenAI client and job workers when the server starts, and release them when it stops."""
+    get_shared_openai_client(app)
+    job_queue: Union[JobQueue, None] = app.state.generation_job_queue
+    if job_queue:
+        await job_queue.start()
+    yield
+    if job_queue:
+        await job_queue.stop()
+    await close_shared_clients(app)
+    tracer: Union[Tracer, None] = getattr(app.state, "tracer", None)
+    if tracer:
+        tracer.close()
+
+
 def create_app(settings: Union[Settings, None] = None) -> FastAPI:
     """Create a FastAPI application."""
     # s3_bucket_name = s3_bucket_name or os.environ["S3_BUCKET_NAME"]
@@ -50,18 +97,75 @@ def create_app(settings: Union[Settings, None] = None) -> FastAPI:
         redoc_url="/redoc",
         root_path="/prod",  # adding stage name to the root path
         generate_unique_id_function=custom_generate_unique_id,
+        lifespan=lifespan,
     )
     # app.state.s3_bucket_name = s3_bucket_name
     app.state.settings = settings
+    app.state.listing_page_cache = TTLCache(
+        maxsize=settings.listing_cache_max_pages,
+        ttl_seconds=settings.listing_cache_ttl_seconds,
+    )
+    app.state.object_metadata_cache = TTLCache(
+        maxsize=settings.object_metadata_cache_max_entries,
+        ttl_seconds=settings.object_metadata_cache_ttl_seconds,
+    )
+    app.state.generation_cache = TTLCache(
+        maxsize=settings.generation_cache_max_entries,
+        ttl_seconds=settings.generation_cache_ttl_seconds,
+    )
+    app.state.openai_scheduler = OpenAIScheduler.from_settings(settings)
+    app.state.generation_job_queue = create_generation_job_queue(app, settings)
     app.include_router(ROUTER)
     app.add_exception_handler(
         exc_class_or_status_code=pydantic.ValidationError,
         handler=handle_pydantic_validation_error,
     )
-    app.middleware("http")(handle_broad_exceptions)
+    app.add_middleware(BroadExceptionMiddleware)
+    if settings.server_timing_enabled:
+        # outside of the error handling, so that error responses are timed too
+        app.add_middleware(ServerTimingMiddleware)
+    if settings.metrics_enabled:
+        enable_metrics()
+        app.add_middleware(MetricsMiddleware)
+    if settings.tracing_enabled:
+        app.state.tracer = Tracer.from_settings(settings)
+        app.add_middleware(TracingMiddleware, tracer=app.state.tracer)
+    if settings.profiling_token:
+        # outermost, so that the profile covers the other middlewares too
+        app.add_middleware(ProfilingMiddleware, settings=settings)
     return app
 
 
+def create_generation_job_queue(app: FastAPI, settings: Settings) -> Union[JobQueue, None]:
+    """
+    Create the queue generation jobs are submitted to, or None if the app cannot run jobs.
+
+    On AWS Lambda, the execution environment is frozen between invocations, so jobs queued in memory would
+    stall, and their status could only be polled from the environment that queued them: jobs need SQS there.
+    """
+    handler = partial(run_generation_job, app)
+    queue_url = settings.generation_job_queue_url
+    status_bucket_name = settings.generation_job_status_s3_bucket_name
+    if queue_url and status_bucket_name:
+        return SQSJobQueue(
+            handler=handler,
+            queue_url=queue_url,
+            status_bucket_name=status_bucket_name,
+            job_ttl_seconds=settings.generation_job_ttl_seconds,
+            get_s3_client=partial(get_shared_s3_client, app),
+            # on Lambda, the SQS event source mapping delivers the messages
+            num_workers=0 if is_running_in_aws_lambda() else settings.generation_job_workers,
+        )
+    if is_running_in_aws_lambda():
+        return None
+    return InProcessJobQueue(
+        handler=handler,
+        maxsize=settings.generation_job_queue_size,
+        num_workers=settings.generation_job_workers,
+        job_ttl_seconds=settings.generation_job_ttl_seconds,
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,482 @@
+"""
+Aggregate metrics of the app: request latencies, in-flight requests, S3 and OpenAI calls, bytes and cache hits.
+
+``GET /metrics`` exposes them in the Prometheus text format. In Lambda, where nothing scrapes an execution
+environment, `flush_metrics_as_emf` prints what changed since the previous invocation in the CloudWatch
+Embedded Metric Format (EMF) instead: CloudWatch extracts the metrics from these log lines, with no API call.
+
+Updating a metric must not slow down the requests it measures, nor make the threads they use (e.g. S3 calls
+in `asyncio.to_thread`) wait for each other. So every thread updates its own cells, found by its thread id,
+and the cells of all threads are only summed when the metrics are read. No locks are taken on the hot path.
+
+The S3 and OpenAI metrics come from the phases timed with `files_api.timing.timed`: `observe_phase` is one of
+the `PHASE_OBSERVERS`. Caches already count their hits and misses, so they are only read at collection time.
+"""
+
+import bisect
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import orjson
+from starlette.types import (
+    ASGIApp,
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+from files_api.timing import PHASE_OBSERVERS
+
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+
+    from files_api.cache import TTLCache
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# the Prometheus client's default buckets, from 5 ms to 10 s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# OpenAI calls take seconds to minutes
+OPENAI_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0, 120.0)
+
+# the route of requests that match none, so that unknown paths don't create a new series each
+UNMATCHED_ROUTE = "<unmatched>"
+
+LabelValues = Tuple[str, ...]
+
+
+class MetricFamily(NamedTuple):
+    """The values of a metric, summed over all threads, by label values."""
+
+    name: str
+    documentation: str
+    type: str
+    unit: str
+    label_names: Tuple[str, ...]
+    values: Dict[LabelValues, List[float]]
+    buckets: Tuple[float, ...] = ()
+
+
+class Metric:
+    """
+    A metric with a cell of values per combination of label values, and per thread.
+
+    :param name: The name of the metric, in Prometheus style.
+    :param documentation: What the metric measures.
+    :param label_names: The names of the labels the values of each cell are given for.
+    :param unit: The CloudWatch unit of the metric, when flushed as EMF.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), unit: str = "Count"):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.unit = unit
+        self._shards: Dict[int, Dict[LabelValues, List[float]]] = {}
+
+    def _new_cell(self) -> List[float]:
+        return [0.0]
+
+    def _cell(self, label_values: LabelValues) -> List[float]:
+        # only the current thread writes to its shard, so reading and updating a cell needs no lock
+        thread_id = threading.get_ident()
+        shard = self._shards.get(thread_id)
+        if shard is None:
+            shard = self._shards[thread_id] = {}
+        cell = shard.get(label_values)
+        if cell is None:
+            cell = shard[label_values] = self._new_cell()
+        return cell
+
+    def collect(self) -> MetricFamily:
+        """Sum the cells of all threads."""
+        values: Dict[LabelValues, List[float]] = {}
+        for shard in list(self._shards.values()):
+            for label_values, cell in list(shard.items()):
+                total = values.get(label_values)
+                if total is None:
+                    values[label_values] = list(cell)
+                else:
+                    for index, value in enumerate(cell):
+                        total[index] += value
+        return MetricFamily(self.name, self.documentation, self.type, self.unit, self.label_names, values)
+
+    def reset(self) -> None:
+        """Forget every value; only safe while no other thread updates the metric."""
+        self._shards = {}
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. a number of requests."""
+
+    type = "counter"
+
+    def inc(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        self._cell(label_values)[0] += amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. a number of requests in flight."""
+
+    type = "gauge"
+
+    def inc(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        self._cell(label_values)[0] += amount
+
+    def dec(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        self._cell(label_values)[0] -= amount
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, e.g. latencies, as counts per bucket, their sum and their count.
+
+    :param buckets: The upper bounds of the buckets, in increasing order; an infinite bucket is implied.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        unit: str = "Seconds",
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names, unit)
+        self.buckets = tuple(buckets)
+
+    def _new_cell(self) -> List[float]:
+        # a (non-cumulative) count per bucket and for the infinite bucket, then the sum and the count
+        return [0.0] * (len(self.buckets) + 3)
+
+    def observe(self, label_values: LabelValues, value: float) -> None:
+        cell = self._cell(label_values)
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def collect(self) -> MetricFamily:
+        return super().collect()._replace(buckets=self.buckets)
+
+
+HTTP_REQUESTS = Counter(
+    "files_api_http_requests_total",
+    "Number of completed HTTP requests.",
+    ("method", "route", "status"),
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "files_api_http_request_duration_seconds",
+    "Time to handle an HTTP request, until its response is complete.",
+    ("method", "route"),
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "files_api_http_requests_in_flight",
+    "Number of HTTP requests being handled.",
+    ("method",),
+)
+HTTP_BODY_BYTES = Counter(
+    "files_api_http_body_bytes_total",
+    'Bytes of request bodies received (direction "in") and of response bodies sent (direction "out").',
+    ("route", "direction"),
+    unit="Bytes",
+)
+S3_OPERATIONS = Counter(
+    "files_api_s3_operations_total",
+    "Number of S3 operations, by operation (head, get, put, list, ...) and outcome.",
+    ("operation", "status"),
+)
+S3_OPERATION_DURATION = Histogram(
+    "files_api_s3_operation_duration_seconds",
+    "Duration of S3 operations.",
+    ("operation",),
+)
+OPENAI_REQUESTS = Counter(
+    "files_api_openai_requests_total",
+    "Number of OpenAI calls, retries included, by model and outcome.",
+    ("model", "status"),
+)
+OPENAI_REQUEST_DURATION = Histogram(
+    "files_api_openai_request_duration_seconds",
+    "Duration of OpenAI calls (until the response starts, for streamed responses).",
+    ("model",),
+    buckets=OPENAI_BUCKETS,
+)
+
+METRICS: Tuple[Metric, ...] = (
+    HTTP_REQUESTS,
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS_IN_FLIGHT,
+    HTTP_BODY_BYTES,
+    S3_OPERATIONS,
+    S3_OPERATION_DURATION,
+    OPENAI_REQUESTS,
+    OPENAI_REQUEST_DURATION,
+)
+
+
+def observe_phase(
+    phase: str, duration_seconds: float, error: Optional[BaseException], labels: Mapping[str, str]
+) -> None:
+    """Count the S3 (``s3-<operation>``) and OpenAI (``openai-<kind>``) phases timed by `files_api.timing`."""
+    service, _, operation = phase.partition("-")
+    if error is None:
+        status = "ok"
+    else:
+        # the OpenAI client raises rate limit errors with the status code 429
+        status = "throttled" if getattr(error, "status_code", None) == 429 else "error"
+    if service == "s3":
+        S3_OPERATIONS.inc((operation, status))
+        S3_OPERATION_DURATION.observe((operation,), duration_seconds)
+    elif service == "openai":
+        model = labels.get("model", operation)
+        OPENAI_REQUESTS.inc((model, status))
+        OPENAI_REQUEST_DURATION.observe((model,), duration_seconds)
+
+
+def enable_metrics() -> None:
+    """Start counting the S3 and OpenAI calls of the process; calling it again has no effect."""
+    if observe_phase not in PHASE_OBSERVERS:
+        PHASE_OBSERVERS.append(observe_phase)
+
+
+def reset_metrics(caches: Optional[Mapping[str, "TTLCache"]] = None) -> None:
+    """
+    Start all metrics, and the hit and miss counts of the given caches, over from zero.
+
+    Meant for the init phase (e.g. after priming), while no request is being handled.
+    """
+    for metric in METRICS:
+        metric.reset()
+    for cache in (caches or {}).values():
+        cache.hits = cache.misses = 0
+    LAST_FLUSHED_VALUES.clear()
+
+
+def get_app_caches(app: "FastAPI") -> Dict[str, "TTLCache"]:
+    """Return the caches of the app, by name."""
+    return {
+        "listing_page": app.state.listing_page_cache,
+        "object_metadata": app.state.object_metadata_cache,
+        "generation": app.state.generation_cache,
+    }
+
+
+def collect_cache_metrics(caches: Mapping[str, "TTLCache"]) -> List[MetricFamily]:
+    """Read the hits and misses counted by each cache, and their hit ratio if they were looked up at all."""
+    hits: Dict[LabelValues, List[float]] = {}
+    misses: Dict[LabelValues, List[float]] = {}
+    hit_ratios: Dict[LabelValues, List[float]] = {}
+    for name, cache in caches.items():
+        num_hits, num_misses = cache.hits, cache.misses
+        hits[(name,)] = [float(num_hits)]
+        misses[(name,)] = [float(num_misses)]
+        # a cache that was never looked up has no hit ratio (rather than a ratio of 0 that looks like misses)
+        if num_hits + num_misses:
+            hit_ratios[(name,)] = [num_hits / (num_hits + num_misses)]
+    return [
+        MetricFamily(
+            "files_api_cache_hits_total",
+            "Number of cache lookups that found a value.",
+            "counter",
+            "Count",
+            ("cache",),
+            hits,
+        ),
+        MetricFamily(
+            "files_api_cache_misses_total",
+            "Number of cache lookups that found nothing.",
+            "counter",
+            "Count",
+            ("cache",),
+            misses,
+        ),
+        MetricFamily(
+            "files_api_cache_hit_ratio",
+            "Share of cache lookups that found a value.",
+            "gauge",
+            "None",
+            ("cache",),
+            hit_ratios,
+        ),
+    ]
+
+
+def collect_metrics(caches: Optional[Mapping[str, "TTLCache"]] = None) -> List[MetricFamily]:
+    """Collect all metrics of the process, and of the given caches."""
+    return [metric.collect() for metric in METRICS] + collect_cache_metrics(caches or {})
+
+
+def render_prometheus_text(families: Sequence[MetricFamily]) -> str:
+    """Format metrics in the Prometheus text exposition format."""
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family.name} {family.documentation}")
+        lines.append(f"# TYPE {family.name} {family.type}")
+        for label_values, values in sorted(family.values.items()):
+            labels = list(zip(family.label_names, label_values))
+            if family.type != "histogram":
+                lines.append(f"{family.name}{format_labels(labels)} {format_number(values[0])}")
+                continue
+            cumulative_count = 0.0
+            for upper_bound, count in zip(family.buckets + (float("inf"),), values):
+                cumulative_count += count
+                bucket_labels = format_labels(labels + [("le", format_number(upper_bound))])
+                lines.append(f"{family.name}_bucket{bucket_labels} {format_number(cumulative_count)}")
+            lines.append(f"{family.name}_sum{format_labels(labels)} {format_number(values[-2])}")
+            lines.append(f"{family.name}_count{format_labels(labels)} {format_number(values[-1])}")
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+# the values of the metrics at the previous EMF flush, to report only what changed since
+LAST_FLUSHED_VALUES: Dict[Tuple[str, LabelValues], List[float]] = {}
+
+
+def format_emf_documents(
+    families: Sequence[MetricFamily],
+    namespace: str,
+    last_flushed_values: Dict[Tuple[str, LabelValues], List[float]],
+) -> List[dict]:
+    """
+    Format what changed in the metrics since the last flush as CloudWatch Embedded Metric Format documents.
+
+    Counters are reported as their increase, histograms as the number and average of the new observations
+    (``<name>_count`` and ``<name>_average``), and gauges as their current value, if it changed. Metrics with
+    the same labels share a document, whose dimensions are these labels.
+
+    :param families: The metrics, as collected.
+    :param namespace: The CloudWatch namespace of the metrics.
+    :param last_flushed_values: The values at the last flush, updated in place.
+
+    :return: One JSON-serializable document per combination of label names and values.
+    """
+    documents: Dict[Tuple[Tuple[str, str], ...], Dict[str, Tuple[float, str]]] = {}
+    for family in families:
+        for label_values, values in family.values.items():
+            previous_values = last_flushed_values.get((family.name, label_values))
+            last_flushed_values[(family.name, label_values)] = values
+            document = documents.setdefault(tuple(zip(family.label_names, label_values)), {})
+            if family.type == "gauge":
+                if values != previous_values:
+                    document[family.name] = (values[0], family.unit)
+                continue
+            new_values = [value - previous for value, previous in zip(values, previous_values or [0.0] * len(values))]
+            if family.type == "histogram":
+                if new_values[-1]:
+                    document[f"{family.name}_count"] = (new_values[-1], "Count")
+                    document[f"{family.name}_average"] = (new_values[-2] / new_values[-1], family.unit)
+            elif new_values[0]:
+                document[family.name] = (new_values[0], family.unit)
+
+    timestamp_ms = int(time.time() * 1000)
+    return [
+        {
+            "_aws": {
+                "Timestamp": timestamp_ms,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [[name for name, _ in labels]],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+                    }
+                ],
+            },
+            **dict(labels),
+            **{name: value for name, (value, _) in metrics.items()},
+        }
+        for labels, metrics in documents.items()
+        if metrics
+    ]
+
+
+def flush_metrics_as_emf(namespace: str, caches: Optional[Mapping[str, "TTLCache"]] = None) -> None:
+    """Print what changed in the metrics since the last flush as EMF log lines, e.g. after a Lambda invocation."""
+    for document in format_emf_documents(collect_metrics(caches), namespace, LAST_FLUSHED_VALUES):
+        print(orjson.dumps(document).decode("utf-8"), flush=True)
+
+
+def get_route_template(scope: Scope) -> str:
+    """The path template of the route a request matched, e.g. ``/v1/files/{file_path:path}``."""
+    route = scope.get("route")
+    return getattr(route, "path", UNMATCHED_ROUTE)
+
+
+class MetricsMiddleware:
+    """
+    Count every HTTP request, its duration and body sizes by route, and the requests in flight.
+
+    A pure ASGI middleware, like `files_api.timing.ServerTimingMiddleware`. The route is read from the scope
+    once the app has handled the request, since routing happens inside the app.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start = time.perf_counter()
+        status_code = 500
+        bytes_received = 0
+        bytes_sent = 0
+
+        async def receive_and_count() -> Message:
+            nonlocal bytes_received
+            message = await receive()
+            if message["type"] == "http.request":
+                bytes_received += len(message.get("body", b""))
+            return message
+
+        async def count_and_send(message: Message) -> None:
+            nonlocal status_code, bytes_sent
+            if message["type"] == "http.response.body":
+                bytes_sent += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc((method,))
+        try:
+            await self.app(scope, receive_and_count, count_and_send)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec((method,))
+            route = get_route_template(scope)
+            HTTP_REQUESTS.inc((method, route, str(status_code)))
+            HTTP_REQUEST_DURATION.observe((method, route), time.perf_counter() - start)
+            if bytes_received:
+                HTTP_BODY_BYTES.inc((route, "in"), bytes_received)
+            if bytes_sent:
+                HTTP_BODY_BYTES.inc((route, "out"), bytes_sent)
@@ -0,0 +1,350 @@
+"""
+Schedule the calls to OpenAI: limit their concurrency and rate per model, back off on 429s, coalesce duplicates.
+
+OpenAI enforces its rate limits per model, in requests and tokens per minute. Firing every call as soon as it
+is requested makes a burst overshoot the limit, and every caller then retries on its own schedule, so the
+throughput oscillates between 429 storms and idle gaps. Instead, each model gets a `ModelLimiter`:
+
+- a semaphore caps the calls in flight,
+- token buckets pace the calls to the requests and tokens per minute allowed, either configured or learned
+  from the ``x-ratelimit-limit-*`` headers OpenAI sends along with a 429,
+- a 429 pauses the whole model until OpenAI says its limit resets (``retry-after``, ``x-ratelimit-reset-*``)
+  rather than only the caller that got it, and the calls are retried after that, with jitter, so they don't
+  all fire again at the same instant.
+
+Identical calls made while one of them is in flight (e.g. the same prompt requested twice at once) are
+coalesced: they share the result of a single call.
+"""
+
+import asyncio
+import logging
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from files_api.settings import Settings
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# how many seconds of a model's rate limit can be spent at once after an idle period
+BURST_SECONDS = 1.0
+
+# status codes of OpenAI errors that are worth retrying
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429})
+
+# durations of the x-ratelimit-reset-* headers, e.g. "1s", "6m0s", "1h2m3.5s" or "20ms"
+DURATION_PART_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNIT_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class TokenBucket:
+    """
+    Pace the use of a resource to ``rate_per_minute`` units, allowing bursts of ``burst_seconds`` worth of them.
+
+    Units are reserved up front, going into debt if there are not enough of them: the callers then wait for
+    the debt to be paid back in the order they reserved, without polling.
+    """
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate_per_minute = rate_per_minute
+        self.burst_seconds = burst_seconds
+        self._available = self.capacity
+        self._updated_at = time.monotonic()
+
+    @property
+    def capacity(self) -> float:
+        return self.rate_per_minute / 60 * self.burst_seconds
+
+    def reserve(self, units: float) -> float:
+        """Take ``units`` from the bucket and return how many seconds to wait before using them."""
+        now = time.monotonic()
+        rate_per_second = self.rate_per_minute / 60
+        self._available = min(self.capacity, self._available + (now - self._updated_at) * rate_per_second)
+        self._updated_at = now
+        self._available -= units
+        return max(0.0, -self._available / rate_per_second)
+
+
+class ModelLimiter:
+    """
+    The concurrency and rate limits of one model.
+
+    :param max_concurrency: Maximum number of calls in flight.
+    :param requests_per_minute: The requests allowed per minute, or None if unknown (yet).
+    :param tokens_per_minute: The tokens allowed per minute, or None if unknown (yet).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+    ):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0) -> AsyncIterator[None]:
+        """Wait until a call using ``tokens`` tokens fits within the limits, and hold its place while it runs."""
+        async with self.semaphore:
+            await self.wait_until_resumed()
+            delay = max(
+                self.requests.reserve(1) if self.requests else 0.0,
+                self.tokens.reserve(tokens) if self.tokens and tokens else 0.0,
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield
+
+    async def wait_until_resumed(self) -> None:
+        while (delay := self.paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every call to the model for ``seconds``, e.g. until its rate limit resets."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def learn_limits(self, headers: Mapping[str, str]) -> None:
+        """Pace the calls to the limits OpenAI reports in the ``x-ratelimit-limit-*`` headers of a response."""
+        requests_per_minute = parse_float(headers.get("x-ratelimit-limit-requests"))
+        if requests_per_minute:
+            if self.requests is None:
+                self.requests = TokenBucket(requests_per_minute)
+            self.requests.rate_per_minute = requests_per_minute
+        tokens_per_minute = parse_float(headers.get("x-ratelimit-limit-tokens"))
+        if tokens_per_minute:
+            if self.tokens is None:
+                self.tokens = TokenBucket(tokens_per_minute)
+            self.tokens.rate_per_minute = tokens_per_minute
+
+
+class SchedulerConfig(NamedTuple):
+    """
+    The limits and retry policy of an `OpenAIScheduler`.
+
+    :param max_concurrency: Maximum number of calls in flight per model.
+    :param requests_per_minute: The requests allowed per minute for some models, by model name.
+    :param tokens_per_minute: The tokens allowed per minute for some models, by model name.
+    :param max_attempts: How many times a call is attempted before its error is raised.
+    :param backoff_base_seconds: The delay before the first retry when OpenAI does not tell how long to wait;
+        it doubles with every attempt.
+    :param backoff_max_seconds: The longest delay between two attempts.
+    """
+
+    max_concurrency: int
+    requests_per_minute: Optional[Mapping[str, float]] = None
+    tokens_per_minute: Optional[Mapping[str, float]] = None
+    max_attempts: int = 5
+    backoff_base_seconds: float = 0.5
+    backoff_max_seconds: float = 30.0
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "SchedulerConfig":
+        return cls(
+            max_concurrency=settings.openai_max_concurrency_per_model,
+            requests_per_minute=settings.openai_requests_per_minute,
+            tokens_per_minute=settings.openai_tokens_per_minute,
+            max_attempts=settings.openai_max_attempts,
+            backoff_base_seconds=settings.openai_backoff_base_seconds,
+            backoff_max_seconds=settings.openai_backoff_max_seconds,
+        )
+
+
+class OpenAIScheduler:
+    """
+    Run the calls to OpenAI within the limits of their models, retrying the ones that failed transiently.
+
+    The calls must not retry on their own, i.e. use an OpenAI client with ``max_retries=0``.
+
+    :param config: The limits of the models and how calls are retried.
+    """
+
+    def __init__(self, config: SchedulerConfig):
+        self.config = config
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._in_flight: Dict[Hashable, "asyncio.Future"] = {}
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "OpenAIScheduler":
+        return cls(SchedulerConfig.from_settings(settings))
+
+    def limiter(self, model: str) -> ModelLimiter:
+        """Return the limiter of a model, creating it on first use."""
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limiter = ModelLimiter(
+                max_concurrency=self.config.max_concurrency,
+                requests_per_minute=(self.config.requests_per_minute or {}).get(model),
+                tokens_per_minute=(self.config.tokens_per_minute or {}).get(model),
+            )
+            self._limiters[model] = limiter
+        return limiter
+
+    async def call(
+        self,
+        model: str,
+        make_call: Callable[[], Awaitable[T]],
+        tokens: int = 0,
+        coalesce_key: Optional[Hashable] = None,
+    ) -> T:
+        """
+        Call OpenAI within the limits of ``model``, retrying on rate limits and transient errors.
+
+        :param model: The model called, whose limits apply.
+        :param make_call: Makes the call; called again for every attempt.
+        :param tokens: The tokens the call counts against the model's limit (prompt and maximum completion).
+        :param coalesce_key: Identifies what the call computes: a call with the same key as a call in flight
+            is not made, it returns the result of the call in flight instead.
+        """
+        if coalesce_key is None:
+            return await self._call_with_retries(model, make_call, tokens)
+
+        key = (model, coalesce_key)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call_with_retries(model, make_call, tokens))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done_task: self._forget_in_flight(key, done_task))
+        # a caller that goes away must not cancel the call for the others waiting on it
+        return await asyncio.shield(task)
+
+    @asynccontextmanager
+    async def slot(self, model: str, tokens: int = 0) -> AsyncIterator[None]:
+        """
+        Hold a place within the limits of ``model`` for a call that cannot be retried, e.g. a streamed response.
+
+        A 429 raised from within still pauses the model, so that the other calls back off.
+        """
+        limiter = self.limiter(model)
+        async with limiter.slot(tokens):
+            try:
+                yield
+            except Exception as err:
+                if getattr(err, "status_code", None) == 429:
+                    self._back_off_rate_limit(limiter, attempt=1, err=err)
+                raise
+
+    async def _call_with_retries(self, model: str, make_call: Callable[[], Awaitable[T]], tokens: int) -> T:
+        limiter = self.limiter(model)
+        client_errors = get_openai_client_errors()
+        attempt = 1
+        while True:
+            async with limiter.slot(tokens):
+                try:
+                    return await make_call()
+                except client_errors as err:
+                    if attempt >= self.config.max_attempts or not is_retryable(err):
+                        raise
+                    error = err
+            if getattr(error, "status_code", None) == 429:
+                delay = self._back_off_rate_limit(limiter, attempt=attempt, err=error)
+            else:
+                delay = self.backoff_seconds(attempt, headers=getattr(getattr(error, "response", None), "headers", {}))
+            LOGGER.warning("Retrying a call to %s in %.2fs (attempt %d): %s", model, delay, attempt, error)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _back_off_rate_limit(self, limiter: ModelLimiter, attempt: int, err: Exception) -> float:
+        """Pause the model after a 429, adopting the limits it reports; return the delay before a retry."""
+        headers = getattr(getattr(err, "response", None), "headers", {})
+        limiter.learn_limits(headers)
+        delay = self.backoff_seconds(attempt, headers=headers)
+        limiter.pause(delay)
+        return delay
+
+    def backoff_seconds(self, attempt: int, headers: Mapping[str, str]) -> float:
+        """
+        Return how long to wait before the next attempt, with jitter.
+
+        Waits as long as the response headers ask, if they do, and otherwise backs off exponentially.
+        """
+        delay = retry_delay_seconds(headers)
+        if delay is not None:
+            return min(delay, self.config.backoff_max_seconds) * random.uniform(1.0, 1.1)
+        backoff = min(self.config.backoff_base_seconds * 2 ** (attempt - 1), self.config.backoff_max_seconds)
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def _forget_in_flight(self, key: Hashable, task: "asyncio.Future") -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # mark the error as retrieved, in case every caller went away
+            task.exception()
+
+
+def get_openai_client_errors() -> Tuple[Type[Exception], ...]:
+    """
+    Return the errors a call made with the OpenAI client can fail with.
+
+    Besides its own errors, the client lets the transport errors of ``httpx2`` (which it is built on) through
+    while a streamed response is read.
+    """
+    # imported here, since importing `openai` takes hundreds of milliseconds (see `files_api.generate`)
+    import httpx2  # pylint: disable=import-outside-toplevel
+    from openai import APIError  # pylint: disable=import-outside-toplevel
+
+    return (APIError, httpx2.TransportError)
+
+
+def is_retryable(err: Exception) -> bool:
+    """Whether an error of the OpenAI client is transient: a rate limit, a timeout, a server or network error."""
+    import httpx2  # pylint: disable=import-outside-toplevel
+    from openai import (  # pylint: disable=import-outside-toplevel
+        APIConnectionError,
+        APIStatusError,
+    )
+
+    if isinstance(err, (APIConnectionError, httpx2.TransportError)):
+        return True
+    return isinstance(err, APIStatusError) and (err.status_code in RETRYABLE_STATUS_CODES or err.status_code >= 500)
+
+
+def retry_delay_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Return how long the headers of an OpenAI response ask to wait before retrying, if they do.
+
+    ``retry-after-ms`` and ``retry-after`` say so directly; otherwise, the limits that are exhausted
+    (``x-ratelimit-remaining-*`` is 0) reset after ``x-ratelimit-reset-*``.
+    """
+    retry_after_ms = parse_float(headers.get("retry-after-ms"))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    retry_after = parse_float(headers.get("retry-after"))
+    if retry_after is not None:
+        return retry_after
+    resets = [
+        parse_duration_seconds(headers.get(f"x-ratelimit-reset-{limit}", ""))
+        for limit in ("requests", "tokens")
+        if parse_float(headers.get(f"x-ratelimit-remaining-{limit}")) == 0
+    ]
+    return max(resets) if resets else None
+
+
+def parse_duration_seconds(duration: str) -> float:
+    """Parse a duration such as "6m0s" or "20ms" into seconds."""
+    return sum(float(value) * DURATION_UNIT_SECONDS[unit] for value, unit in DURATION_PART_PATTERN.findall(duration))
+
+
+def parse_float(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
@@ -0,0 +1,145 @@
+"""
+Warm an app up before it serves its first request.
+
+On AWS Lambda, module-level code runs in the init phase, before the first invocation is handed to the
+function (and, with provisioned concurrency or SnapStart, before any client is waiting at all). Work done
+here is work the first request no longer pays for:
+
+- the shared clients are built (service model loading, credential resolution, connection pools),
+- read-only warm-up requests are sent through the app, which exercises routing, dependency resolution,
+  query validation and response serialization for the first time, and opens a pooled, TLS-established
+  connection to S3,
+- optionally, the hostnames of the S3 and OpenAI endpoints are resolved so their DNS answers are cached.
+
+The warm-up requests are not real traffic, so the metrics they updated are reset afterwards.
+
+Priming never fails the app: a failed warm-up is logged and the first real request simply pays the cost.
+"""
+
+import asyncio
+import logging
+import socket
+import time
+from contextlib import contextmanager
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Tuple,
+)
+from urllib.parse import urlsplit
+
+from fastapi import FastAPI
+from starlette.types import (
+    Message,
+    Scope,
+)
+
+from files_api.clients import (
+    get_shared_openai_client,
+    get_shared_s3_client,
+)
+from files_api.metrics import (
+    get_app_caches,
+    reset_metrics,
+)
+from files_api.settings import Settings
+
+LOGGER = logging.getLogger(__name__)
+
+# Read-only requests that exercise the most common code paths without changing anything in the bucket.
+# The HEAD request targets a key that does not exist on purpose: it warms up `head_object` and the 404 path.
+WARMUP_REQUESTS: List[Tuple[str, str, str]] = [
+    ("GET", "/v1/files", "page_size=1"),
+    ("HEAD", "/v1/files/.files-api-warmup", ""),
+]
+
+
+def prime_app(app: FastAPI) -> Dict[str, float]:
+    """
+    Build the app's shared clients and warm up its request path.
+
+    Meant to be called from module-level (init) code, outside of any running event loop.
+
+    :param app: The app to prime.
+
+    :return: Seconds spent in each priming step, by step name.
+    """
+    settings: Settings = app.state.settings
+    timings: Dict[str, float] = {}
+    endpoint_urls: List[str] = []
+
+    with timed_step("s3_client", timings):
+        endpoint_urls.append(get_shared_s3_client(app).meta.endpoint_url)
+
+    if settings.prime_openai_client:
+        with timed_step("openai_client", timings):
+            endpoint_urls.append(str(get_shared_openai_client(app).base_url))
+
+    if settings.prime_resolve_endpoints:
+        with timed_step("resolve_endpoints", timings):
+            for endpoint_url in endpoint_urls:
+                resolve_endpoint(endpoint_url)
+
+    if settings.prime_warmup_requests:
+        with timed_step("warmup_requests", timings):
+            for method, path, query_string in WARMUP_REQUESTS:
+                asyncio.run(send_warmup_request(app, method=method, path=path, query_string=query_string))
+        if settings.metrics_enabled:
+            # so that the first metrics flushed only count real requests
+            reset_metrics(get_app_caches(app))
+
+    return timings
+
+
+@contextmanager
+def timed_step(name: str, timings: Dict[str, float]) -> Iterator[None]:
+    """Record how long a priming step took in ``timings``, logging (not raising) its failures."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:  # pylint: disable=broad-except
+        LOGGER.warning("Priming step %r failed", name, exc_info=True)
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def resolve_endpoint(endpoint_url: str) -> None:
+    """Resolve the hostname of an endpoint so the answer is in the resolver's cache for the first request."""
+    parts = urlsplit(endpoint_url)
+    if parts.hostname:
+        socket.getaddrinfo(parts.hostname, parts.port or 443, proto=socket.IPPROTO_TCP)
+
+
+async def send_warmup_request(app: FastAPI, method: str, path: str, query_string: str = "") -> int:
+    """
+    Send a request straight to the ASGI app, without a server.
+
+    :return: The status code of the response.
+    """
+    scope: Scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "root_path": "",
+        "query_string": query_string.encode("utf-8"),
+        "headers": [(b"host", b"warmup")],
+        "client": ("127.0.0.1", 0),
+        "server": ("warmup", 80),
+    }
+    status_code = 0
+
+    async def receive() -> Message:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Message) -> None:
+        nonlocal status_code
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+
+    await app(scope, receive, send)
+    return status_code
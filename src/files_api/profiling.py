@@ -0,0 +1,363 @@
+"""
+Profile the CPU time and the memory allocations of a single request, on demand.
+
+A request sent with the ``X-Profile`` header set to the `profiling_token` setting is profiled by
+`ProfilingMiddleware`; profiling is disabled while that setting is unset. The profile has two parts:
+
+- ``cpu``: a statistical (wall-clock) profile. A background thread samples the stacks of the app's threads
+  every `profiling_sample_interval_seconds`, i.e. the event loop and the workers running blocking calls, and
+  counts them as folded stacks (``outer;inner;innermost count``, ready for ``flamegraph.pl`` or speedscope)
+  and per function. Idle threads (an event loop waiting for I/O, a pool worker waiting for work) are skipped.
+- ``memory``: the peak of the memory allocated while the request ran, and the lines that allocated the
+  memory alive near that peak, from `tracemalloc`, each with the lines of the app that led to it. A buffer
+  read whole, such as ``await file.read()``, shows up here even though it is freed before the request ends.
+
+The profile is uploaded to the `profiling_s3_bucket_name` bucket, whose location is returned in the
+``X-Profile-Location`` header. If that setting is unset, the profile replaces the response body instead.
+
+The sampler sees every thread of the process and `tracemalloc` every allocation, so other requests served at
+the same time show up in the profile too; profile on an otherwise idle instance. Only one request is profiled
+at a time, and `tracemalloc` slows down the process while it runs.
+"""
+
+import asyncio
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+import orjson
+from starlette.types import (
+    ASGIApp,
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+from files_api.clients import get_shared_s3_client
+from files_api.s3.write_objects import upload_s3_object
+from files_api.settings import Settings
+
+LOGGER = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_LOCATION_HEADER = b"x-profile-location"
+
+# the directory of this package, to find the app's own lines in the traceback of an allocation
+APP_PACKAGE = os.path.dirname(__file__)
+# the app's lines reported per allocation, innermost first
+MAX_APP_FRAMES = 5
+
+# frames kept per allocation, enough to reach the app's code from deep inside libraries
+TRACEBACK_FRAMES = 32
+
+# a memory snapshot is taken whenever the traced memory grows this much past the last snapshot
+MEMORY_SNAPSHOT_STEP_BYTES = 1024 * 1024
+
+# innermost frames of threads that wait for something to do, by file name and function
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+}
+
+# only one request is profiled at a time: the sampler and `tracemalloc` see the whole process
+PROFILING_LOCK = threading.Lock()
+
+
+class StackSamples:
+    """The stacks of the app's busy threads seen by the sampler, counted as folded stacks."""
+
+    def __init__(self):
+        self.stack_counts: Dict[Tuple[str, ...], int] = Counter()
+        self.num_samples = 0
+
+    def sample(self, own_thread_id: int) -> None:
+        """Count the current stack of every thread that is not waiting for work, but the sampler's own."""
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if thread_id == own_thread_id:
+                continue
+            stack = collapse_stack(frame)
+            if stack is not None:
+                self.stack_counts[(thread_names.get(thread_id, str(thread_id)),) + stack] += 1
+        self.num_samples += 1
+
+    def folded_stacks(self) -> List[str]:
+        return [f"{';'.join(stack)} {count}" for stack, count in self.stack_counts.most_common()]  # type: ignore
+
+    def top_functions(self, top_entries: int) -> List[dict]:
+        self_counts: Dict[str, int] = Counter()
+        total_counts: Dict[str, int] = Counter()
+        for stack, count in self.stack_counts.items():
+            self_counts[stack[-1]] += count
+            for function in set(stack[1:]):
+                total_counts[function] += count
+        # the functions the threads were in when sampled come first, then the ones calling them
+        functions = sorted(total_counts, key=lambda function: (self_counts[function], total_counts[function]))
+        start = max(len(functions) - top_entries, 0)
+        return [
+            {"function": function, "self_samples": self_counts[function], "total_samples": total_counts[function]}
+            for function in reversed(functions[start:])
+        ]
+
+
+class MemorySnapshots:
+    """The `tracemalloc` snapshots of the memory allocated before a request and near its peak while it ran."""
+
+    def __init__(self):
+        self.peak_memory_bytes = 0
+        self._started_tracemalloc = False
+        self._baseline_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._baseline_bytes = 0
+        self._peak_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._peak_snapshot_bytes = 0
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_FRAMES)
+            self._started_tracemalloc = True
+        self._baseline_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        self._baseline_bytes = self._peak_snapshot_bytes = tracemalloc.get_traced_memory()[0]
+
+    def sample(self) -> None:
+        """Take a new peak snapshot if the traced memory grew enough since the last one."""
+        current_memory_bytes = tracemalloc.get_traced_memory()[0]
+        if current_memory_bytes >= self._peak_snapshot_bytes + MEMORY_SNAPSHOT_STEP_BYTES:
+            self._peak_snapshot = tracemalloc.take_snapshot()
+            self._peak_snapshot_bytes = current_memory_bytes
+
+    def stop(self) -> None:
+        self.peak_memory_bytes = tracemalloc.get_traced_memory()[1] - self._baseline_bytes
+        if self._peak_snapshot is None:
+            self._peak_snapshot = tracemalloc.take_snapshot()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    def top_allocations(self, top_entries: int) -> List[dict]:
+        if self._baseline_snapshot is None or self._peak_snapshot is None:
+            return []
+        ignored_files = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        differences = self._peak_snapshot.filter_traces(ignored_files).compare_to(
+            self._baseline_snapshot.filter_traces(ignored_files), "traceback"
+        )
+        return [
+            {
+                "location": format_frame(difference.traceback[-1]),
+                "app_frames": [
+                    format_frame(frame, relative_to=APP_PACKAGE)
+                    for frame in reversed(difference.traceback)
+                    if frame.filename.startswith(APP_PACKAGE)
+                ][:MAX_APP_FRAMES],
+                "size_bytes": difference.size_diff,
+                "count": difference.count_diff,
+            }
+            for difference in differences[:top_entries]
+            if difference.size_diff > 0
+        ]
+
+
+class RequestProfiler:
+    """
+    Sample the stacks of all threads and track the peak of the traced memory until stopped.
+
+    :param sample_interval_seconds: Time between two samples of the stacks.
+    """
+
+    def __init__(self, sample_interval_seconds: float = 0.005):
+        self.sample_interval_seconds = sample_interval_seconds
+        self.stacks = StackSamples()
+        self.memory = MemorySnapshots()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample_until_stopped, name="request-profiler", daemon=True)
+        self._started_at = 0.0
+        self.duration_seconds = 0.0
+
+    def start(self) -> None:
+        self.memory.start()
+        self._started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.duration_seconds = time.perf_counter() - self._started_at
+        self._stopped.set()
+        self._thread.join()
+        self.memory.stop()
+
+    def _sample_until_stopped(self) -> None:
+        own_thread_id = threading.get_ident()
+        while not self._stopped.wait(self.sample_interval_seconds):
+            self.stacks.sample(own_thread_id)
+            self.memory.sample()
+
+    def to_dict(self, top_entries: int = 30) -> dict:
+        """
+        Summarize the profile: the folded stacks and top functions, and the top allocating lines.
+
+        :param top_entries: Number of functions and allocating lines reported, by decreasing cost.
+        """
+        return {
+            "duration_ms": round(self.duration_seconds * 1000, 1),
+            "cpu": {
+                "sample_interval_ms": self.sample_interval_seconds * 1000,
+                "num_samples": self.stacks.num_samples,
+                "top_functions": self.stacks.top_functions(top_entries),
+                "folded_stacks": self.stacks.folded_stacks(),
+            },
+            "memory": {
+                "peak_bytes": self.memory.peak_memory_bytes,
+                "top_allocations": self.memory.top_allocations(top_entries),
+            },
+        }
+
+
+def format_frame(frame: tracemalloc.Frame, relative_to: Optional[str] = None) -> str:
+    filename = os.path.relpath(frame.filename, relative_to) if relative_to else frame.filename
+    return f"{filename}:{frame.lineno}"
+
+
+def collapse_stack(frame) -> Optional[Tuple[str, ...]]:
+    """Return the functions of a stack, outermost first, or None if the thread is waiting for work."""
+    if (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+        return None
+    functions = []
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "?")
+        functions.append(f"{module}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return tuple(reversed(functions))
+
+
+def get_header(scope: Scope, name: bytes) -> Optional[bytes]:
+    for header_name, value in scope["headers"]:
+        if header_name == name:
+            return value
+    return None
+
+
+def is_profiling_requested(scope: Scope, token: Optional[str]) -> bool:
+    """Whether the request carries the profiling token, compared in constant time."""
+    if not token:
+        return False
+    header = get_header(scope, PROFILE_HEADER)
+    return header is not None and hmac.compare_digest(header, token.encode("utf-8"))
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests that ask for it with a valid ``X-Profile`` token, and store or return the profile.
+
+    A pure ASGI middleware, like `files_api.timing.ServerTimingMiddleware`; requests without the header only
+    pay for a header lookup.
+    """
+
+    def __init__(self, app: ASGIApp, settings: Settings):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not is_profiling_requested(scope, self.settings.profiling_token):
+            await self.app(scope, receive, send)
+            return
+        # not `with PROFILING_LOCK`: a request that finds another one being profiled must not wait for it
+        if not PROFILING_LOCK.acquire(blocking=False):  # pylint: disable=consider-using-with
+            # another request is being profiled; serve this one as usual
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            bucket_name = self.settings.profiling_s3_bucket_name
+            if bucket_name:
+                await self.profile_and_store(scope, receive, send, bucket_name=bucket_name)
+            else:
+                await self.profile_and_return(scope, receive, send)
+        finally:
+            PROFILING_LOCK.release()
+
+    def start_profiler(self) -> RequestProfiler:
+        profiler = RequestProfiler(sample_interval_seconds=self.settings.profiling_sample_interval_seconds)
+        profiler.start()
+        return profiler
+
+    async def profile_and_store(self, scope: Scope, receive: Receive, send: Send, bucket_name: str) -> None:
+        """Serve the request as usual, then upload its profile to S3, at the location announced in a header."""
+        object_key = f"{self.settings.profiling_s3_prefix}{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-"
+        object_key += f"{uuid.uuid4().hex}.json"
+
+        async def send_with_profile_location(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_LOCATION_HEADER, f"s3://{bucket_name}/{object_key}".encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = self.start_profiler()
+        try:
+            await self.app(scope, receive, send_with_profile_location)
+        finally:
+            profiler.stop()
+            profile = {
+                "method": scope["method"],
+                "path": scope["path"],
+                **profiler.to_dict(top_entries=self.settings.profiling_top_entries),
+            }
+            try:
+                await asyncio.to_thread(
+                    upload_s3_object,
+                    bucket_name=bucket_name,
+                    object_key=object_key,
+                    file_content=orjson.dumps(profile),
+                    content_type="application/json",
+                    s3_client=get_shared_s3_client(scope["app"]),
+                )
+            except Exception:  # pylint: disable=broad-except
+                # the response was already sent, so the profile is only lost
+                LOGGER.exception("Could not store the profile of %s %s", scope["method"], scope["path"])
+
+    async def profile_and_return(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Serve the request, discarding its response, and respond with its profile instead."""
+        status_code = 500
+        body_bytes = 0
+
+        async def discard(message: Message) -> None:
+            nonlocal status_code, body_bytes
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+
+        profiler = self.start_profiler()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            profiler.stop()
+
+        profile = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "response": {"status": status_code, "body_bytes": body_bytes},
+            **profiler.to_dict(top_entries=self.settings.profiling_top_entries),
+        }
+        body = orjson.dumps(profile)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
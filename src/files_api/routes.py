@@ -1,11 +1,19 @@
 """FastAPI application for managing files in an S3 bucket."""
 
+import hmac
+import json
+import logging
 import mimetypes
-from typing import Annotated
+from typing import (
+    Annotated,
+    AsyncIterator,
+    Dict,
+    Union,
+)
 
-import requests  # type: ignore
 from fastapi import (
     APIRouter,
+    BackgroundTasks,
     Depends,
     File,
     HTTPException,
@@ -17,33 +25,81 @@ from fastapi import (
 )
 from fastapi.responses import StreamingResponse
 
-from files_api.generate import (
-    generate_image,
-    generate_text_to_speech,
-    get_text_chat_completion,
+from files_api.cache import TTLCache
+from files_api.clients import get_shared_s3_client
+from files_api.generation import (
+    generate_file,
+    generate_files,
+    start_speech_file_generation,
+    stream_text_file_generation,
+)
+from files_api.jobs import (
+    GenerationJob,
+    JobQueue,
+    JobQueueFullError,
+)
+from files_api.listing import (
+    ListingPage,
+    ObjectHeadMetadata,
+    fetch_objects_head_metadata,
+    get_listing_page,
+    prefetch_listing_page,
+)
+from files_api.listing_cursors import (
+    ListingCursor,
+    decode_listing_cursor,
+    encode_listing_cursor,
+)
+from files_api.metrics import (
+    PROMETHEUS_CONTENT_TYPE,
+    collect_metrics,
+    get_app_caches,
+    render_prometheus_text,
 )
 from files_api.s3.delete_objects import delete_s3_object
 from files_api.s3.read_objects import (
+    aiter_s3_object_body,
     fetch_s3_object,
-    fetch_s3_objects_metadata,
-    fetch_s3_objects_using_page_token,
     object_exists_in_s3,
 )
-from files_api.s3.write_objects import upload_s3_object
+from files_api.s3.write_objects import (
+    upload_s3_object,
+    upload_s3_object_from_async_stream,
+)
 from files_api.schemas import (
-    FileMetadata,
+    BulkGenerateFilesRequest,
+    BulkGenerationItemResult,
+    FileMetadataField,
     GeneratedFileType,
     GenerateFilesQueryParams,
+    GenerationJobResponse,
     GetFilesQueryParams,
     GetFilesResponse,
     PostFileResponse,
     PutFileResponse,
 )
+from files_api.serialization import serialize_get_files_response
 from files_api.settings import Settings
 
+LOGGER = logging.getLogger(__name__)
+
 ROUTER = APIRouter()
 
 
+class NDJSONStreamingResponse(StreamingResponse):
+    """A streamed response of newline-delimited JSON objects."""
+
+    media_type = "application/x-ndjson"
+
+
+# The OpenAPI response examples are declared in each model's `json_schema_extra`. Reading them from there
+# is a dict lookup, whereas `model_json_schema()` builds the model's whole JSON schema on every call,
+# which used to happen several times while this module was imported (i.e. on every Lambda cold start).
+PUT_FILE_RESPONSE_EXAMPLES: dict = PutFileResponse.model_config["json_schema_extra"]  # type: ignore
+GET_FILES_RESPONSE_EXAMPLES: list = GetFilesResponse.model_config["json_schema_extra"]["examples"]  # type: ignore
+POST_FILE_RESPONSE_EXAMPLES: list = PostFileResponse.model_config["json_schema_extra"]["examples"]  # type: ignore
+
+
 @ROUTER.put(
     "/v1/files/{file_path:path}",
     status_code=status.HTTP_201_CREATED,
@@ -53,25 +109,53 @@ ROUTER = APIRouter()
         status.HTTP_201_CREATED: {
             "model": PutFileResponse,
             "description": "File uploaded successfully.",
-            "content": PutFileResponse.model_json_schema()[str(status.HTTP_201_CREATED)]["content"],
+            "content": PUT_FILE_RESPONSE_EXAMPLES[str(status.HTTP_201_CREATED)]["content"],
         },
         status.HTTP_200_OK: {
             "model": PutFileResponse,
             "description": "File updated successfully.",
-            "content": PutFileResponse.model_json_schema()[str(status.HTTP_200_OK)]["content"],
+            "content": PUT_FILE_RESPONSE_EXAMPLES[str(status.HTTP_200_OK)]["content"],
         },
+        status.HTTP_415_UNSUPPORTED_MEDIA_TYPE: {"description": "The file was sent as a URL-encoded form."},
+    },
+    # the raw request body is read by the route itself, so FastAPI does not document it
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/octet-stream": {"schema": {"type": "string", "format": "binary"}}},
+        }
     },
 )
 async def upload_file(
     request: Request,
     response: Response,
     file_path: Annotated[str, Path(description=PutFileResponse.model_fields["file_path"].description)],
-    file_content: Annotated[UploadFile, File(description="The file to upload.")],
+    file_content: Annotated[
+        Union[UploadFile, None], File(description="The file to upload, if sent as `multipart/form-data`.")
+    ] = None,
 ) -> PutFileResponse:
-    """Upload or Update a File."""
+    """
+    Upload or Update a File.
+
+    The file is either the `file_content` field of a `multipart/form-data` body, or the whole request body,
+    sent with the file's own `Content-Type` (e.g. `application/octet-stream`). A raw body is streamed to S3
+    as it arrives, without being parsed or spooled to disk first, which suits large files best.
+    """
     settings: Settings = request.app.state.settings
+    request_content_type = request.headers.get("content-type", "")
+    if file_content is None and request_content_type.startswith("multipart/form-data"):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="The form has no `file_content` field."
+        )
+    if request_content_type.startswith("application/x-www-form-urlencoded"):
+        # FastAPI parsed (and so consumed) the body as a form already, and such a form cannot carry a file
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Send the file as `multipart/form-data`, or as the raw request body with the file's content type.",
+        )
     s3_bucket_name = settings.s3_bucket_name
-    object_already_exists = object_exists_in_s3(bucket_name=s3_bucket_name, object_key=file_path)
+    s3_client = get_shared_s3_client(request.app)
+    object_already_exists = object_exists_in_s3(bucket_name=s3_bucket_name, object_key=file_path, s3_client=s3_client)
     if object_already_exists:
         response_message = f"Existing file updated at path: {file_path}"
         response.status_code = status.HTTP_200_OK
@@ -79,13 +163,25 @@ async def upload_file(
         response_message = f"New file uploaded at path: {file_path}"
         response.status_code = status.HTTP_201_CREATED
 
-    file_bytes: bytes = await file_content.read()
-    upload_s3_object(
-        bucket_name=s3_bucket_name,
-        object_key=file_path,
-        file_content=file_bytes,
-        content_type=file_content.content_type,
-    )
+    if file_content is None:
+        await upload_s3_object_from_async_stream(
+            bucket_name=s3_bucket_name,
+            object_key=file_path,
+            chunks=request.stream(),
+            content_type=request_content_type or mimetypes.guess_type(file_path)[0],
+            part_size_bytes=settings.upload_part_size_bytes,
+            s3_client=s3_client,
+        )
+    else:
+        file_bytes: bytes = await file_content.read()
+        upload_s3_object(
+            bucket_name=s3_bucket_name,
+            object_key=file_path,
+            file_content=file_bytes,
+            content_type=file_content.content_type,
+            s3_client=s3_client,
+        )
+    request.app.state.listing_page_cache.clear()
     return PutFileResponse(file_path=file_path, message=response_message)
 
 
@@ -93,6 +189,7 @@ async def upload_file(
     "/v1/files",
     tags=["Files"],
     summary="List Files",
+    response_model=GetFilesResponse,
     responses={
         status.HTTP_200_OK: {
             "model": GetFilesResponse,
@@ -100,8 +197,8 @@ async def upload_file(
             "content": {
                 "application/json": {
                     "examples": {
-                        "With Pagination": GetFilesResponse.model_json_schema()["examples"][0],
-                        "No Pages Left": GetFilesResponse.model_json_schema()["examples"][1],
+                        "With Pagination": GET_FILES_RESPONSE_EXAMPLES[0],
+                        "No Pages Left": GET_FILES_RESPONSE_EXAMPLES[1],
                     },
                 },
             },
@@ -109,36 +206,60 @@ async def upload_file(
     },
 )
 async def list_files(
-    request: Request, response: Response, query_params: Annotated[GetFilesQueryParams, Depends()]
-) -> GetFilesResponse:
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    query_params: Annotated[GetFilesQueryParams, Depends()],
+) -> Response:
     """List Files with Pagination."""
     settings: Settings = request.app.state.settings
     s3_bucket_name = settings.s3_bucket_name
+    s3_client = get_shared_s3_client(request.app)
+    page_cache: TTLCache[ListingPage] = request.app.state.listing_page_cache
     if query_params.page_token:
-        files, next_page_token = fetch_s3_objects_using_page_token(
-            bucket_name=s3_bucket_name,
-            continuation_token=query_params.page_token,
-            max_keys=query_params.page_size,
-        )
+        cursor = decode_listing_cursor(query_params.page_token)
+        # an explicit page_size resizes the remaining pages of the listing
+        if "page_size" in query_params.model_dump(exclude_defaults=True):
+            cursor = cursor._replace(page_size=query_params.page_size)
     else:
-        files, next_page_token = fetch_s3_objects_metadata(
+        cursor = ListingCursor(
+            prefix=query_params.directory or "",
+            page_size=query_params.page_size,
+            start_after=query_params.start_after,
+        )
+
+    page = get_listing_page(page_cache=page_cache, bucket_name=s3_bucket_name, cursor=cursor, s3_client=s3_client)
+    if page.next_cursor and settings.listing_read_ahead:
+        # read the next page ahead of time, so it is already in memory when the client asks for it
+        background_tasks.add_task(
+            prefetch_listing_page,
+            page_cache=page_cache,
             bucket_name=s3_bucket_name,
-            prefix=query_params.directory,
-            max_keys=query_params.page_size,
+            cursor=page.next_cursor,
+            s3_client=s3_client,
         )
 
-    files_metadata = [
-        FileMetadata(
-            file_path=file["Key"],
-            last_modified=file["LastModified"],
-            size_bytes=file["Size"],
+    include_fields = query_params.include_fields
+    head_metadata: Dict[str, ObjectHeadMetadata] = {}
+    if include_fields & {FileMetadataField.CONTENT_TYPE, FileMetadataField.METADATA}:
+        head_metadata = fetch_objects_head_metadata(
+            metadata_cache=request.app.state.object_metadata_cache,
+            bucket_name=s3_bucket_name,
+            files=page.files,
+            max_concurrency=settings.head_object_concurrency,
+            s3_client=s3_client,
         )
-        for file in files
-    ]
-    response.status_code = status.HTTP_200_OK
-    return GetFilesResponse(
-        files=files_metadata,
-        next_page_token=next_page_token if next_page_token else None,
+
+    # serialize the S3 listing straight to JSON bytes rather than building and re-validating pydantic models
+    return Response(
+        content=serialize_get_files_response(
+            files=page.files,
+            next_page_token=encode_listing_cursor(page.next_cursor) if page.next_cursor else None,
+            include_fields=include_fields,
+            head_metadata=head_metadata,
+        ),
+        media_type="application/json",
+        status_code=status.HTTP_200_OK,
     )
 
 
@@ -187,14 +308,15 @@ async def get_file_metadata(file_path: str, request: Request, response: Response
     """
     settings: Settings = request.app.state.settings
     s3_bucket_name = settings.s3_bucket_name
-    object_exists = object_exists_in_s3(bucket_name=s3_bucket_name, object_key=file_path)
+    s3_client = get_shared_s3_client(request.app)
+    object_exists = object_exists_in_s3(bucket_name=s3_bucket_name, object_key=file_path, s3_client=s3_client)
     if not object_exists:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             headers={"X-Error": f"File not found: {file_path}"},
         )
 
-    get_object_response = fetch_s3_object(bucket_name=s3_bucket_name, object_key=file_path)
+    get_object_response = fetch_s3_object(bucket_name=s3_bucket_name, object_key=file_path, s3_client=s3_client)
     response.headers["Content-Type"] = get_object_response["ContentType"]
     response.headers["Content-Length"] = str(get_object_response["ContentLength"])
     response.headers["Last-Modified"] = get_object_response["LastModified"].strftime("%a, %d %b %Y %H:%M:%S GMT")
@@ -249,11 +371,12 @@ async def get_file(
     """Retrieve a File."""
     settings: Settings = request.app.state.settings
     s3_bucket_name = settings.s3_bucket_name
-    object_exists = object_exists_in_s3(bucket_name=s3_bucket_name, object_key=file_path)
+    s3_client = get_shared_s3_client(request.app)
+    object_exists = object_exists_in_s3(bucket_name=s3_bucket_name, object_key=file_path, s3_client=s3_client)
     if not object_exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"File not found: {file_path}")
 
-    get_object_response = fetch_s3_object(bucket_name=s3_bucket_name, object_key=file_path)
+    get_object_response = fetch_s3_object(bucket_name=s3_bucket_name, object_key=file_path, s3_client=s3_client)
     response.headers["Content-Type"] = get_object_response["ContentType"]
     response.headers["Content-Length"] = str(get_object_response["ContentLength"])
     # If the file is a PDF, set the Content-Disposition header to force download
@@ -263,7 +386,7 @@ async def get_file(
 
     response.status_code = status.HTTP_200_OK
     return StreamingResponse(
-        content=get_object_response["Body"],
+        content=aiter_s3_object_body(get_object_response["Body"], chunk_size_bytes=settings.download_chunk_size_bytes),
         media_type=get_object_response["ContentType"],
         headers=response.headers,
     )
@@ -289,13 +412,15 @@ async def delete_file(
     """
     settings: Settings = request.app.state.settings
     s3_bucket_name = settings.s3_bucket_name
-    object_exists = object_exists_in_s3(bucket_name=s3_bucket_name, object_key=file_path)
+    s3_client = get_shared_s3_client(request.app)
+    object_exists = object_exists_in_s3(bucket_name=s3_bucket_name, object_key=file_path, s3_client=s3_client)
     if not object_exists:
         response.status_code = status.HTTP_404_NOT_FOUND
         response.headers["X-Error"] = f"File not found: {file_path}"
         return response
 
-    delete_s3_object(bucket_name=s3_bucket_name, object_key=file_path)
+    delete_s3_object(bucket_name=s3_bucket_name, object_key=file_path, s3_client=s3_client)
+    request.app.state.listing_page_cache.clear()
     response.status_code = status.HTTP_204_NO_CONTENT
     return response
 
@@ -303,6 +428,7 @@ async def delete_file(
 @ROUTER.post(
     "/v1/files/generated/{file_path:path}",
     status_code=status.HTTP_201_CREATED,
+    response_model=PostFileResponse,
     tags=["Generate Files"],
     summary="AI Generated Files",
     responses={
@@ -312,18 +438,24 @@ async def delete_file(
             "content": {
                 "application/json": {
                     "examples": {
-                        GeneratedFileType.TEXT: PostFileResponse.model_json_schema()["examples"][0],
-                        GeneratedFileType.IMAGE: PostFileResponse.model_json_schema()["examples"][1],
-                        GeneratedFileType.AUDIO: PostFileResponse.model_json_schema()["examples"][2],
+                        GeneratedFileType.TEXT: POST_FILE_RESPONSE_EXAMPLES[0],
+                        GeneratedFileType.IMAGE: POST_FILE_RESPONSE_EXAMPLES[1],
+                        GeneratedFileType.AUDIO: POST_FILE_RESPONSE_EXAMPLES[2],
                     },
                 },
+                "text/event-stream": {
+                    "schema": {"type": "string"},
+                    "example": 'event: token\ndata: {"text": "Once upon"}\n\n'
+                    'event: done\ndata: {"file_path": "path/to/file.txt", "message": "..."}\n\n',
+                },
+                "audio/*": {"schema": {"type": "string", "format": "binary"}},
             },
         },
     },
 )
 async def generate_file_using_openai(
     request: Request, response: Response, query_params: Annotated[GenerateFilesQueryParams, Depends()]
-) -> PostFileResponse:
+) -> Union[PostFileResponse, StreamingResponse]:
     """
     Generate a File using AI.
 
@@ -333,39 +465,191 @@ async def generate_file_using_openai(
     - Image: .png, .jpg, .jpeg
     - Text-to-Speech: .mp3, .opus, .aac, .flac, .wav, .pcm
     ```
+
+    Text can be streamed: send `Accept: text/event-stream` to receive the text as server-sent `token`
+    events while it is being generated, followed by a `done` event carrying the usual response body (or an
+    `error` event). The file is uploaded once the text is complete.
+
+    Speech can be played while it is generated: send an `Accept` header with an `audio/` type (e.g.
+    `audio/*`) to receive the audio itself as it streams into S3.
+
+    Images are encoded in the format of their path. Downscaled variants of them, if configured (e.g. a
+    thumbnail), are stored next to them: `path/to/cat.jpg` gets `path/to/cat.thumbnail.jpg`.
     """
-    settings: Settings = request.app.state.settings
-    s3_bucket_name = settings.s3_bucket_name
-    content_type = None
-
-    if query_params.file_type == GeneratedFileType.TEXT:
-        file_content = await get_text_chat_completion(prompt=query_params.prompt)
-        file_content_bytes: bytes = file_content.encode("utf-8")  # convert string to bytes
-        content_type = "text/plain"
-    elif query_params.file_type == GeneratedFileType.IMAGE:
-        image_url = await generate_image(prompt=query_params.prompt)
-
-        # Download the image from the URL
-        image_response = requests.get(image_url)  # pylint: disable=missing-timeout
-        file_content_bytes = image_response.content
-    else:
-        response_format = query_params.file_path.split(".")[-1]
-        file_content_bytes, content_type = await generate_text_to_speech(
-            prompt=query_params.prompt, response_format=response_format  # type: ignore
+    if query_params.file_type == GeneratedFileType.TEXT and "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            content=stream_text_generation_events(request, query_params),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
 
-    # If content_type is None, try to guess it from the file path
-    content_type: str | None = content_type or mimetypes.guess_type(query_params.file_path)[0]  # type: ignore
+    if query_params.file_type == GeneratedFileType.AUDIO and "audio/" in request.headers.get("accept", ""):
+        audio_chunks, content_type, cache_hit = await start_speech_file_generation(
+            request.app, params=query_params, use_cache=query_params.use_cache
+        )
+        return StreamingResponse(
+            content=audio_chunks,
+            media_type=content_type,
+            status_code=status.HTTP_201_CREATED,
+            headers={"X-Generation-Cache": "hit" if cache_hit else "miss"},
+        )
 
-    # Upload the generated file to S3
-    upload_s3_object(
-        bucket_name=s3_bucket_name,
-        object_key=query_params.file_path,
-        file_content=file_content_bytes,
-        content_type=content_type,
-    )
+    cache_hit = await generate_file(request.app, params=query_params, use_cache=query_params.use_cache)
+    request.app.state.listing_page_cache.clear()
+    response.headers["X-Generation-Cache"] = "hit" if cache_hit else "miss"
     response.status_code = status.HTTP_201_CREATED
     return PostFileResponse(
         file_path=query_params.file_path,
         message=f"New {query_params.file_type.value} file generated and uploaded at path: {query_params.file_path}",
     )
+
+
+async def stream_text_generation_events(
+    request: Request, query_params: GenerateFilesQueryParams
+) -> AsyncIterator[bytes]:
+    """Generate a text file, reporting its text and the outcome as server-sent events."""
+    try:
+        async for text in stream_text_file_generation(
+            request.app, params=query_params, use_cache=query_params.use_cache
+        ):
+            yield format_server_sent_event("token", {"text": text})
+    except Exception as err:  # pylint: disable=broad-except
+        # the response has started already, so the error can only be reported in the stream
+        LOGGER.exception("Streaming the generation of %s failed", query_params.file_path)
+        yield format_server_sent_event("error", {"detail": str(err) or type(err).__name__})
+        return
+    result = PostFileResponse(
+        file_path=query_params.file_path,
+        message=f"New {query_params.file_type.value} file generated and uploaded at path: {query_params.file_path}",
+    )
+    yield format_server_sent_event("done", result.model_dump())
+
+
+def format_server_sent_event(event: str, data: dict) -> bytes:
+    """Encode a server-sent event whose data is JSON."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+@ROUTER.post(
+    "/v1/files/generated",
+    tags=["Generate Files"],
+    summary="AI Generated Files, in Bulk",
+    response_class=NDJSONStreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "model": BulkGenerationItemResult,
+            "description": "One JSON object per line and per item, in the order the items finish.",
+        },
+    },
+)
+async def generate_files_in_bulk(request: Request, body: BulkGenerateFilesRequest) -> NDJSONStreamingResponse:
+    """
+    Generate many Files using AI in one request.
+
+    The items are generated concurrently and the result of each one is streamed back as a line of JSON as
+    soon as it is done, so the response starts before the whole batch is finished. A failed item is
+    reported in its line and does not stop the others.
+    """
+    settings: Settings = request.app.state.settings
+    max_concurrency = min(
+        body.max_concurrency or settings.bulk_generation_concurrency, settings.bulk_generation_concurrency
+    )
+
+    async def stream_results() -> AsyncIterator[bytes]:
+        async for result in generate_files(request.app, items=body.items, max_concurrency=max_concurrency):
+            yield result.model_dump_json(exclude_none=True).encode("utf-8") + b"\n"
+
+    return NDJSONStreamingResponse(content=stream_results())
+
+
+def get_generation_job_queue(request: Request) -> JobQueue:
+    """Return the app's job queue, or answer 501 if it has none (on AWS Lambda, without an SQS queue)."""
+    job_queue: Union[JobQueue, None] = request.app.state.generation_job_queue
+    if job_queue is None:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Generation jobs are not available: the API runs on AWS Lambda without GENERATION_JOB_QUEUE_URL",
+        )
+    return job_queue
+
+
+@ROUTER.post(
+    "/v1/generation-jobs/{file_path:path}",
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Generate Files"],
+    summary="Start Generating a File",
+    responses={
+        status.HTTP_501_NOT_IMPLEMENTED: {"description": "The deployment has no durable job queue."},
+        status.HTTP_503_SERVICE_UNAVAILABLE: {"description": "Too many generation jobs are waiting already."},
+    },
+)
+async def submit_generation_job(
+    request: Request,
+    response: Response,
+    job_queue: Annotated[JobQueue, Depends(get_generation_job_queue)],
+    query_params: Annotated[GenerateFilesQueryParams, Depends()],
+) -> GenerationJobResponse:
+    """
+    Generate a File using AI, in the background.
+
+    Takes the same parameters as `POST /v1/files/generated/{file_path}`, but answers right away with a
+    job ID. Poll `GET /v1/generation-jobs/{job_id}` (see the `Location` header) until the job has
+    `succeeded` or `failed`.
+    """
+    try:
+        job = await job_queue.submit(query_params)
+    except JobQueueFullError as err:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(err), headers={"Retry-After": "5"}
+        ) from err
+    response.headers["Location"] = str(request.url_for("get_generation_job", job_id=job.job_id).path)
+    return generation_job_response(job)
+
+
+@ROUTER.get(
+    "/v1/generation-jobs/{job_id}",
+    tags=["Generate Files"],
+    summary="Get a Generation Job",
+    responses={
+        status.HTTP_404_NOT_FOUND: {"description": "The job does not exist, or finished too long ago."},
+        status.HTTP_501_NOT_IMPLEMENTED: {"description": "The deployment has no durable job queue."},
+    },
+)
+async def get_generation_job(
+    job_id: str, job_queue: Annotated[JobQueue, Depends(get_generation_job_queue)]
+) -> GenerationJobResponse:
+    """Get the status of a generation job."""
+    job = await job_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Generation job not found: {job_id}")
+    return generation_job_response(job)
+
+
+def generation_job_response(job: GenerationJob) -> GenerationJobResponse:
+    """Describe a generation job to the client."""
+    return GenerationJobResponse(
+        job_id=job.job_id,
+        status=job.status,
+        file_path=job.params.file_path,
+        file_type=job.params.file_type,
+        generated_from_cache=job.generated_from_cache,
+        error=job.error,
+    )
+
+
+@ROUTER.get("/metrics", tags=["Metrics"], include_in_schema=False)
+async def get_metrics(request: Request) -> Response:
+    """Expose the metrics of this process (or Lambda execution environment) in the Prometheus text format."""
+    settings: Settings = request.app.state.settings
+    metrics_token = settings.metrics_token
+    if not settings.metrics_enabled or not metrics_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled.")
+    authorization = request.headers.get("authorization", "")
+    if not hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {metrics_token}".encode("utf-8")):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="A valid metrics token is required.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    families = collect_metrics(get_app_caches(request.app))
+    return Response(content=render_prometheus_text(families), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -5,6 +5,8 @@ from typing import Optional
 import boto3
 
 from files_api.s3.read_objects import object_exists_in_s3
+from files_api.timing import timed
+from files_api.tracing import traced
 
 try:
     from mypy_boto3_s3 import S3Client
@@ -12,6 +14,8 @@ except ImportError:
     ...
 
 
+@traced("s3.delete_object")
+@timed("s3-delete")
 def delete_s3_object(bucket_name: str, object_key: str, s3_client: Optional["S3Client"] = None) -> None:
     """
     Delete an object from the S3 bucket.
@@ -0,0 +1,225 @@
+"""
+Parallel, prefix-sharded listing of large S3 buckets.
+
+`list_objects_v2` pages with continuation tokens, so a single listing is strictly sequential:
+every page has to wait for the previous one. Here the key space is split into independent shards,
+the shards are listed concurrently, and the results are merged back into one stream ordered by key,
+i.e. exactly what a sequential listing would have returned.
+
+Shards are found in one of two ways:
+
+1. Delimiter discovery: the prefix is listed once with ``Delimiter="/"``. Every common prefix
+   (a sub-"directory") becomes a shard, and objects directly under the prefix are emitted as-is.
+2. ``StartAfter`` split points: callers that know their key distribution (flat buckets with
+   date- or hash-named keys) pass sorted split keys, and each shard is the key range
+   ``(previous split point, split point]``.
+"""
+
+import contextvars
+from collections import deque
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+)
+from typing import (
+    Deque,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import boto3
+from botocore.config import Config
+
+from files_api.s3.read_objects import (
+    DEFAULT_MAX_KEYS,
+    fetch_s3_objects_metadata,
+)
+from files_api.timing import timed
+from files_api.tracing import traced
+
+try:
+    from mypy_boto3_s3 import S3Client
+    from mypy_boto3_s3.type_defs import ObjectTypeDef
+except ImportError:
+    ...
+
+DEFAULT_MAX_SHARD_WORKERS = 8
+DEFAULT_DELIMITER = "/"
+
+
+class S3KeyRange(NamedTuple):
+    """
+    A shard of the key space: all keys under ``prefix`` in the range ``(start_after, end_at]``.
+
+    A bound of ``None`` means the range is open on that side.
+    """
+
+    prefix: str
+    start_after: Optional[str] = None
+    end_at: Optional[str] = None
+
+
+def iter_s3_objects(
+    bucket_name: str,
+    key_range: S3KeyRange,
+    page_size: int = DEFAULT_MAX_KEYS,
+    s3_client: Optional["S3Client"] = None,
+) -> Iterator["ObjectTypeDef"]:
+    """
+    Sequentially yield every object in a key range, in key order.
+
+    Pages are chained with ``StartAfter=<last key of the previous page>`` rather than continuation
+    tokens, so a range can start at any key.
+
+    :param bucket_name: Name of the S3 bucket to list objects from.
+    :param key_range: The shard of the key space to list.
+    :param page_size: Number of keys requested per ``list_objects_v2`` call.
+    :param s3_client: Optional S3 client to use. If not provided, a new client will be created.
+    """
+    s3_client = s3_client or boto3.client("s3")
+    start_after = key_range.start_after
+    while True:
+        files, next_continuation_token = fetch_s3_objects_metadata(
+            bucket_name=bucket_name,
+            prefix=key_range.prefix,
+            max_keys=page_size,
+            start_after=start_after,
+            s3_client=s3_client,
+        )
+        for file in files:
+            if key_range.end_at is not None and file["Key"] > key_range.end_at:
+                return
+            yield file
+        if not files or not next_continuation_token:
+            return
+        start_after = files[-1]["Key"]
+
+
+@traced("s3.list_objects")
+@timed("s3-list")
+def discover_s3_shards(
+    bucket_name: str,
+    prefix: Optional[str] = None,
+    delimiter: str = DEFAULT_DELIMITER,
+    s3_client: Optional["S3Client"] = None,
+) -> Tuple[List["ObjectTypeDef"], List[str]]:
+    """
+    Discover the sub-"directories" of a prefix using a delimiter listing.
+
+    :param bucket_name: Name of the S3 bucket to list objects from.
+    :param prefix: Prefix whose immediate children should be discovered.
+    :param delimiter: Character that separates "directories" in object keys.
+    :param s3_client: Optional S3 client to use. If not provided, a new client will be created.
+
+    :return: Tuple of
+        1. Objects stored directly under the prefix (not inside any sub-"directory").
+        2. The common prefixes (sub-"directories") found under the prefix, in key order.
+    """
+    s3_client = s3_client or boto3.client("s3")
+    paginator = s3_client.get_paginator("list_objects_v2")
+    files: List["ObjectTypeDef"] = []
+    common_prefixes: List[str] = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix or "", Delimiter=delimiter):
+        files.extend(page.get("Contents", []))
+        common_prefixes.extend(common_prefix["Prefix"] for common_prefix in page.get("CommonPrefixes", []))
+    return files, common_prefixes
+
+
+class ShardingOptions(NamedTuple):
+    """How `list_s3_objects_sharded` splits the key space and how many shards it lists at the same time."""
+
+    # sorted keys to split the prefix at; if empty, shards are discovered from the common prefixes found with
+    # ``delimiter``
+    split_points: Sequence[str] = ()
+    # character that separates "directories" in object keys
+    delimiter: str = DEFAULT_DELIMITER
+    # maximum number of shards listed at the same time
+    max_workers: int = DEFAULT_MAX_SHARD_WORKERS
+
+
+def plan_listing_units(
+    bucket_name: str,
+    prefix: Optional[str],
+    options: ShardingOptions,
+    s3_client: "S3Client",
+) -> List[Union["ObjectTypeDef", S3KeyRange]]:
+    """
+    Split the key space under a prefix into units to list, in key order.
+
+    Each unit is either an object that is already known or a shard that still has to be listed.
+    """
+    # units are sorted by their sort key; for shards that is their lower bound
+    units: List[Tuple[str, Union["ObjectTypeDef", S3KeyRange]]] = []
+    if options.split_points:
+        bounds: List[Optional[str]] = [None, *sorted(options.split_points), None]
+        for start_after, end_at in zip(bounds[:-1], bounds[1:]):
+            units.append((start_after or "", S3KeyRange(prefix=prefix or "", start_after=start_after, end_at=end_at)))
+    else:
+        direct_files, common_prefixes = discover_s3_shards(
+            bucket_name=bucket_name, prefix=prefix, delimiter=options.delimiter, s3_client=s3_client
+        )
+        # A key that sorts before a common prefix (and does not start with it) also sorts before
+        # every key under that prefix, so sorting by "key or prefix" preserves the global key order.
+        units.extend((file["Key"], file) for file in direct_files)
+        units.extend((common_prefix, S3KeyRange(prefix=common_prefix)) for common_prefix in common_prefixes)
+        units.sort(key=lambda unit: unit[0])
+    return [unit for _, unit in units]
+
+
+def list_s3_objects_sharded(
+    bucket_name: str,
+    prefix: Optional[str] = None,
+    options: ShardingOptions = ShardingOptions(),
+    s3_client: Optional["S3Client"] = None,
+) -> Iterator["ObjectTypeDef"]:
+    """
+    Yield every object under a prefix, in key order, listing shards of the key space concurrently.
+
+    At most ``2 * options.max_workers`` shards are buffered ahead of the consumer, so memory stays bounded
+    even when the caller consumes the stream slowly. Closing the generator early cancels the
+    shards that have not started yet. Every ``list_objects_v2`` call is timed as an ``s3-list`` phase.
+
+    :param bucket_name: Name of the S3 bucket to list objects from.
+    :param prefix: Prefix to filter objects by.
+    :param options: How to split the key space into shards, and how many to list at the same time.
+    :param s3_client: Optional S3 client to use. If not provided, one is created with a connection
+        pool large enough for ``options.max_workers`` concurrent requests.
+    """
+    s3_client = s3_client or boto3.client("s3", config=Config(max_pool_connections=options.max_workers))
+    units_iter = iter(plan_listing_units(bucket_name=bucket_name, prefix=prefix, options=options, s3_client=s3_client))
+
+    def list_shard(key_range: S3KeyRange) -> List["ObjectTypeDef"]:
+        return list(iter_s3_objects(bucket_name=bucket_name, key_range=key_range, s3_client=s3_client))
+
+    executor = ThreadPoolExecutor(max_workers=options.max_workers, thread_name_prefix="s3-list-shard")
+    pending: Deque[Union["ObjectTypeDef", "Future[List[ObjectTypeDef]]"]] = deque()
+    max_shards_ahead = 2 * options.max_workers
+    shards_ahead = 0
+    try:
+        while True:
+            # keep the pipeline full: schedule shards until enough are in flight ahead of the consumer
+            while shards_ahead < max_shards_ahead:
+                unit = next(units_iter, None)
+                if unit is None:
+                    break
+                if isinstance(unit, S3KeyRange):
+                    # in a copy of the caller's context, so the shard's pages are timed and traced into its request
+                    pending.append(executor.submit(contextvars.copy_context().run, list_shard, unit))
+                    shards_ahead += 1
+                else:
+                    pending.append(unit)
+            if not pending:
+                return
+            item = pending.popleft()
+            if isinstance(item, Future):
+                shards_ahead -= 1
+                yield from item.result()
+            else:
+                yield item
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,6 +1,11 @@
 """Functions for reading objects from an S3 bucket--the "R" in CRUD."""
 
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import (
+    AsyncIterator,
+    Dict,
     List,
     Optional,
     Tuple,
@@ -8,7 +13,12 @@ from typing import (
 )
 
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+from files_api.timing import timed
+from files_api.tracing import traced
 
 try:
     from mypy_boto3_s3 import S3Client
@@ -22,8 +32,12 @@ except ImportError:
     ...
 
 DEFAULT_MAX_KEYS = 1_000
+DEFAULT_HEAD_OBJECT_CONCURRENCY = 10
+DEFAULT_DOWNLOAD_CHUNK_SIZE_BYTES = 1024 * 1024
 
 
+@traced("s3.head_object")
+@timed("s3-head")
 def object_exists_in_s3(  # type: ignore
     bucket_name: str,
     object_key: str,
@@ -50,6 +64,8 @@ def object_exists_in_s3(  # type: ignore
         raise
 
 
+@traced("s3.get_object", size_of_result=lambda response: response["ContentLength"])
+@timed("s3-get")
 def fetch_s3_object(
     bucket_name: str,
     object_key: str,
@@ -69,6 +85,36 @@ def fetch_s3_object(
     return response
 
 
+async def aiter_s3_object_body(
+    body: StreamingBody,
+    chunk_size_bytes: int = DEFAULT_DOWNLOAD_CHUNK_SIZE_BYTES,
+) -> AsyncIterator[bytes]:
+    """
+    Read the body of an S3 object in large chunks, without blocking the event loop.
+
+    Iterating over a `StreamingBody` directly (e.g. by passing it to a `StreamingResponse`) reads it 1 KiB at a
+    time, each read in a trip through a thread pool. Here, every read takes ``chunk_size_bytes`` in a worker
+    thread, and the next chunk is already being read while the current one is consumed (double buffering),
+    so the network reads from S3 and the writes to the client overlap.
+
+    :param body: The `Body` of a `get_object` response; it is closed once the iteration ends.
+    :param chunk_size_bytes: The size of the chunks to read.
+    """
+    next_chunk = asyncio.ensure_future(asyncio.to_thread(body.read, chunk_size_bytes))
+    try:
+        while chunk := await next_chunk:
+            next_chunk = asyncio.ensure_future(asyncio.to_thread(body.read, chunk_size_bytes))
+            yield chunk
+    finally:
+        # the body must not be closed while a worker thread is still reading it
+        if not next_chunk.done():
+            with contextlib.suppress(Exception):
+                await next_chunk
+        body.close()
+
+
+@traced("s3.list_objects")
+@timed("s3-list")
 def fetch_s3_objects_using_page_token(
     bucket_name: str,
     continuation_token: str,
@@ -100,11 +146,14 @@ def fetch_s3_objects_using_page_token(
     return files, next_continuation_token
 
 
+@traced("s3.list_objects")
+@timed("s3-list")
 def fetch_s3_objects_metadata(
     bucket_name: str,
     prefix: Optional[str] = None,
     max_keys: Optional[int] = DEFAULT_MAX_KEYS,
     s3_client: Optional["S3Client"] = None,
+    start_after: Optional[str] = None,
 ) -> Tuple[List["ObjectTypeDef"], Union[str, None]]:
     """
     Fetch list of object keys and their metadata.
@@ -113,6 +162,8 @@ def fetch_s3_objects_metadata(
     :param prefix: Prefix to filter objects by.
     :param max_keys: Maximum number of keys to return within this page.
     :param s3_client: Optional S3 client to use. If not provided, a new client will be created.
+    :param start_after: Only return keys that sort strictly after this key. Unlike a continuation
+        token, this can point anywhere in the key space, so listings can start (or resume) at any key.
 
     :return: Tuple of a list of objects and the next continuation token.
         1. Possibly empty list of objects in the current page.
@@ -123,8 +174,47 @@ def fetch_s3_objects_metadata(
         Bucket=bucket_name,
         Prefix=prefix or "",
         MaxKeys=max_keys or DEFAULT_MAX_KEYS,
+        StartAfter=start_after or "",
     )
     files: List["ObjectTypeDef"] = response.get("Contents", [])
     next_continuation_token: Union[str, None] = response.get("NextContinuationToken", None)
 
     return files, next_continuation_token
+
+
+@traced("s3.head_objects")
+@timed("s3-head")
+def fetch_s3_objects_head_metadata(
+    bucket_name: str,
+    object_keys: List[str],
+    max_concurrency: int = DEFAULT_HEAD_OBJECT_CONCURRENCY,
+    s3_client: Optional["S3Client"] = None,
+) -> Dict[str, "HeadObjectOutputTypeDef"]:
+    """
+    Fetch the metadata of many objects with concurrent `head_object` calls.
+
+    Objects that no longer exist (e.g. deleted between a listing and this call) are left out of the result.
+
+    :param bucket_name: Name of the S3 bucket.
+    :param object_keys: Keys of the objects to fetch metadata for.
+    :param max_concurrency: Maximum number of `head_object` calls in flight at the same time.
+    :param s3_client: Optional S3 client to use. If not provided, one is created with a connection
+        pool large enough for ``max_concurrency`` concurrent requests.
+
+    :return: Mapping of object key to its `head_object` response.
+    """
+    s3_client = s3_client or boto3.client("s3", config=Config(max_pool_connections=max_concurrency))
+
+    def head_object(object_key: str) -> Optional["HeadObjectOutputTypeDef"]:
+        try:
+            return s3_client.head_object(Bucket=bucket_name, Key=object_key)
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code", "") == "404":
+                return None
+            raise
+
+    if not object_keys:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(object_keys))) as executor:
+        responses = executor.map(head_object, object_keys)
+        return {object_key: response for object_key, response in zip(object_keys, responses) if response is not None}
@@ -1,9 +1,17 @@
 """Functions for writing objects from an S3 bucket--the "C" and "U" in CRUD."""
 
-from typing import Optional
+import asyncio
+from typing import (
+    AsyncIterable,
+    List,
+    Optional,
+)
 
 import boto3
 
+from files_api.timing import timed
+from files_api.tracing import traced
+
 try:
     from mypy_boto3_s3 import S3Client
 except ImportError:
@@ -20,6 +28,8 @@ except ImportError:
 # the ContentType="application/octet-stream", is a generic binary file.
 
 
+@traced("s3.put_object")
+@timed("s3-put")
 def upload_s3_object(
     bucket_name: str,
     object_key: str,
@@ -45,3 +55,170 @@ def upload_s3_object(
         Body=file_content,
         ContentType=content_type,
     )
+
+
+@traced("s3.copy_object")
+@timed("s3-copy")
+def copy_s3_object(
+    bucket_name: str,
+    source_key: str,
+    destination_key: str,
+    source_etag: Optional[str] = None,
+    s3_client: Optional["S3Client"] = None,
+) -> None:
+    """
+    Copy an object within an S3 bucket, server-side, keeping its content type and metadata.
+
+    :param bucket_name: The name of the S3 bucket.
+    :param source_key: path to the object to copy.
+    :param destination_key: path to the copy.
+    :param source_etag: If given, only copy the source if its ETag still matches, i.e. it was not replaced.
+        Otherwise, S3 answers with a `PreconditionFailed` error.
+    :param s3_client: An optional boto3 S3 client object. If not provided, one will be created.
+    """
+    s3_client = s3_client or boto3.client("s3")
+    copy_kwargs = {"CopySourceIfMatch": source_etag} if source_etag else {}
+    s3_client.copy_object(
+        Bucket=bucket_name,
+        Key=destination_key,
+        CopySource={"Bucket": bucket_name, "Key": source_key},
+        **copy_kwargs,
+    )
+
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one).
+MIN_MULTIPART_PART_SIZE_BYTES = 5 * 1024 * 1024
+DEFAULT_MULTIPART_PART_SIZE_BYTES = 8 * 1024 * 1024
+
+
+class StreamedMultipartUpload:
+    """
+    A multipart upload fed one part at a time, uploading each part while the caller fills the next one.
+
+    The multipart upload is only created with its first part, so a stream that never fills one part costs
+    no more than a `put_object`.
+    """
+
+    def __init__(self, s3_client: "S3Client", bucket_name: str, object_key: str, content_type: str):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.content_type = content_type
+        self.upload_id: Optional[str] = None
+        # filled in order as the parts are scheduled; each ETag is added once its part is uploaded
+        self.parts: List[dict] = []
+        self._pending_part: Optional[asyncio.Task] = None
+
+    async def add_part(self, body: bytes) -> None:
+        """Start uploading a part, once the previous part was uploaded."""
+        if self.upload_id is None:
+            multipart_upload = await asyncio.to_thread(
+                self.s3_client.create_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=self.object_key,
+                ContentType=self.content_type,
+            )
+            self.upload_id = multipart_upload["UploadId"]
+        if self._pending_part is not None:
+            await self._pending_part
+        part = {"PartNumber": len(self.parts) + 1}
+        self.parts.append(part)
+        self._pending_part = asyncio.create_task(self._upload_part(part, body))
+
+    async def complete(self, last_body: bytes) -> None:
+        """Upload the last part, which may be smaller than the others, and assemble the object."""
+        if self._pending_part is not None:
+            await self._pending_part
+        if last_body:
+            part = {"PartNumber": len(self.parts) + 1}
+            self.parts.append(part)
+            await self._upload_part(part, last_body)
+        await asyncio.to_thread(
+            self.s3_client.complete_multipart_upload,
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+
+    async def abort(self) -> None:
+        """Stop the part being uploaded and abort the multipart upload, if it was created."""
+        if self._pending_part is not None and not self._pending_part.done():
+            self._pending_part.cancel()
+        if self.upload_id is not None:
+            await asyncio.to_thread(
+                self.s3_client.abort_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=self.object_key,
+                UploadId=self.upload_id,
+            )
+
+    async def _upload_part(self, part: dict, body: bytes) -> None:
+        response = await asyncio.to_thread(
+            self.s3_client.upload_part,
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            UploadId=self.upload_id,
+            PartNumber=part["PartNumber"],
+            Body=body,
+        )
+        part["ETag"] = response["ETag"]
+
+
+@traced("s3.upload_stream", size_of_result=lambda size_bytes: size_bytes)
+@timed("s3-upload")
+async def upload_s3_object_from_async_stream(  # pylint: disable=too-many-arguments
+    bucket_name: str,
+    object_key: str,
+    chunks: AsyncIterable[bytes],
+    *,
+    content_type: Optional[str] = None,
+    part_size_bytes: int = DEFAULT_MULTIPART_PART_SIZE_BYTES,
+    s3_client: Optional["S3Client"] = None,
+) -> int:
+    """
+    Upload the bytes of an async stream to an S3 bucket while they are still arriving.
+
+    At most one part is held in memory while the previous one is uploaded. A stream that ends before
+    filling one part is uploaded with a single `put_object`, anything larger as a multipart upload, which
+    is aborted if the stream or an upload fails. The (blocking) boto3 calls run in worker threads, so the
+    event loop keeps serving other requests.
+
+    :param bucket_name: The name of the S3 bucket to upload the file to.
+    :param object_key: path to the object in the bucket.
+    :param chunks: The content of the file, e.g. the body of an HTTP response being downloaded.
+    :param content_type: The MIME type of the file, e.g. "text/plain" for a text file.
+    :param part_size_bytes: Size of each multipart part, at least 5 MiB.
+    :param s3_client: An optional boto3 S3 client object. If not provided, one will be created.
+
+    :return: The number of bytes uploaded.
+    """
+    s3_client = s3_client or boto3.client("s3")
+    content_type = content_type or "application/octet-stream"
+    part_size_bytes = max(part_size_bytes, MIN_MULTIPART_PART_SIZE_BYTES)
+    upload = StreamedMultipartUpload(s3_client, bucket_name, object_key, content_type)
+
+    buffer = bytearray()
+    size_bytes = 0
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            size_bytes += len(chunk)
+            while len(buffer) >= part_size_bytes:
+                body, buffer = bytes(buffer[:part_size_bytes]), buffer[part_size_bytes:]
+                await upload.add_part(body)
+
+        if upload.upload_id is None:
+            await asyncio.to_thread(
+                s3_client.put_object,
+                Bucket=bucket_name,
+                Key=object_key,
+                Body=bytes(buffer),
+                ContentType=content_type,
+            )
+        else:
+            await upload.complete(bytes(buffer))
+        return size_bytes
+    except BaseException:
+        await upload.abort()
+        raise
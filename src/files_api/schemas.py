@@ -4,8 +4,10 @@ import re
 from datetime import datetime
 from enum import Enum
 from typing import (
+    Dict,
     List,
     Optional,
+    Set,
 )
 
 from fastapi import (
@@ -16,14 +18,18 @@ from pydantic import (
     BaseModel,
     ConfigDict,
     Field,
+    field_validator,
     model_validator,
 )
 from typing_extensions import Self
 
+from files_api.listing_cursors import decode_listing_cursor
+
 DEFAULT_GET_FILES_PAGE_SIZE = 10
 DEFAULT_GET_FILES_MIN_PAGE_SIZE = 1
 DEFAULT_GET_FILES_MAX_PAGE_SIZE = 100
 DEFAULT_GET_FILES_DIRECTORY = ""
+BULK_GENERATION_MAX_ITEMS = 500
 
 
 # from pydantic.alias_generators import to_camel
@@ -50,6 +56,29 @@ class FileMetadata(BaseModel):
         description="The size of the file in bytes.",
         json_schema_extra={"example": 512},
     )
+    content_type: Optional[str] = Field(
+        default=None,
+        description="The MIME type of the file. Only returned when requested with `include=content_type`.",
+        json_schema_extra={"example": "text/plain"},
+    )
+    etag: Optional[str] = Field(
+        default=None,
+        description="The entity tag of the file's current version. Only returned when requested with `include=etag`.",
+        json_schema_extra={"example": '"9dd4e461268c8034f5c8564e155c67a6"'},
+    )
+    metadata: Optional[Dict[str, str]] = Field(
+        default=None,
+        description="The user-defined metadata of the file. Only returned when requested with `include=metadata`.",
+        json_schema_extra={"example": {"author": "someone"}},
+    )
+
+
+class FileMetadataField(str, Enum):
+    """Optional `FileMetadata` fields that `GET /v1/files` can be asked to include."""
+
+    CONTENT_TYPE = "content_type"
+    ETAG = "etag"
+    METADATA = "metadata"
 
 
 # create/update (Crud)
@@ -109,18 +138,57 @@ class GetFilesQueryParams(BaseModel):
     )
     page_token: Optional[str] = Field(
         default=None,
-        description="The token to retrieve the next page of files.",
+        description=(
+            "The token to retrieve the next page of files. "
+            "It remembers the directory and page size of the listing it came from; "
+            "passing `page_size` alongside it changes the size of the remaining pages."
+        ),
         json_schema_extra={"example": "next_page_token_value"},
     )
+    start_after: Optional[str] = Field(
+        default=None,
+        description="Start listing at the first file whose path sorts after this path.",
+        json_schema_extra={"example": "path/to/directory/file.txt"},
+    )
+    include: Optional[str] = Field(
+        default=None,
+        description=(
+            "Comma-separated optional fields to include for every file: "
+            "`content_type`, `etag` and/or `metadata`. "
+            "`content_type` and `metadata` cost an extra lookup per file, so only ask for what you need."
+        ),
+        json_schema_extra={"example": "content_type,etag"},
+    )
+
+    @field_validator("include")
+    @classmethod
+    def check_include(cls, include: Optional[str]) -> Optional[str]:
+        """Ensure that include only lists known optional fields."""
+        if include:
+            allowed_fields = {field.value for field in FileMetadataField}
+            unknown_fields = {field.strip() for field in include.split(",")} - allowed_fields
+            if unknown_fields:
+                raise ValueError(f"include must be a comma-separated subset of: {', '.join(sorted(allowed_fields))}")
+        return include
+
+    @property
+    def include_fields(self) -> Set[FileMetadataField]:
+        """The optional `FileMetadata` fields requested with `include`."""
+        if not self.include:
+            return set()
+        return {FileMetadataField(field.strip()) for field in self.include.split(",")}
 
     @model_validator(mode="after")
     def check_page_token(self) -> Self:
-        """Ensure that page_token is mutually exclusive with page_size and directory."""
+        """Ensure that page_token is mutually exclusive with directory and start_after, and is a valid token."""
         if self.page_token:
             get_files_query_params: dict = self.model_dump(exclude_defaults=True)
             directory_set: bool = "directory" in get_files_query_params.keys()
             if directory_set:
                 raise ValueError("page_token is mutually exclusive with directory")
+            if self.start_after is not None:
+                raise ValueError("page_token is mutually exclusive with start_after")
+            decode_listing_cursor(self.page_token)
         return self
 
 
@@ -188,6 +256,10 @@ class GeneratedFileType(str, Enum):
     AUDIO = "Text-to-Speech"
 
 
+# the longest text OpenAI synthesizes to speech in one request
+TEXT_TO_SPEECH_MAX_INPUT_CHARS = 4096
+
+
 class GenerateFilesQueryParams(BaseModel):
     """Query parameters for `POST /v1/files/generated`."""
 
@@ -207,6 +279,13 @@ class GenerateFilesQueryParams(BaseModel):
         description="The type of file to generate.",
         json_schema_extra={"example": "Text"},
     )
+    use_cache: bool = Field(
+        default=True,
+        description=(
+            "Reuse a file previously generated from the same prompt and parameters, copying it to `file_path` "
+            "instead of generating it again. Set to `false` to always generate a new file."
+        ),
+    )
 
     @model_validator(mode="after")
     def validate_file_path(self) -> Self:
@@ -222,6 +301,18 @@ class GenerateFilesQueryParams(BaseModel):
         if file_type == GeneratedFileType.AUDIO and not re.match(r".*\.(mp3|opus|aac|flac|wav|pcm)$", self.file_path):
             raise ValueError("For audio files, the path must end with .mp3, .opus, .aac, .flac, .wav, or .pcm")
 
+        # longer texts are synthesized in pieces that are joined afterwards, which FLAC and Opus files don't allow
+        unjoinable_extension = re.search(r"\.(flac|opus)$", self.file_path, re.IGNORECASE)
+        if (
+            file_type == GeneratedFileType.AUDIO
+            and unjoinable_extension
+            and len(self.prompt) > TEXT_TO_SPEECH_MAX_INPUT_CHARS
+        ):
+            raise ValueError(
+                f"For {unjoinable_extension.group(0).lower()} files, the prompt must be at most "
+                f"{TEXT_TO_SPEECH_MAX_INPUT_CHARS} characters"
+            )
+
         return self
 
 
@@ -262,3 +353,76 @@ class PostFileResponse(BaseModel):
             ]
         }
     )
+
+
+class GenerationJobStatus(str, Enum):
+    """The state of a generation job."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class GenerationJobResponse(BaseModel):
+    """Response model for `POST /v1/generation-jobs/:file_path` and `GET /v1/generation-jobs/:job_id`."""
+
+    job_id: str = Field(
+        description="The ID of the job, used to poll its status.",
+        json_schema_extra={"example": "3f2c9a0e5b6d4e7f8a9b0c1d2e3f4a5b"},
+    )
+    status: GenerationJobStatus = Field(
+        description="The state of the job.",
+        json_schema_extra={"example": "queued"},
+    )
+    file_path: str = Field(
+        description="The path the generated file is (or will be) uploaded to.",
+        json_schema_extra={"example": "path/to/file.txt"},
+    )
+    file_type: GeneratedFileType = Field(
+        description="The type of file generated.",
+        json_schema_extra={"example": "Text"},
+    )
+    generated_from_cache: Optional[bool] = Field(
+        default=None,
+        description="Whether the file was copied from a previous identical generation, once the job succeeded.",
+    )
+    error: Optional[str] = Field(
+        default=None,
+        description="Why the job failed, if it did.",
+    )
+
+
+class BulkGenerateFilesRequest(BaseModel):
+    """Request body for `POST /v1/files/generated`."""
+
+    items: List[GenerateFilesQueryParams] = Field(
+        ...,
+        min_length=1,
+        max_length=BULK_GENERATION_MAX_ITEMS,
+        description="The files to generate, each described like the parameters of `POST /v1/files/generated/:file_path`.",
+        json_schema_extra={
+            "example": [
+                {"file_path": "course/intro.mp3", "prompt": "Welcome to the course!", "file_type": "Text-to-Speech"},
+                {"file_path": "course/outro.mp3", "prompt": "Thanks for watching!", "file_type": "Text-to-Speech"},
+            ]
+        },
+    )
+    max_concurrency: Optional[int] = Field(
+        default=None,
+        ge=1,
+        description="Maximum number of files generated at the same time. Capped by the server's own limit.",
+    )
+
+
+class BulkGenerationItemResult(BaseModel):
+    """One line of the (newline-delimited JSON) response of `POST /v1/files/generated`."""
+
+    index: int = Field(description="The position of the item in the request.")
+    file_path: str = Field(description="The path to the file.")
+    status: GenerationJobStatus = Field(description="Whether the file was generated.")
+    generated_from_cache: Optional[bool] = Field(
+        default=None,
+        description="Whether the file was copied from a previous identical generation.",
+    )
+    error: Optional[str] = Field(default=None, description="Why the file could not be generated.")
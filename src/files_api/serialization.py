@@ -0,0 +1,96 @@
+"""
+Fast-path JSON serialization for `GET /v1/files`.
+
+Building a `FileMetadata` per listed object, wrapping them in a `GetFilesResponse` and letting FastAPI
+validate and serialize that model again costs far more than the listing data is worth: the objects
+come straight from S3 and already have the right types. The functions here turn `list_objects_v2`
+dicts into the JSON bytes of a `GetFilesResponse` directly with `orjson`.
+
+`files_api.schemas.GetFilesResponse` remains the documented contract. Optional `FileMetadata` fields are
+only returned when requested with ``include``, so the output is byte-for-byte what the pydantic models
+produce with ``exclude_unset=True``: a requested field is always present (``null`` if unknown), a field
+that was not requested is omitted rather than serialized as ``null``. The tests hold it to that.
+"""
+
+from typing import (
+    AbstractSet,
+    Any,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+)
+
+import orjson
+
+from files_api.listing import ObjectHeadMetadata
+from files_api.schemas import FileMetadataField
+from files_api.timing import timed
+
+try:
+    from mypy_boto3_s3.type_defs import ObjectTypeDef
+except ImportError:
+    ...
+
+# pydantic renders UTC datetimes with a "Z" suffix, orjson defaults to "+00:00"
+ORJSON_OPTIONS = orjson.OPT_UTC_Z
+
+
+def to_file_metadata_dict(
+    file: "ObjectTypeDef",
+    include_fields: AbstractSet[FileMetadataField] = frozenset(),
+    object_head_metadata: Optional[ObjectHeadMetadata] = None,
+) -> Dict[str, Any]:
+    """
+    Convert an object returned by `list_objects_v2` into the JSON shape of `FileMetadata`.
+
+    :param file: An object as returned by `list_objects_v2`.
+    :param include_fields: Optional `FileMetadata` fields requested by the client.
+    :param object_head_metadata: Metadata of the object from `head_object`, if it was fetched. Requested
+        fields that come from it are ``None`` without it.
+    """
+    file_metadata: Dict[str, Any] = {
+        "file_path": file["Key"],
+        "last_modified": file["LastModified"],
+        "size_bytes": file["Size"],
+    }
+    # in the order of the `FileMetadata` fields
+    if FileMetadataField.CONTENT_TYPE in include_fields:
+        file_metadata["content_type"] = object_head_metadata.content_type if object_head_metadata else None
+    if FileMetadataField.ETAG in include_fields:
+        file_metadata["etag"] = file.get("ETag")
+    if FileMetadataField.METADATA in include_fields:
+        file_metadata["metadata"] = object_head_metadata.metadata if object_head_metadata else None
+    return file_metadata
+
+
+@timed("serialize")
+def serialize_get_files_response(
+    files: List["ObjectTypeDef"],
+    next_page_token: Optional[str],
+    include_fields: AbstractSet[FileMetadataField] = frozenset(),
+    head_metadata: Optional[Mapping[str, ObjectHeadMetadata]] = None,
+) -> bytes:
+    """
+    Serialize a page of `list_objects_v2` objects to the JSON bytes of a `GetFilesResponse`.
+
+    :param files: Objects as returned by `list_objects_v2`.
+    :param next_page_token: Token of the next page, if any.
+    :param include_fields: Optional `FileMetadata` fields requested by the client.
+    :param head_metadata: Mapping of object key to its `head_object` metadata, if it was fetched.
+    """
+    head_metadata = head_metadata or {}
+    return orjson.dumps(
+        {
+            "files": [
+                to_file_metadata_dict(
+                    file=file,
+                    include_fields=include_fields,
+                    object_head_metadata=head_metadata.get(file["Key"]),
+                )
+                for file in files
+            ],
+            "next_page_token": next_page_token,
+        },
+        option=ORJSON_OPTIONS,
+    )
@@ -1,12 +1,27 @@
 """Settings for the Files API."""
 
-from pydantic import Field
+import os
+from typing import (
+    Dict,
+    Literal,
+    Optional,
+)
+
+from pydantic import (
+    Field,
+    model_validator,
+)
 from pydantic_settings import (
     BaseSettings,
     SettingsConfigDict,
 )
 
 
+def is_running_in_aws_lambda() -> bool:
+    """Return whether the process runs in an AWS Lambda execution environment."""
+    return "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+
+
 class Settings(BaseSettings):
     """
     Settings for the Files API.
@@ -16,5 +31,313 @@ class Settings(BaseSettings):
     """
 
     s3_bucket_name: str = Field(...)
+    s3_max_pool_connections: int = Field(
+        default=50,
+        description="Size of the connection pool of the app's shared S3 client.",
+    )
+    http_max_connections: int = Field(
+        default=20,
+        description="Size of the connection pool of the app's shared HTTP client (e.g. for downloading images).",
+    )
+    http_connect_timeout_seconds: float = Field(
+        default=5.0,
+        description="How long the shared HTTP client waits to establish a connection.",
+    )
+    http_read_timeout_seconds: float = Field(
+        default=30.0,
+        description="How long the shared HTTP client waits for each chunk of a response.",
+    )
+
+    openai_max_connections: int = Field(
+        default=20,
+        description="Maximum number of concurrent connections of the app's shared OpenAI client.",
+    )
+    openai_max_keepalive_connections: int = Field(
+        default=10,
+        description="Maximum number of idle connections the shared OpenAI client keeps open for reuse.",
+    )
+    openai_keepalive_expiry_seconds: float = Field(
+        default=30.0,
+        description="How long an idle connection of the shared OpenAI client is kept open.",
+    )
+    openai_connect_timeout_seconds: float = Field(
+        default=5.0,
+        description="How long the shared OpenAI client waits to establish a connection.",
+    )
+    openai_timeout_seconds: float = Field(
+        default=60.0,
+        description="How long the shared OpenAI client waits to read, write or get a pooled connection.",
+    )
+    openai_max_retries: int = Field(
+        default=2,
+        description=(
+            "How often the shared OpenAI client retries failed requests. Generations are retried by the "
+            "OpenAI scheduler instead, see `openai_max_attempts`."
+        ),
+    )
+    openai_http2: bool = Field(
+        default=False,
+        description="Talk HTTP/2 to OpenAI, multiplexing requests over one connection. Requires the `http2` extra.",
+    )
+    openai_max_concurrency_per_model: int = Field(
+        default=8,
+        description="Maximum number of calls to one OpenAI model in flight at the same time.",
+    )
+    openai_requests_per_minute: Dict[str, float] = Field(
+        default={},
+        description=(
+            'Requests per minute allowed by OpenAI, by model, e.g. `{"dall-e-3": 7}`. The calls to a model that '
+            "is not listed are paced once a 429 from OpenAI reports its limits."
+        ),
+    )
+    openai_tokens_per_minute: Dict[str, float] = Field(
+        default={},
+        description='Tokens per minute allowed by OpenAI, by model, e.g. `{"gpt-3.5-turbo": 200000}`.',
+    )
+    openai_max_attempts: int = Field(
+        default=5,
+        description="How many times a generation is attempted when OpenAI rate-limits it or fails transiently.",
+    )
+    openai_backoff_base_seconds: float = Field(
+        default=0.5,
+        description=(
+            "The delay before retrying a generation when OpenAI does not say how long to wait; doubles every retry."
+        ),
+    )
+    openai_backoff_max_seconds: float = Field(
+        default=30.0,
+        description="The longest delay between two attempts of a generation.",
+    )
+    image_response_format: Literal["url", "b64_json"] = Field(
+        default="b64_json",
+        description=(
+            "How generated images are returned by OpenAI. `b64_json` embeds the image in the API response; "
+            "`url` returns a link that has to be downloaded in a second round trip."
+        ),
+    )
+    image_post_processing_enabled: bool = Field(
+        default=True,
+        description=(
+            "Re-encode generated images to the format of their path with size-optimized settings, and render "
+            "`image_variant_sizes`. Requires the `images` extra; without it, images are stored as generated."
+        ),
+    )
+    image_processing_workers: int = Field(
+        # AWS Lambda cannot run process pools (it has no /dev/shm for their semaphores)
+        default_factory=lambda: 0 if is_running_in_aws_lambda() else 2,
+        description=(
+            "Number of processes post-processing images. 0 processes them in a worker thread instead, "
+            "the default on AWS Lambda, which cannot run process pools."
+        ),
+    )
+    image_jpeg_quality: int = Field(
+        default=85,
+        description="The quality (1-95) generated images are encoded with as JPEG.",
+    )
+    image_variant_sizes: Dict[str, int] = Field(
+        default={},
+        description=(
+            'Downscaled variants stored next to each generated image, by name, e.g. `{"thumbnail": 256}` stores '
+            "`cat.thumbnail.jpg`, fitting in 256x256 pixels, next to `cat.jpg`."
+        ),
+    )
+
+    generation_cache_enabled: bool = Field(
+        default=True,
+        description="Serve repeated generation requests by copying the previously generated file in S3.",
+    )
+    generation_cache_ttl_seconds: float = Field(
+        default=3600.0,
+        description="How long a generated file may be reused for identical generation requests.",
+    )
+    generation_cache_max_entries: int = Field(
+        default=1000,
+        description="Maximum number of generated files remembered for reuse.",
+    )
+
+    generation_job_queue_size: int = Field(
+        default=100,
+        description="Maximum number of generation jobs waiting to be processed before new ones are rejected.",
+    )
+    generation_job_workers: int = Field(
+        default=4,
+        description="Number of generation jobs processed concurrently.",
+    )
+    generation_job_ttl_seconds: float = Field(
+        default=24 * 3600.0,
+        description="How long the status of a generation job can be polled.",
+    )
+    generation_job_queue_url: Optional[str] = Field(
+        default=None,
+        description=(
+            "URL of an SQS queue to send generation jobs to, instead of processing them in the server's memory. "
+            "Required for generation jobs on AWS Lambda, where the queue is consumed by an SQS event source mapping."
+        ),
+    )
+    generation_job_status_s3_bucket_name: Optional[str] = Field(
+        default=None,
+        description="S3 bucket the statuses of the jobs sent to `generation_job_queue_url` are stored in.",
+    )
+
+    upload_part_size_bytes: int = Field(
+        default=8 * 1024 * 1024,
+        description=(
+            "Size of the multipart upload parts a raw `PUT /v1/files/...` body is streamed to S3 in (at least 5 MiB)."
+        ),
+    )
+    download_chunk_size_bytes: int = Field(
+        default=1024 * 1024,
+        description="Size of the chunks files are read from S3 and streamed to the client in by `GET /v1/files/...`.",
+    )
+
+    bulk_generation_concurrency: int = Field(
+        default=8,
+        description="Maximum number of files generated at the same time by one `POST /v1/files/generated` request.",
+    )
+
+    tts_chunk_max_chars: int = Field(
+        default=1500,
+        description=(
+            "Text-to-Speech prompts longer than this are split at sentence boundaries into pieces of at most "
+            "this many characters, synthesized concurrently and joined into one audio file."
+        ),
+    )
+    tts_concurrency: int = Field(
+        default=8,
+        description="Maximum number of pieces of one long Text-to-Speech prompt synthesized at the same time.",
+    )
+
+    server_timing_enabled: bool = Field(
+        default=True,
+        description=(
+            "Time the phases of every request (S3 calls, OpenAI calls, ...) and report them in a `Server-Timing` "
+            "response header and a JSON log line."
+        ),
+    )
+
+    metrics_enabled: bool = Field(
+        default=True,
+        description=(
+            "Collect request, S3, OpenAI and cache metrics, printed as CloudWatch Embedded Metric Format log lines "
+            "after every Lambda invocation, and exposed at `GET /metrics` if `metrics_token` is set."
+        ),
+    )
+    metrics_token: Optional[str] = Field(
+        default=None,
+        description=(
+            "Secret that scrapers of `GET /metrics` send as a bearer token (`Authorization: Bearer <token>`). "
+            "`GET /metrics` is disabled while unset."
+        ),
+    )
+    metrics_namespace: str = Field(
+        default="FilesAPI",
+        description="CloudWatch namespace of the metrics flushed in the Embedded Metric Format.",
+    )
+
+    tracing_enabled: bool = Field(
+        default=False,
+        description=(
+            "Trace requests through the S3 and OpenAI calls they make, continuing the trace of callers that send "
+            "a W3C `traceparent` header."
+        ),
+    )
+    tracing_sample_ratio: float = Field(
+        default=0.01,
+        description="Share of requests traced, from 0 to 1, unless the caller's `traceparent` decides.",
+    )
+    tracing_slow_request_seconds: Optional[float] = Field(
+        default=None,
+        description=(
+            "If set, record every request and also export the traces of requests that are not sampled but took "
+            "at least this long, to catch tail-latency outliers."
+        ),
+    )
+    tracing_exporter: Literal["jsonl", "memory"] = Field(
+        default="jsonl",
+        description="Export the spans of traced requests to a JSON Lines file, or keep them in memory (for tests).",
+    )
+    tracing_jsonl_path: str = Field(
+        default="/tmp/files-api-traces.jsonl",
+        description="The file the spans are appended to by the `jsonl` exporter.",
+    )
+
+    profiling_token: Optional[str] = Field(
+        default=None,
+        description=(
+            "Secret that enables profiling a request: requests whose `X-Profile` header holds it are profiled "
+            "(CPU samples and memory allocations). Profiling is disabled while unset."
+        ),
+    )
+    profiling_sample_interval_seconds: float = Field(
+        default=0.005,
+        description="Time between two samples of the stacks of the app's threads while a request is profiled.",
+    )
+    profiling_top_entries: int = Field(
+        default=30,
+        description="Number of functions and allocating lines of code reported in a profile.",
+    )
+    profiling_s3_bucket_name: Optional[str] = Field(
+        default=None,
+        description=(
+            "Bucket the profiles are stored in, at the location given in the `X-Profile-Location` response "
+            "header. If unset, the profile is returned instead of the response."
+        ),
+    )
+    profiling_s3_prefix: str = Field(
+        default="profiles/",
+        description="Prefix of the keys of the profiles stored in `profiling_s3_bucket_name`.",
+    )
+
+    prime_warmup_requests: bool = Field(
+        default=True,
+        description="While priming, send read-only warm-up requests through the app (and so to S3).",
+    )
+    prime_openai_client: bool = Field(
+        default=False,
+        description=(
+            "While priming, also create the OpenAI client. Importing `openai` takes hundreds of milliseconds, "
+            "so only enable this where generation traffic dominates or init time is free (provisioned concurrency)."
+        ),
+    )
+    prime_resolve_endpoints: bool = Field(
+        default=False,
+        description="While priming, resolve the hostnames of the S3 (and OpenAI, if primed) endpoints.",
+    )
+
+    listing_read_ahead: bool = Field(
+        # on Lambda, background tasks run before the invocation returns, so reading ahead only adds latency
+        default_factory=lambda: not is_running_in_aws_lambda(),
+        description=(
+            "Speculatively fetch the next page of `GET /v1/files` after serving a page. "
+            "Off by default on AWS Lambda."
+        ),
+    )
+    listing_cache_ttl_seconds: float = Field(
+        default=60.0,
+        description="How long a read-ahead page stays servable before it is considered stale.",
+    )
+    listing_cache_max_pages: int = Field(
+        default=256,
+        description="Maximum number of read-ahead pages kept in memory.",
+    )
+    head_object_concurrency: int = Field(
+        default=10,
+        description="Maximum concurrent `head_object` calls when a listing is enriched with `include=...`.",
+    )
+    object_metadata_cache_ttl_seconds: float = Field(
+        default=300.0,
+        description="How long the content type and user metadata of an object version stay cached.",
+    )
+    object_metadata_cache_max_entries: int = Field(
+        default=10_000,
+        description="Maximum number of object versions whose metadata is kept in memory.",
+    )
 
     model_config = SettingsConfigDict(case_sensitive=False)
+
+    @model_validator(mode="after")
+    def validate_generation_job_queue(self) -> "Settings":
+        """Ensure that the statuses of jobs sent to SQS have a bucket to be stored in."""
+        if self.generation_job_queue_url and not self.generation_job_status_s3_bucket_name:
+            raise ValueError("generation_job_queue_url requires generation_job_status_s3_bucket_name")
+        return self
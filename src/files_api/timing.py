@@ -0,0 +1,222 @@
+"""
+Break the latency of every request down into phases: S3 calls, OpenAI calls, downloads, serialization.
+
+The S3 helpers, the generate functions and a few other steps are wrapped with `timed` (or `measure`), which
+adds their duration to the `RequestTimings` of the request they run for, found in a context variable set by
+`ServerTimingMiddleware`. Context variables follow the request into `asyncio.to_thread` workers and tasks it
+creates, so phases running in threads or concurrently are attributed to it too. Outside of a request (e.g. in
+a background job), recording costs a single context variable lookup.
+
+Every completed phase is also passed to the `PHASE_OBSERVERS`, in a request or not, along with the error it
+raised (if any) and the labels given to `timed` or `measure`; `files_api.metrics` counts them this way.
+
+The middleware reports the phases completed before the response starts in a ``Server-Timing`` header, which
+browser dev tools display, and all phases, including the ones of a streamed body, in a structured (JSON)
+log line once the response is complete:
+
+    Server-Timing: s3-head;dur=12.1, openai-image;dur=2150.4, s3-put;dur=80.9;desc="x2", total;dur=2251.3
+"""
+
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+import orjson
+from starlette.types import (
+    ASGIApp,
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable)
+
+# called with the phase, its duration in seconds, the error it raised (if any) and its labels
+PhaseObserver = Callable[[str, float, Optional[BaseException], Mapping[str, str]], None]
+PHASE_OBSERVERS: List[PhaseObserver] = []
+
+
+class RequestTimings:
+    """The durations of the phases of one request, in seconds."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        # appending to a list is atomic, so worker threads can record phases without a lock
+        self.records: List[Tuple[str, float]] = []
+
+    def record(self, phase: str, duration_seconds: float) -> None:
+        self.records.append((phase, duration_seconds))
+
+    def summarize(self) -> Dict[str, Tuple[float, int]]:
+        """Return the total duration and the number of occurrences of each phase, in order of first occurrence."""
+        summary: Dict[str, Tuple[float, int]] = {}
+        for phase, duration_seconds in list(self.records):
+            total_seconds, count = summary.get(phase, (0.0, 0))
+            summary[phase] = (total_seconds + duration_seconds, count + 1)
+        return summary
+
+    def elapsed_seconds(self) -> float:
+        return time.perf_counter() - self.started_at
+
+
+REQUEST_TIMINGS: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def measure(phase: str, **labels: str) -> Iterator[None]:
+    """Record the duration of the block as ``phase`` of the current request, if any, and pass it to the observers."""
+    timings = REQUEST_TIMINGS.get()
+    if timings is None and not PHASE_OBSERVERS:
+        yield
+        return
+    start = time.perf_counter()
+    error: Optional[BaseException] = None
+    try:
+        yield
+    except BaseException as err:
+        error = err
+        raise
+    finally:
+        finish_phase(phase, time.perf_counter() - start, error, labels, timings)
+
+
+def timed(phase: str, **labels: str) -> Callable[[F], F]:
+    """Record the duration of every call of the decorated function (sync or async) as ``phase``."""
+
+    def decorator(fn: F) -> F:
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                timings = REQUEST_TIMINGS.get()
+                if timings is None and not PHASE_OBSERVERS:
+                    return await fn(*args, **kwargs)
+                start = time.perf_counter()
+                error: Optional[BaseException] = None
+                try:
+                    return await fn(*args, **kwargs)
+                except BaseException as err:
+                    error = err
+                    raise
+                finally:
+                    finish_phase(phase, time.perf_counter() - start, error, labels, timings)
+
+            return async_wrapper  # type: ignore
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            timings = REQUEST_TIMINGS.get()
+            if timings is None and not PHASE_OBSERVERS:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            error: Optional[BaseException] = None
+            try:
+                return fn(*args, **kwargs)
+            except BaseException as err:
+                error = err
+                raise
+            finally:
+                finish_phase(phase, time.perf_counter() - start, error, labels, timings)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def finish_phase(
+    phase: str,
+    duration_seconds: float,
+    error: Optional[BaseException],
+    labels: Mapping[str, str],
+    timings: Optional[RequestTimings],
+) -> None:
+    """Record a completed phase for the current request, if any, and pass it to the observers."""
+    if timings is not None:
+        timings.record(phase, duration_seconds)
+    for observer in PHASE_OBSERVERS:
+        observer(phase, duration_seconds, error, labels)
+
+
+def format_server_timing(timings: RequestTimings) -> str:
+    """Format the phases recorded so far, and the total, as the value of a ``Server-Timing`` header."""
+    metrics = []
+    for phase, (total_seconds, count) in timings.summarize().items():
+        metric = f"{phase};dur={total_seconds * 1000:.1f}"
+        metrics.append(metric if count == 1 else f'{metric};desc="x{count}"')
+    metrics.append(f"total;dur={timings.elapsed_seconds() * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+class ServerTimingMiddleware:
+    """
+    Time the phases of every HTTP request, and report them in a ``Server-Timing`` header and a log line.
+
+    A pure ASGI middleware, like `files_api.errors.BroadExceptionMiddleware`, so it adds no per-chunk cost to
+    streamed responses.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = REQUEST_TIMINGS.set(timings)
+        status_code = 500
+        first_byte_seconds: Optional[float] = None
+
+        async def send_with_server_timing(message: Message) -> None:
+            nonlocal status_code, first_byte_seconds
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                first_byte_seconds = timings.elapsed_seconds()
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", format_server_timing(timings).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            REQUEST_TIMINGS.reset(token)
+            log_request_timings(scope, status_code, first_byte_seconds, timings)
+
+
+def log_request_timings(
+    scope: Scope, status_code: int, first_byte_seconds: Optional[float], timings: RequestTimings
+) -> None:
+    """Log the phases of a completed request as a single JSON object."""
+    if not LOGGER.isEnabledFor(logging.INFO):
+        return
+    record = {
+        "event": "request_timings",
+        "method": scope["method"],
+        "path": scope["path"],
+        "status": status_code,
+        "duration_ms": round(timings.elapsed_seconds() * 1000, 1),
+        "first_byte_ms": round(first_byte_seconds * 1000, 1) if first_byte_seconds is not None else None,
+        "phases": {
+            phase: {"duration_ms": round(total_seconds * 1000, 1), "count": count}
+            for phase, (total_seconds, count) in timings.summarize().items()
+        },
+    }
+    LOGGER.info(orjson.dumps(record).decode("utf-8"))
@@ -0,0 +1,460 @@
+"""
+Trace requests through the S3 and OpenAI calls they make, to find out why the slowest ones are slow.
+
+A trace is a tree of spans: a root span per HTTP request, started by `TracingMiddleware`, and a child span per
+call of a function decorated with `traced` (the S3 helpers in `files_api.s3` and the generate functions in
+`files_api.generate`), with attributes such as the bucket, the key, the size and the status of the call.
+The current span is kept in a context variable, so calls made in `asyncio.to_thread` workers and in tasks
+find their parent.
+
+Requests join the trace of the caller when they carry a W3C ``traceparent`` header, and the response tells the
+caller which span handled it in a ``traceresponse`` header (Trace Context Level 2)::
+
+    traceparent: 00-<32 hex trace id>-<16 hex parent span id>-<01 if sampled, else 00>
+
+The app's own calls to OpenAI and to other HTTP services carry a ``traceparent`` header too, added by
+`inject_traceparent`, so that the trace follows the request into them.
+
+Tracing every request would cost too much under load, so it is sampled. A request is recorded if its caller
+sampled it, or else with a probability of ``sample_ratio``. To catch the outliers that sampling would miss,
+``slow_request_seconds`` records every request but only exports the ones that took longer than that (as well
+as the sampled ones). Requests that are not recorded cost one random number and one context variable lookup
+per traced call.
+
+Spans are exported when their request completes, to memory (`InMemorySpanExporter`, for tests and benchmarks)
+or appended to a JSON Lines file by a background thread (`JSONLinesSpanExporter`), one span per line.
+"""
+
+import functools
+import inspect
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union,
+)
+
+import orjson
+from starlette.types import (
+    ASGIApp,
+    Message,
+    Receive,
+    Scope,
+    Send,
+)
+
+from files_api.metrics import get_route_template
+
+if TYPE_CHECKING:
+    from files_api.settings import Settings
+
+F = TypeVar("F", bound=Callable)
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+INVALID_TRACE_ID = "0" * 32
+INVALID_SPAN_ID = "0" * 16
+
+AttributeValue = Union[str, int, float, bool]
+
+# the arguments of traced functions recorded as span attributes: argument name -> (attribute, conversion)
+ARGUMENT_ATTRIBUTES: Dict[str, tuple] = {
+    "bucket_name": ("bucket", str),
+    "object_key": ("key", str),
+    "source_key": ("source_key", str),
+    "destination_key": ("key", str),
+    "object_keys": ("key_count", len),
+    "prefix": ("prefix", str),
+    "file_content": ("size", len),
+    "prompt": ("prompt_chars", len),
+}
+
+
+class SpanContext(NamedTuple):
+    """What identifies a span across processes, as carried by a ``traceparent`` header."""
+
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+def parse_traceparent(value: str) -> Optional[SpanContext]:
+    """Parse a (version 00) ``traceparent`` header, returning None if it is invalid."""
+    match = TRACEPARENT_PATTERN.match(value.strip())
+    if match is None:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if trace_id == INVALID_TRACE_ID or span_id == INVALID_SPAN_ID:
+        return None
+    return SpanContext(trace_id=trace_id, span_id=span_id, sampled=bool(int(flags, 16) & 0x01))
+
+
+def format_traceparent(context: SpanContext) -> str:
+    return f"00-{context.trace_id}-{context.span_id}-{'01' if context.sampled else '00'}"
+
+
+def new_span_id() -> str:
+    return f"{random.getrandbits(64) or 1:016x}"
+
+
+def new_trace_id() -> str:
+    return f"{random.getrandbits(128) or 1:032x}"
+
+
+class TraceRecording:
+    """The spans of one trace recorded in this process, exported together when its root span ends."""
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        # appending to a list is atomic, so spans ending in worker threads need no lock
+        self.spans: List["Span"] = []
+
+
+class SpanTiming:
+    """When a span started, by the wall clock (to export it), and how long it took, by the monotonic clock."""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.duration_seconds: Optional[float] = None
+        self._started_at = time.perf_counter()
+
+    def stop(self) -> None:
+        self.duration_seconds = time.perf_counter() - self._started_at
+
+
+class Span:
+    """
+    A timed operation within a trace, with attributes describing it.
+
+    :param name: What the span measures, e.g. "s3.get_object".
+    :param trace: The recording of the trace the span belongs to.
+    :param parent_span_id: The id of the parent span, possibly in another process; None for a new trace.
+    :param attributes: The attributes known when the span starts.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        trace: TraceRecording,
+        parent_span_id: Optional[str],
+        attributes: Optional[Dict[str, AttributeValue]] = None,
+    ):
+        self.name = name
+        self.trace = trace
+        self.span_id = new_span_id()
+        self.parent_span_id = parent_span_id
+        self.attributes: Dict[str, AttributeValue] = attributes or {}
+        self.status = "ok"
+        self.timing = SpanTiming()
+
+    @property
+    def context(self) -> SpanContext:
+        return SpanContext(trace_id=self.trace.trace_id, span_id=self.span_id, sampled=self.trace.sampled)
+
+    def set_attribute(self, name: str, value: AttributeValue) -> None:
+        self.attributes[name] = value
+
+    def record_error(self, error: BaseException) -> None:
+        """Mark the span as failed, with the type of the error and the status code of the response, if any."""
+        self.status = "error"
+        self.attributes["error_type"] = type(error).__name__
+        status_code = getattr(error, "status_code", None)
+        response = getattr(error, "response", None)
+        if status_code is None and isinstance(response, dict):
+            # botocore's `ClientError`
+            status_code = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+            self.attributes["error_code"] = response.get("Error", {}).get("Code", "")
+        if isinstance(status_code, int):
+            self.attributes["status_code"] = status_code
+
+    def end(self) -> None:
+        self.timing.stop()
+        self.trace.spans.append(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time": self.timing.start_time,
+            "duration_ms": round((self.timing.duration_seconds or 0.0) * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+CURRENT_SPAN: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def start_span(name: str, **attributes: AttributeValue) -> Iterator[Optional[Span]]:
+    """
+    Record the block as a child of the current span, if the current request is traced.
+
+    :return: The new span, made current for the block, or None if the request is not traced.
+    """
+    parent = CURRENT_SPAN.get()
+    if parent is None:
+        yield None
+        return
+    span = Span(name, parent.trace, parent.span_id, attributes)
+    token = CURRENT_SPAN.set(span)
+    try:
+        yield span
+    except BaseException as err:
+        span.record_error(err)
+        raise
+    finally:
+        CURRENT_SPAN.reset(token)
+        span.end()
+
+
+def traced(
+    name: str, size_of_result: Optional[Callable[[Any], int]] = None, **attributes: AttributeValue
+) -> Callable[[F], F]:
+    """
+    Record every call of the decorated function (sync or async) as a span, when the current request is traced.
+
+    The span's attributes are ``attributes``, and the arguments listed in `ARGUMENT_ATTRIBUTES`.
+
+    :param name: The name of the span.
+    :param size_of_result: Returns the size of what the function returned, recorded as the "size" attribute.
+    """
+
+    def decorator(fn: F) -> F:
+        signature = inspect.signature(fn)
+        recorded_arguments = [argument for argument in signature.parameters if argument in ARGUMENT_ATTRIBUTES]
+
+        def get_attributes(args: tuple, kwargs: dict) -> Dict[str, AttributeValue]:
+            span_attributes = dict(attributes)
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            for argument in recorded_arguments:
+                value = arguments.get(argument)
+                if value is not None:
+                    attribute, convert = ARGUMENT_ATTRIBUTES[argument]
+                    span_attributes[attribute] = convert(value)
+            return span_attributes
+
+        def record_result(span: Optional[Span], result: Any) -> None:
+            if span is not None and size_of_result is not None:
+                span.set_attribute("size", size_of_result(result))
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if CURRENT_SPAN.get() is None:
+                    return await fn(*args, **kwargs)
+                with start_span(name, **get_attributes(args, kwargs)) as span:
+                    result = await fn(*args, **kwargs)
+                    record_result(span, result)
+                    return result
+
+            return async_wrapper  # type: ignore
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if CURRENT_SPAN.get() is None:
+                return fn(*args, **kwargs)
+            with start_span(name, **get_attributes(args, kwargs)) as span:
+                result = fn(*args, **kwargs)
+                record_result(span, result)
+                return result
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+class InMemorySpanExporter:
+    """Keep the last ``max_spans`` exported spans in memory, e.g. to inspect them in tests and benchmarks."""
+
+    def __init__(self, max_spans: int = 10_000):
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, spans: Sequence[Span]) -> None:
+        self.spans.extend(spans)
+
+    def close(self) -> None:
+        """Nothing to release: the spans stay in memory."""
+
+
+class JSONLinesSpanExporter:
+    """
+    Append the exported spans to a file, one JSON object per line.
+
+    Spans are exported when requests complete, on the event loop, so they are handed over to a writer thread
+    through a queue instead of being written there; the thread appends all the spans queued since its last
+    write at once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # a batch of spans to write, or None to stop the writer thread
+        self._queue: "queue.SimpleQueue[Optional[Sequence[Span]]]" = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_spans, name="jsonl-span-exporter", daemon=True)
+        self._writer.start()
+
+    def export(self, spans: Sequence[Span]) -> None:
+        self._queue.put(spans)
+
+    def close(self) -> None:
+        """Write the spans that are still queued, and stop the writer thread."""
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write_spans(self) -> None:
+        stopping = False
+        while not stopping:
+            batches = [self._queue.get()]
+            while not self._queue.empty():
+                batches.append(self._queue.get_nowait())
+            stopping = None in batches
+            lines = b"".join(
+                orjson.dumps(span.to_dict()) + b"\n" for spans in batches if spans is not None for span in spans
+            )
+            if lines:
+                with open(self.path, "ab") as file:
+                    file.write(lines)
+
+
+class Tracer:
+    """
+    Decide which requests to trace, and export their spans once they complete.
+
+    :param exporter: Where to export the spans of recorded requests.
+    :param sample_ratio: The share of requests to trace when the caller did not decide, from 0 to 1.
+    :param slow_request_seconds: If set, also record requests that are not sampled, and export them if they
+        took at least this long.
+    """
+
+    def __init__(
+        self,
+        exporter: Union[InMemorySpanExporter, JSONLinesSpanExporter],
+        sample_ratio: float = 1.0,
+        slow_request_seconds: Optional[float] = None,
+    ):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.slow_request_seconds = slow_request_seconds
+
+    @classmethod
+    def from_settings(cls, settings: "Settings") -> "Tracer":
+        exporter: Union[InMemorySpanExporter, JSONLinesSpanExporter] = (
+            InMemorySpanExporter()
+            if settings.tracing_exporter == "memory"
+            else JSONLinesSpanExporter(settings.tracing_jsonl_path)
+        )
+        return cls(
+            exporter=exporter,
+            sample_ratio=settings.tracing_sample_ratio,
+            slow_request_seconds=settings.tracing_slow_request_seconds,
+        )
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None) -> Optional[Span]:
+        """Start the root span of a request, continuing the caller's trace if any; None if it is not recorded."""
+        parent = parse_traceparent(traceparent) if traceparent else None
+        sampled = parent.sampled if parent is not None else random.random() < self.sample_ratio
+        if not sampled and self.slow_request_seconds is None:
+            return None
+        trace = TraceRecording(trace_id=parent.trace_id if parent else new_trace_id(), sampled=sampled)
+        return Span(name, trace, parent_span_id=parent.span_id if parent else None)
+
+    def end_trace(self, root_span: Span) -> None:
+        """End the root span of a request, and export its trace if it is sampled or slow."""
+        root_span.end()
+        trace = root_span.trace
+        # the span has just ended, so it has a duration
+        duration_seconds = root_span.timing.duration_seconds or 0.0
+        slow = self.slow_request_seconds is not None and duration_seconds >= self.slow_request_seconds
+        if trace.sampled or slow:
+            self.exporter.export(trace.spans)
+
+    def close(self) -> None:
+        """Export the spans still pending, and release the exporter."""
+        self.exporter.close()
+
+
+async def inject_traceparent(request: Any) -> None:
+    """
+    Tell the service called by an outbound request which span called it, with a ``traceparent`` header.
+
+    An event hook of the ``httpx`` (and ``httpx2``) clients the app calls other services with, so that their
+    spans join the trace of the request being served.
+    """
+    span = CURRENT_SPAN.get()
+    if span is not None:
+        request.headers["traceparent"] = format_traceparent(span.context)
+
+
+def get_header(scope: Scope, name: bytes) -> Optional[str]:
+    for header_name, value in scope["headers"]:
+        if header_name == name:
+            return value.decode("latin-1")
+    return None
+
+
+class TracingMiddleware:
+    """
+    Start a trace (or continue the caller's) for every HTTP request, with a root span named after its route.
+
+    A pure ASGI middleware, like `files_api.timing.ServerTimingMiddleware`.
+    """
+
+    def __init__(self, app: ASGIApp, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        root_span = self.tracer.start_trace(f"{method} {scope['path']}", get_header(scope, b"traceparent"))
+        if root_span is None:
+            await self.app(scope, receive, send)
+            return
+
+        root_span.set_attribute("method", method)
+        root_span.set_attribute("path", scope["path"])
+        token = CURRENT_SPAN.set(root_span)
+
+        async def send_with_traceresponse(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                root_span.set_attribute("status_code", message["status"])
+                if message["status"] >= 500:
+                    root_span.status = "error"
+                headers = list(message.get("headers", []))
+                headers.append((b"traceresponse", format_traceparent(root_span.context).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_traceresponse)
+        except BaseException as err:
+            root_span.record_error(err)
+            raise
+        finally:
+            CURRENT_SPAN.reset(token)
+            route = get_route_template(scope)
+            root_span.name = f"{method} {route}"
+            root_span.set_attribute("route", route)
+            self.tracer.end_trace(root_span)
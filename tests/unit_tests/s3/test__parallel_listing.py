@@ -0,0 +1,93 @@
+"""Test cases for `s3.parallel_listing`."""
+
+import boto3
+
+from files_api.s3.parallel_listing import (
+    S3KeyRange,
+    ShardingOptions,
+    discover_s3_shards,
+    iter_s3_objects,
+    list_s3_objects_sharded,
+)
+from files_api.timing import (
+    REQUEST_TIMINGS,
+    RequestTimings,
+)
+from tests.consts import TEST_BUCKET_NAME
+
+TEST_KEYS = [
+    "a.txt",
+    "folder1.txt",
+    "folder1/file1.txt",
+    "folder1/file2.txt",
+    "folder2/file3.txt",
+    "folder2/subfolder1/file4.txt",
+    "z.txt",
+]
+
+
+def put_test_objects() -> None:
+    s3_client = boto3.client("s3")
+    for key in TEST_KEYS:
+        s3_client.put_object(Bucket=TEST_BUCKET_NAME, Key=key, Body=f"content of {key}")
+
+
+def test_discover_s3_shards(mocked_aws: None):
+    """Test that delimiter discovery splits direct objects from sub-directories."""
+    put_test_objects()
+
+    files, common_prefixes = discover_s3_shards(bucket_name=TEST_BUCKET_NAME)
+    assert [file["Key"] for file in files] == ["a.txt", "folder1.txt", "z.txt"]
+    assert common_prefixes == ["folder1/", "folder2/"]
+
+
+def test_iter_s3_objects_in_key_range(mocked_aws: None):
+    """Test listing a bounded key range across several small pages."""
+    put_test_objects()
+
+    key_range = S3KeyRange(prefix="", start_after="a.txt", end_at="folder2/file3.txt")
+    keys = [file["Key"] for file in iter_s3_objects(TEST_BUCKET_NAME, key_range=key_range, page_size=2)]
+    assert keys == ["folder1.txt", "folder1/file1.txt", "folder1/file2.txt", "folder2/file3.txt"]
+
+
+def test_sharded_listing_matches_sequential_order(mocked_aws: None):
+    """Test that shards discovered with a delimiter are merged back in key order."""
+    put_test_objects()
+
+    keys = [
+        file["Key"]
+        for file in list_s3_objects_sharded(bucket_name=TEST_BUCKET_NAME, options=ShardingOptions(max_workers=2))
+    ]
+    assert keys == sorted(TEST_KEYS)
+
+    keys = [file["Key"] for file in list_s3_objects_sharded(bucket_name=TEST_BUCKET_NAME, prefix="folder2/")]
+    assert keys == ["folder2/file3.txt", "folder2/subfolder1/file4.txt"]
+
+
+def test_sharded_listing_with_split_points(mocked_aws: None):
+    """Test that `StartAfter` split points cover the key space without gaps or duplicates."""
+    put_test_objects()
+
+    keys = [
+        file["Key"]
+        for file in list_s3_objects_sharded(
+            bucket_name=TEST_BUCKET_NAME,
+            options=ShardingOptions(split_points=["folder1/file2.txt", "folder2/"]),
+        )
+    ]
+    assert keys == sorted(TEST_KEYS)
+
+
+def test_sharded_listing_times_every_page(mocked_aws: None):
+    """Test that the discovery and every shard's pages are timed into the request, from the worker threads too."""
+    put_test_objects()
+    timings = RequestTimings()
+    token = REQUEST_TIMINGS.set(timings)
+    try:
+        keys = [file["Key"] for file in list_s3_objects_sharded(bucket_name=TEST_BUCKET_NAME)]
+    finally:
+        REQUEST_TIMINGS.reset(token)
+
+    assert keys == sorted(TEST_KEYS)
+    # one delimiter listing, then one page for each of the "folder1/" and "folder2/" shards
+    assert timings.summarize()["s3-list"][1] == 3
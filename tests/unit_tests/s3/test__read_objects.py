@@ -1,8 +1,11 @@
 """Test cases for `s3.read_objects`."""
 
+import asyncio
+
 import boto3
 
 from files_api.s3.read_objects import (
+    aiter_s3_object_body,
     fetch_s3_objects_metadata,
     fetch_s3_objects_using_page_token,
     object_exists_in_s3,
@@ -115,3 +118,28 @@ def test_directory_queries(mocked_aws: None):  # noqa: R701
     assert files[3]["Key"] == "folder2/file3.txt"
     assert files[4]["Key"] == "folder2/subfolder1/file4.txt"
     assert next_page_token is None
+
+
+def test_aiter_s3_object_body(mocked_aws: None):
+    """Test reading an object's body in chunks of the given size, and closing it when the reader stops early."""
+    s3_client = boto3.client("s3")
+    content = bytes(range(256)) * 40
+    s3_client.put_object(Bucket=TEST_BUCKET_NAME, Key="testfile.bin", Body=content)
+
+    async def read_all() -> list:
+        body = s3_client.get_object(Bucket=TEST_BUCKET_NAME, Key="testfile.bin")["Body"]
+        return [chunk async for chunk in aiter_s3_object_body(body, chunk_size_bytes=4096)]
+
+    assert [len(chunk) for chunk in asyncio.run(read_all())] == [4096, 4096, 2048]
+    assert b"".join(asyncio.run(read_all())) == content
+
+    async def read_first_chunk():
+        body = s3_client.get_object(Bucket=TEST_BUCKET_NAME, Key="testfile.bin")["Body"]
+        chunks = aiter_s3_object_body(body, chunk_size_bytes=4096)
+        first_chunk = await chunks.__anext__()
+        await chunks.aclose()
+        return first_chunk, body
+
+    first_chunk, body = asyncio.run(read_first_chunk())
+    assert first_chunk == content[:4096]
+    assert body._raw_stream.closed  # pylint: disable=protected-access
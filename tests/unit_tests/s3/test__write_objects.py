@@ -1,8 +1,16 @@
 """Test cases for `s3.write_objects`."""
 
+import asyncio
+from typing import AsyncIterator
+
 import boto3
+import pytest
 
-from files_api.s3.write_objects import upload_s3_object
+from files_api.s3.write_objects import (
+    MIN_MULTIPART_PART_SIZE_BYTES,
+    upload_s3_object,
+    upload_s3_object_from_async_stream,
+)
 from tests.consts import TEST_BUCKET_NAME
 
 
@@ -25,3 +33,51 @@ def test__upload_s3_object(mocked_aws: None):
     response = s3_client.get_object(Bucket=TEST_BUCKET_NAME, Key=object_key)
     assert response["ContentType"] == content_type
     assert response["Body"].read() == file_content
+
+
+async def make_async_stream(content: bytes, chunk_size: int) -> AsyncIterator[bytes]:
+    """Yield ``content`` in chunks, like the body of an HTTP response being downloaded."""
+    for start in range(0, len(content), chunk_size):
+        end = start + chunk_size
+        yield content[start:end]
+
+
+@pytest.mark.parametrize("size_bytes", [1000, 2 * MIN_MULTIPART_PART_SIZE_BYTES + 1000])
+def test__upload_s3_object_from_async_stream(mocked_aws: None, size_bytes: int):
+    """Test uploading a stream that fits in one part and one that needs a multipart upload."""
+    object_key = "streamed.bin"
+    file_content = bytes(range(256)) * (size_bytes // 256) + b"x" * (size_bytes % 256)
+
+    uploaded_bytes = asyncio.run(
+        upload_s3_object_from_async_stream(
+            bucket_name=TEST_BUCKET_NAME,
+            object_key=object_key,
+            chunks=make_async_stream(file_content, chunk_size=1024 * 1024),
+            content_type="image/png",
+            part_size_bytes=MIN_MULTIPART_PART_SIZE_BYTES,
+        )
+    )
+
+    assert uploaded_bytes == size_bytes
+    response = boto3.client("s3").get_object(Bucket=TEST_BUCKET_NAME, Key=object_key)
+    assert response["ContentType"] == "image/png"
+    assert response["Body"].read() == file_content
+
+
+def test__upload_s3_object_from_async_stream_aborts_on_error(mocked_aws: None):
+    """Test that a stream failing halfway aborts the multipart upload instead of leaving it behind."""
+
+    async def failing_stream() -> AsyncIterator[bytes]:
+        yield b"x" * MIN_MULTIPART_PART_SIZE_BYTES
+        raise ConnectionError("download interrupted")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(
+            upload_s3_object_from_async_stream(
+                bucket_name=TEST_BUCKET_NAME, object_key="streamed.bin", chunks=failing_stream()
+            )
+        )
+
+    s3_client = boto3.client("s3")
+    assert "Uploads" not in s3_client.list_multipart_uploads(Bucket=TEST_BUCKET_NAME)
+    assert "Contents" not in s3_client.list_objects_v2(Bucket=TEST_BUCKET_NAME)
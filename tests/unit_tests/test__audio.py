@@ -0,0 +1,92 @@
+"""Test cases for `audio`: splitting long texts and joining the audio synthesized from them."""
+
+import io
+import struct
+import wave
+
+import pytest
+
+from files_api.audio import (
+    WAV_UNKNOWN_SIZE,
+    AudioJoiner,
+    parse_wav_file,
+    split_text_into_chunks,
+    strip_id3_tags,
+)
+from files_api.schemas import (
+    TEXT_TO_SPEECH_MAX_INPUT_CHARS,
+    GeneratedFileType,
+    GenerateFilesQueryParams,
+)
+
+
+def make_wav_file(samples: bytes, data_size: int = -1) -> bytes:
+    """Write a 16-bit mono 24 kHz WAV file with `wave`, optionally declaring another size for its data chunk."""
+    buffer = io.BytesIO()
+    with wave.Wave_write(buffer) as wav_writer:
+        wav_writer.setnchannels(1)
+        wav_writer.setsampwidth(2)
+        wav_writer.setframerate(24_000)
+        wav_writer.writeframes(samples)
+    wav_file = buffer.getvalue()
+    if data_size >= 0:
+        # the size of the data chunk is the last field of the 44-byte header `wave` writes for PCM
+        wav_file = wav_file[:40] + struct.pack("<I", data_size) + wav_file[44:]
+    return wav_file
+
+
+def test_split_text_into_chunks_at_sentence_boundaries():
+    """Test that sentences are packed into chunks without being cut, and that no text is lost."""
+    text = 'One two. "Three four?" Five six! Seven eight.'
+    chunks = split_text_into_chunks(text, max_chars=20)
+    assert chunks == ["One two.", '"Three four?"', "Five six!", "Seven eight."]
+    assert " ".join(chunks) == text
+    assert split_text_into_chunks(text, max_chars=100) == [text]
+
+
+def test_split_text_into_chunks_splits_long_sentences():
+    """Test that a sentence (or word) longer than a chunk is split between words (or anywhere)."""
+    chunks = split_text_into_chunks("a" * 25 + " bb cc", max_chars=10)
+    assert chunks == ["a" * 10, "a" * 10, "aaaaa bb", "cc"]
+
+
+def join_audio_files(audio_files: list, response_format: str) -> bytes:
+    joiner = AudioJoiner(response_format)
+    return b"".join(joiner.add(audio_file) for audio_file in audio_files)
+
+
+def test_join_wav_files():
+    """Test that WAV files are joined under a single streaming header, also when they have placeholder sizes."""
+    joined = join_audio_files(
+        [make_wav_file(b"\x01\x00" * 3), make_wav_file(b"\x02\x00" * 2, data_size=WAV_UNKNOWN_SIZE)], "wav"
+    )
+    fmt_chunk, samples = parse_wav_file(joined)
+    assert samples == b"\x01\x00" * 3 + b"\x02\x00" * 2
+    assert struct.unpack("<HHI", fmt_chunk[:8]) == (1, 1, 24_000)
+    # the length of the stream is unknown when its header is written
+    assert struct.unpack("<I", joined[4:8])[0] == WAV_UNKNOWN_SIZE
+
+
+def test_join_mp3_files_drops_inner_id3_tags():
+    """Test that the ID3 tags of all but the first MP3 file are dropped."""
+    id3v2_tag = b"ID3\x04\x00\x00\x00\x00\x00\x05" + b"12345"
+    id3v1_tag = b"TAG" + b"\x00" * 125
+    first, second = id3v2_tag + b"frames-1", id3v2_tag + b"frames-2" + id3v1_tag
+    assert strip_id3_tags(second) == b"frames-2"
+    assert join_audio_files([first, second], "mp3") == first + b"frames-2"
+
+
+@pytest.mark.parametrize("response_format", ["flac", "opus"])
+def test_join_pcm_files_and_unjoinable_formats(response_format: str):
+    """Test that raw PCM is concatenated, and that FLAC and Opus (Ogg streams with serial numbers) are refused."""
+    assert join_audio_files([b"\x01\x02", b"\x03"], "pcm") == b"\x01\x02\x03"
+    with pytest.raises(ValueError):
+        AudioJoiner(response_format)
+
+    # so their prompts are capped to what can be synthesized at once
+    with pytest.raises(ValueError, match=f"For .{response_format} files"):
+        GenerateFilesQueryParams(
+            file_path=f"speech.{response_format}",
+            prompt="a" * (TEXT_TO_SPEECH_MAX_INPUT_CHARS + 1),
+            file_type=GeneratedFileType.AUDIO,
+        )
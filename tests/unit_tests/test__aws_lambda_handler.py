@@ -0,0 +1,46 @@
+"""Test cases for `aws_lambda_handler`, mainly guarding the Lambda cold-start import budget."""
+
+import pytest
+
+from files_api.cold_start import run_in_fresh_interpreter
+from tests.consts import TEST_BUCKET_NAME
+
+# modules only needed to generate files; importing them eagerly costs hundreds of milliseconds per cold start
+LAZILY_IMPORTED_MODULES = ["openai", "requests"]
+
+# time to import the Lambda handler (which also creates the app) in a fresh interpreter
+IMPORT_TIME_BUDGET_SECONDS = 1.0
+
+IMPORT_LAMBDA_HANDLER_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import files_api.aws_lambda_handler
+print(json.dumps({"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}))
+"""
+
+
+def import_lambda_handler_in_fresh_interpreter() -> dict:
+    """Import the Lambda handler in a new Python process, like a Lambda cold start does."""
+    env = {
+        "S3_BUCKET_NAME": TEST_BUCKET_NAME,
+        # measure the app's own cold start: no credential lookups or warm-up requests to AWS
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "PRIME_WARMUP_REQUESTS": "false",
+    }
+    return run_in_fresh_interpreter(IMPORT_LAMBDA_HANDLER_SCRIPT, env=env)
+
+
+def test_cold_start_does_not_import_generation_stack():
+    """Test that importing the Lambda handler does not import the modules only used to generate files."""
+    imported_modules = set(import_lambda_handler_in_fresh_interpreter()["modules"])
+    assert imported_modules.isdisjoint(LAZILY_IMPORTED_MODULES)
+
+
+@pytest.mark.slow
+def test_cold_start_import_time_budget():
+    """Test that importing the Lambda handler stays within the cold-start import time budget."""
+    # best of a few runs, to measure the code rather than a noisy neighbour
+    seconds = min(import_lambda_handler_in_fresh_interpreter()["seconds"] for _ in range(3))
+    assert seconds < IMPORT_TIME_BUDGET_SECONDS, f"importing the Lambda handler took {seconds:.3f}s"
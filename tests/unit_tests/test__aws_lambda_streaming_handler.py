@@ -0,0 +1,248 @@
+"""Test cases for the streaming Lambda entry point, using a simulated Function URL and Runtime API."""
+
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Tuple,
+)
+
+import boto3
+import pytest
+from fastapi import FastAPI
+
+from files_api.aws_lambda_streaming_handler import (
+    HTTP_INTEGRATION_RESPONSE_CONTENT_TYPE,
+    PRELUDE_DELIMITER,
+    Writer,
+    build_asgi_scope,
+    build_prelude,
+    handle_next_invocation,
+    stream_asgi_response,
+)
+from files_api.main import create_app
+from files_api.settings import Settings
+from tests.consts import TEST_BUCKET_NAME
+
+TEST_FILE_PATH = "some/nested/file.bin"
+TEST_FILE_CONTENT = bytes(range(256)) * 64  # 16 KiB, streamed by the route in several chunks
+
+
+def make_function_url_event(method: str, path: str, query_string: str = "") -> dict:
+    """Build a minimal Lambda Function URL event (payload format version 2.0)."""
+    return {
+        "version": "2.0",
+        "rawPath": path,
+        "rawQueryString": query_string,
+        "headers": {"host": "abc.lambda-url.us-east-1.on.aws", "x-forwarded-proto": "https"},
+        "requestContext": {"http": {"method": method, "path": path, "sourceIp": "127.0.0.1"}},
+        "isBase64Encoded": False,
+    }
+
+
+def make_app_with_file() -> FastAPI:
+    """Create an app whose bucket contains the test file, which it downloads in several chunks."""
+    boto3.client("s3").put_object(
+        Bucket=TEST_BUCKET_NAME, Key=TEST_FILE_PATH, Body=TEST_FILE_CONTENT, ContentType="application/octet-stream"
+    )
+    return create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME, download_chunk_size_bytes=4096))
+
+
+def split_streamed_response(payload: bytes) -> Tuple[dict, bytes]:
+    """Split a streamed HTTP integration response into its prelude and its body."""
+    prelude, body = payload.split(PRELUDE_DELIMITER, 1)
+    return json.loads(prelude), body
+
+
+def test_build_asgi_scope():
+    """Test that a Function URL event is translated into an ASGI scope."""
+    event = make_function_url_event("GET", "/v1/files/a%20b.txt", query_string="page_size=1")
+    event["cookies"] = ["a=1", "b=2"]
+
+    scope = build_asgi_scope(event)
+    assert scope["method"] == "GET"
+    assert scope["path"] == "/v1/files/a b.txt"
+    assert scope["query_string"] == b"page_size=1"
+    assert (b"cookie", b"a=1; b=2") in scope["headers"]
+
+
+def test_stream_asgi_response_streams_file_in_chunks(mocked_aws: None):
+    """Test that a download is written as a prelude followed by several body chunks."""
+    app = make_app_with_file()
+    writes: List[bytes] = []
+
+    async def write(chunk: bytes) -> None:
+        writes.append(chunk)
+
+    asyncio.run(stream_asgi_response(app, make_function_url_event("GET", f"/v1/files/{TEST_FILE_PATH}"), write))
+
+    prelude, body = split_streamed_response(b"".join(writes))
+    assert prelude["statusCode"] == 200
+    assert prelude["headers"]["content-type"] == "application/octet-stream"
+    assert body == TEST_FILE_CONTENT
+    assert writes[0].endswith(PRELUDE_DELIMITER)
+    assert len(writes) > 2
+
+
+def test_stream_asgi_response_error_response(mocked_aws: None):
+    """Test that error responses are streamed with their status code."""
+    app = make_app_with_file()
+    writes: List[bytes] = []
+
+    async def write(chunk: bytes) -> None:
+        writes.append(chunk)
+
+    asyncio.run(stream_asgi_response(app, make_function_url_event("GET", "/v1/files/does/not/exist.txt"), write))
+
+    prelude, _ = split_streamed_response(b"".join(writes))
+    assert prelude["statusCode"] == 404
+
+
+class RuntimeApiRequest(NamedTuple):
+    """A request the fake Runtime API received."""
+
+    path: str
+    headers: Dict[str, str]
+    chunks: List[bytes]
+
+
+@contextmanager
+def run_fake_runtime_api(event: dict, drop_responses: bool = False) -> Iterator[Tuple[str, List[RuntimeApiRequest]]]:
+    """
+    Serve a fake Lambda Runtime API that hands out ``event`` and records the responses and errors posted to it.
+
+    :param drop_responses: Close the connection as soon as a response starts to be uploaded.
+    :return: ``host:port`` of the fake Runtime API, and the requests it received.
+    """
+    received: List[RuntimeApiRequest] = []
+
+    class FakeRuntimeApi(BaseHTTPRequestHandler):
+        """Hands out ``event`` and records what is posted back."""
+
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            body = json.dumps(event).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Lambda-Runtime-Aws-Request-Id", "request-1")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self) -> None:  # pylint: disable=invalid-name
+            if drop_responses and self.path.endswith("/response"):
+                received.append(RuntimeApiRequest(path=self.path, headers=dict(self.headers), chunks=[]))
+                self.close_connection = True
+                return
+            chunks = []
+            if self.headers.get("Transfer-Encoding") == "chunked":
+                while (size := int(self.rfile.readline().strip(), 16)) > 0:
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                self.rfile.readline()
+            else:
+                chunks.append(self.rfile.read(int(self.headers["Content-Length"])))
+            received.append(RuntimeApiRequest(path=self.path, headers=dict(self.headers), chunks=chunks))
+            self.send_response(202)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args: Any) -> None:  # pylint: disable=arguments-differ
+            ...
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRuntimeApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"127.0.0.1:{server.server_address[1]}", received
+    finally:
+        server.shutdown()
+
+
+@contextmanager
+def run_event_loop() -> Iterator[asyncio.AbstractEventLoop]:
+    """Run an event loop in another thread, like `run_forever` does."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    try:
+        yield loop
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_handle_next_invocation_against_simulated_runtime_api(mocked_aws: None):
+    """Test one invocation end-to-end against a fake Lambda Runtime API."""
+    app = make_app_with_file()
+    event = make_function_url_event("GET", f"/v1/files/{TEST_FILE_PATH}")
+
+    with run_fake_runtime_api(event) as (runtime_api, received), run_event_loop() as loop:
+        handle_next_invocation(app, loop=loop, runtime_api=runtime_api)
+
+    assert len(received) == 1
+    response = received[0]
+    assert response.path == "/2018-06-01/runtime/invocation/request-1/response"
+    assert response.headers["Lambda-Runtime-Function-Response-Mode"] == "streaming"
+    assert response.headers["Content-Type"] == HTTP_INTEGRATION_RESPONSE_CONTENT_TYPE
+    prelude, body = split_streamed_response(b"".join(response.chunks))
+    assert prelude["statusCode"] == 200
+    assert body == TEST_FILE_CONTENT
+    assert len(response.chunks) > 2
+
+
+def test_failure_before_the_response_is_reported_as_an_invocation_error(
+    mocked_aws: None, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that an app failing before it starts its response fails the invocation instead of streaming nothing."""
+    app = make_app_with_file()
+
+    async def fail(app: FastAPI, event: dict, write: Writer) -> None:
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr("files_api.aws_lambda_streaming_handler.stream_asgi_response", fail)
+    with run_fake_runtime_api(make_function_url_event("GET", "/v1/files")) as (runtime_api, received):
+        with run_event_loop() as loop:
+            handle_next_invocation(app, loop=loop, runtime_api=runtime_api)
+
+    assert len(received) == 1
+    error = received[0]
+    assert error.path == "/2018-06-01/runtime/invocation/request-1/error"
+    assert error.headers["Lambda-Runtime-Function-Error-Type"] == "Unhandled"
+    assert json.loads(b"".join(error.chunks)) == {
+        "errorMessage": "boom",
+        "errorType": "RuntimeError",
+        "stackTrace": [],
+    }
+
+
+def test_failed_upload_stops_the_app(mocked_aws: None, monkeypatch: pytest.MonkeyPatch):
+    """Test that when the Runtime API drops the response stream, the app is stopped instead of blocking forever."""
+    app = make_app_with_file()
+    app_stopped = threading.Event()
+
+    async def stream_endlessly(app: FastAPI, event: dict, write: Writer) -> None:
+        try:
+            await write(build_prelude(200, []))
+            while True:
+                await write(b"x" * 65536)
+        finally:
+            app_stopped.set()
+
+    monkeypatch.setattr("files_api.aws_lambda_streaming_handler.stream_asgi_response", stream_endlessly)
+    event = make_function_url_event("GET", "/v1/files")
+    with run_fake_runtime_api(event, drop_responses=True) as (runtime_api, received), run_event_loop() as loop:
+        handle_next_invocation(app, loop=loop, runtime_api=runtime_api)
+        assert app_stopped.wait(timeout=5)
+
+    assert [request.path for request in received] == [
+        "/2018-06-01/runtime/invocation/request-1/response",
+        "/2018-06-01/runtime/invocation/request-1/error",
+    ]
@@ -0,0 +1,19 @@
+"""Test cases for `generate`."""
+
+import asyncio
+import base64
+
+from files_api.generate import aiter_base64_decoded
+
+
+def test_aiter_base64_decoded():
+    """Test that base64 data decoded chunk by chunk equals the data decoded at once."""
+    data = bytes(range(256)) * 100 + b"tail"
+    b64_data = base64.b64encode(data).decode("ascii")
+
+    async def decode() -> list:
+        return [chunk async for chunk in aiter_base64_decoded(b64_data, chunk_size_bytes=1000)]
+
+    chunks = asyncio.run(decode())
+    assert len(chunks) > 1
+    assert b"".join(chunks) == data
@@ -0,0 +1,210 @@
+"""Test cases for `generation`: the generation cache and bulk generation."""
+
+import asyncio
+import json
+from typing import (
+    AsyncIterator,
+    List,
+)
+
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+
+from files_api import generation
+from files_api.audio import (
+    split_text_into_chunks,
+    strip_id3_tags,
+)
+from files_api.generation import (
+    SpeechStreamError,
+    start_speech_file_generation,
+)
+from files_api.main import create_app
+from files_api.schemas import (
+    GeneratedFileType,
+    GenerateFilesQueryParams,
+)
+from files_api.settings import Settings
+from tests.consts import TEST_BUCKET_NAME
+
+GENERATE_TEXT_PARAMS = {"prompt": "Test Prompt", "file_type": GeneratedFileType.TEXT.value}
+
+
+def test_repeated_generation_is_copied_from_cache(client: TestClient):
+    """Test that a second identical generation request copies the first file instead of calling OpenAI."""
+    response = client.post("/v1/files/generated/first.txt", params=GENERATE_TEXT_PARAMS)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.headers["X-Generation-Cache"] == "miss"
+
+    response = client.post("/v1/files/generated/second.txt", params=GENERATE_TEXT_PARAMS)
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.headers["X-Generation-Cache"] == "hit"
+
+    first, second = client.get("/v1/files/first.txt"), client.get("/v1/files/second.txt")
+    assert second.content == first.content
+    assert second.headers["Content-Type"] == "text/plain"
+
+
+def test_generation_cache_opt_out(client: TestClient):
+    """Test that `use_cache=false` always generates a new file."""
+    client.post("/v1/files/generated/first.txt", params=GENERATE_TEXT_PARAMS)
+
+    response = client.post("/v1/files/generated/second.txt", params={**GENERATE_TEXT_PARAMS, "use_cache": False})
+    assert response.headers["X-Generation-Cache"] == "miss"
+
+
+def test_generation_cache_skips_replaced_files(client: TestClient):
+    """Test that a cached file that was overwritten since it was generated is not reused."""
+    client.post("/v1/files/generated/first.txt", params=GENERATE_TEXT_PARAMS)
+    client.put("/v1/files/first.txt", files={"file_content": ("first.txt", b"replaced", "text/plain")})
+
+    response = client.post("/v1/files/generated/second.txt", params=GENERATE_TEXT_PARAMS)
+    assert response.headers["X-Generation-Cache"] == "miss"
+    assert client.get("/v1/files/second.txt").content != b"replaced"
+
+
+def test_bulk_generation_streams_one_result_per_item(client: TestClient):
+    """Test that every item of a bulk request is generated and reported on its own line."""
+    items = [
+        {"file_path": f"bulk/file-{i}.txt", "prompt": f"Prompt {i}", "file_type": GeneratedFileType.TEXT.value}
+        for i in range(3)
+    ] + [{"file_path": "bulk/speech.mp3", "prompt": "Hello", "file_type": GeneratedFileType.AUDIO.value}]
+
+    response = client.post("/v1/files/generated", json={"items": items, "max_concurrency": 2})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(result["index"] for result in results) == [0, 1, 2, 3]
+    assert all(result["status"] == "succeeded" for result in results)
+    for item in items:
+        assert client.get(f"/v1/files/{item['file_path']}").status_code == status.HTTP_200_OK
+
+
+def test_bulk_generation_validates_items(client: TestClient):
+    """Test that a bulk request is rejected as a whole if any item is invalid."""
+    items = [{"file_path": "bulk/file.png", "prompt": "Prompt", "file_type": GeneratedFileType.TEXT.value}]
+    response = client.post("/v1/files/generated", json={"items": items})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_streamed_text_generation(client: TestClient):
+    """Test that text is streamed as server-sent events and the complete text is uploaded at the end."""
+    response = client.post(
+        "/v1/files/generated/streamed.txt", params=GENERATE_TEXT_PARAMS, headers={"Accept": "text/event-stream"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["Content-Type"].startswith("text/event-stream")
+
+    events = [
+        (lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: ")))
+        for lines in (event.splitlines() for event in response.text.strip().split("\n\n"))
+    ]
+    assert [name for name, _ in events[:-1]] == ["token"] * (len(events) - 1)
+    assert events[-1] == ("done", {"file_path": "streamed.txt", "message": events[-1][1]["message"]})
+
+    streamed_text = "".join(data["text"] for _, data in events[:-1])
+    assert client.get("/v1/files/streamed.txt").text == streamed_text
+
+
+def test_speech_generation_streams_audio_to_client_and_s3(client: TestClient):
+    """Test that speech requested with an audio `Accept` header is played back while it is uploaded."""
+    params = {"prompt": "Hello there", "file_type": GeneratedFileType.AUDIO.value}
+    response = client.post("/v1/files/generated/speech.mp3", params=params, headers={"Accept": "audio/*"})
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.headers["Content-Type"] == "audio/mpeg"
+    assert response.headers["X-Generation-Cache"] == "miss"
+
+    uploaded = client.get("/v1/files/speech.mp3")
+    assert uploaded.headers["Content-Type"] == "audio/mpeg"
+    assert uploaded.content == response.content
+
+    response = client.post("/v1/files/generated/again.mp3", params=params, headers={"Accept": "audio/*"})
+    assert response.headers["X-Generation-Cache"] == "hit"
+    assert response.content == uploaded.content
+
+
+def make_fake_speech_upload(num_chunks: int, error: Exception = None):
+    """Replace `upload_generated_speech`: pass ``num_chunks`` chunks through the tee, then fail with ``error``."""
+
+    async def upload_generated_speech(app, params, tee) -> None:
+        async def audio_chunks() -> AsyncIterator[bytes]:
+            for index in range(num_chunks):
+                yield bytes([index])
+
+        async for _ in tee(audio_chunks(), "audio/mpeg"):
+            pass
+        if error:
+            raise error
+
+    return upload_generated_speech
+
+
+async def read_speech_stream(chunks: AsyncIterator[bytes]) -> List[bytes]:
+    return [chunk async for chunk in chunks]
+
+
+SPEECH_PARAMS = GenerateFilesQueryParams(file_path="speech.mp3", prompt="Hello", file_type=GeneratedFileType.AUDIO)
+
+
+def test_speech_stream_ends_with_an_error_when_the_upload_fails(mocked_aws, monkeypatch: pytest.MonkeyPatch):
+    """Test that audio the upload of which failed midway is not handed to the client as complete."""
+    monkeypatch.setattr(generation, "upload_generated_speech", make_fake_speech_upload(3, RuntimeError("S3 is down")))
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME))
+
+    async def scenario() -> None:
+        chunks, _, _ = await start_speech_file_generation(app, params=SPEECH_PARAMS, use_cache=False)
+        with pytest.raises(SpeechStreamError, match="S3 is down"):
+            await read_speech_stream(chunks)
+
+    asyncio.run(scenario())
+
+
+def test_speech_stream_of_a_client_that_fell_behind_ends(mocked_aws, monkeypatch: pytest.MonkeyPatch):
+    """Test that a client detached for not reading is not left waiting forever for the end of its stream."""
+    monkeypatch.setattr(generation, "TEE_CLIENT_TIMEOUT_SECONDS", 0.01)
+    monkeypatch.setattr(
+        generation, "upload_generated_speech", make_fake_speech_upload(generation.TEE_BUFFER_CHUNKS + 1)
+    )
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME, generation_cache_enabled=False))
+
+    async def scenario() -> None:
+        chunks, _, _ = await start_speech_file_generation(app, params=SPEECH_PARAMS, use_cache=False)
+        await asyncio.sleep(0.1)  # the upload finishes while the client reads nothing
+        with pytest.raises(SpeechStreamError, match="did not keep up"):
+            await asyncio.wait_for(read_speech_stream(chunks), timeout=1)
+
+    asyncio.run(scenario())
+
+
+def test_long_speech_is_synthesized_in_pieces_and_joined(mocked_aws, mocked_openai):
+    """Test that a prompt longer than `tts_chunk_max_chars` is synthesized per piece and stored as one file."""
+    settings = Settings(s3_bucket_name=TEST_BUCKET_NAME, tts_chunk_max_chars=50)
+    prompt = " ".join(f"This is sentence number {i} of a long narration." for i in range(6))
+    num_pieces = len(split_text_into_chunks(prompt, max_chars=50))
+    assert num_pieces > 1
+
+    with TestClient(create_app(settings=settings)) as client:
+        params = {"prompt": "Short.", "file_type": GeneratedFileType.AUDIO.value}
+        client.post("/v1/files/generated/piece.pcm", params=params)
+        client.post("/v1/files/generated/piece.mp3", params=params)
+        piece_pcm, piece_mp3 = client.get("/v1/files/piece.pcm").content, client.get("/v1/files/piece.mp3").content
+
+        params = {"prompt": prompt, "file_type": GeneratedFileType.AUDIO.value}
+        assert client.post("/v1/files/generated/long.pcm", params=params).status_code == status.HTTP_201_CREATED
+        assert client.post("/v1/files/generated/long.mp3", params=params).status_code == status.HTTP_201_CREATED
+
+        assert client.get("/v1/files/long.pcm").content == piece_pcm * num_pieces
+        assert client.get("/v1/files/long.mp3").content == piece_mp3 + strip_id3_tags(piece_mp3) * (num_pieces - 1)
+
+
+def test_generated_image_is_encoded_in_the_format_of_its_path(client: TestClient):
+    """Test that an image generated at a .jpg path is stored as a JPEG, although OpenAI returns a PNG."""
+    pytest.importorskip("PIL")
+    params = {"prompt": "A cat", "file_type": GeneratedFileType.IMAGE.value}
+    assert client.post("/v1/files/generated/cat.jpg", params=params).status_code == status.HTTP_201_CREATED
+
+    response = client.get("/v1/files/cat.jpg")
+    assert response.headers["Content-Type"] == "image/jpeg"
+    assert response.content.startswith(b"\xff\xd8\xff")  # the JPEG start-of-image marker
@@ -0,0 +1,55 @@
+"""Test cases for `images`."""
+
+import io
+import random
+
+import pytest
+
+from files_api.images import (
+    process_image,
+    variant_object_key,
+)
+from files_api.settings import Settings
+from tests.consts import TEST_BUCKET_NAME
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def make_png(width: int, height: int) -> bytes:
+    """Encode noise (which, like a photo, PNG compresses poorly) with an alpha channel as a PNG."""
+    image = Image.frombytes("RGBA", (width, height), random.Random(0).randbytes(width * height * 4))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_process_image_reencodes_to_the_format_of_the_path():
+    """Test that a PNG stored at a .jpg path becomes a (smaller) JPEG, with the variants that are smaller."""
+    png = make_png(400, 300)
+    encoded_images = process_image(png, ".jpg", variant_sizes={"thumbnail": 100, "huge": 1000})
+
+    assert set(encoded_images) == {"", "thumbnail"}
+    with Image.open(io.BytesIO(encoded_images[""])) as image:
+        assert (image.format, image.size) == ("JPEG", (400, 300))
+    with Image.open(io.BytesIO(encoded_images["thumbnail"])) as thumbnail:
+        assert (thumbnail.format, thumbnail.size) == ("JPEG", (100, 75))
+    assert len(encoded_images[""]) < len(png)
+
+
+def test_process_image_keeps_png():
+    """Test that an image stored at a .png path stays a PNG, transparency included."""
+    encoded_images = process_image(make_png(64, 64), ".png", variant_sizes={})
+    with Image.open(io.BytesIO(encoded_images[""])) as image:
+        assert (image.format, image.mode) == ("PNG", "RGBA")
+
+
+def test_variant_object_key():
+    """Test that variants are stored next to their image, with the same extension."""
+    assert variant_object_key("path/to/cat.jpg", "thumbnail") == "path/to/cat.thumbnail.jpg"
+
+
+def test_images_are_processed_in_a_thread_on_lambda(monkeypatch: pytest.MonkeyPatch):
+    """Test that on AWS Lambda, which cannot run process pools, images are not processed in worker processes."""
+    assert Settings(s3_bucket_name=TEST_BUCKET_NAME).image_processing_workers > 0
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "files-api")
+    assert Settings(s3_bucket_name=TEST_BUCKET_NAME).image_processing_workers == 0
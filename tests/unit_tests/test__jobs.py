@@ -0,0 +1,215 @@
+"""Test cases for generation jobs: the `jobs` module and the `/v1/generation-jobs` routes."""
+
+import asyncio
+import time
+
+import boto3
+import pytest
+from fastapi import status
+from fastapi.testclient import TestClient
+
+from files_api.jobs import (
+    InProcessJobQueue,
+    JobQueueFullError,
+    SQSJobQueue,
+)
+from files_api.main import create_app
+from files_api.schemas import (
+    GeneratedFileType,
+    GenerateFilesQueryParams,
+    GenerationJobStatus,
+)
+from files_api.settings import Settings
+from files_api.timing import (
+    REQUEST_TIMINGS,
+    RequestTimings,
+    measure,
+)
+from files_api.tracing import (
+    CURRENT_SPAN,
+    Span,
+    TraceRecording,
+    start_span,
+)
+from tests.consts import TEST_BUCKET_NAME
+
+TEST_PARAMS = GenerateFilesQueryParams(file_path="file.txt", prompt="Test Prompt", file_type=GeneratedFileType.TEXT)
+
+
+def test_generation_job_runs_in_background(client: TestClient):
+    """Test that a job is accepted right away and can be polled until the file is generated."""
+    response = client.post(
+        "/v1/generation-jobs/some/file.txt",
+        params={"prompt": "Test Prompt", "file_type": GeneratedFileType.TEXT.value},
+    )
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    job = response.json()
+    assert job["status"] in {GenerationJobStatus.QUEUED, GenerationJobStatus.RUNNING}
+    assert response.headers["Location"].endswith(f"/v1/generation-jobs/{job['job_id']}")
+
+    deadline = time.monotonic() + 10
+    while job["status"] not in {GenerationJobStatus.SUCCEEDED, GenerationJobStatus.FAILED}:
+        assert time.monotonic() < deadline, "the job did not finish in time"
+        time.sleep(0.05)
+        job = client.get(f"/v1/generation-jobs/{job['job_id']}").json()
+
+    assert job["status"] == GenerationJobStatus.SUCCEEDED
+    assert job["generated_from_cache"] is False
+    assert client.get("/v1/files/some/file.txt").status_code == status.HTTP_200_OK
+
+
+def test_get_unknown_generation_job(client: TestClient):
+    """Test that polling a job that does not exist is a 404."""
+    response = client.get("/v1/generation-jobs/does-not-exist")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_in_process_job_queue_rejects_jobs_when_full():
+    """Test that the queue is bounded: once the workers are busy and the queue is full, jobs are rejected."""
+
+    async def scenario() -> None:
+        release = asyncio.Event()
+
+        async def handler(params: GenerateFilesQueryParams) -> bool:
+            await release.wait()
+            return False
+
+        job_queue = InProcessJobQueue(handler=handler, maxsize=1, num_workers=1, job_ttl_seconds=60)
+        running_job = await job_queue.submit(TEST_PARAMS)
+        await asyncio.sleep(0)  # let the worker pick up the first job
+        queued_job = await job_queue.submit(TEST_PARAMS)
+        with pytest.raises(JobQueueFullError):
+            await job_queue.submit(TEST_PARAMS)
+
+        assert (await job_queue.get_job(running_job.job_id)).status == GenerationJobStatus.RUNNING
+        assert (await job_queue.get_job(queued_job.job_id)).status == GenerationJobStatus.QUEUED
+        release.set()
+        await asyncio.sleep(0.01)
+        assert (await job_queue.get_job(queued_job.job_id)).status == GenerationJobStatus.SUCCEEDED
+        await job_queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_in_process_job_queue_records_failures():
+    """Test that a job whose handler raises is marked as failed with the error."""
+
+    async def scenario() -> None:
+        async def handler(params: GenerateFilesQueryParams) -> bool:
+            raise RuntimeError("OpenAI is down")
+
+        job_queue = InProcessJobQueue(handler=handler, maxsize=10, num_workers=1, job_ttl_seconds=60)
+        job = await job_queue.submit(TEST_PARAMS)
+        await asyncio.sleep(0.01)
+        failed_job = await job_queue.get_job(job.job_id)
+        assert failed_job.status == GenerationJobStatus.FAILED
+        assert failed_job.error == "OpenAI is down"
+        await job_queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_in_process_job_queue_never_forgets_unfinished_jobs():
+    """Test that queued jobs are processed even when more jobs finished since than the queue remembers."""
+
+    async def scenario() -> None:
+        release = asyncio.Event()
+        processed_prompts = []
+
+        async def handler(params: GenerateFilesQueryParams) -> bool:
+            await release.wait()
+            processed_prompts.append(params.prompt)
+            return False
+
+        job_queue = InProcessJobQueue(handler=handler, maxsize=10, num_workers=1, job_ttl_seconds=60, max_jobs=1)
+        jobs = [await job_queue.submit(TEST_PARAMS.model_copy(update={"prompt": str(i)})) for i in range(3)]
+        assert all([await job_queue.get_job(job.job_id) for job in jobs])
+        release.set()
+        await asyncio.sleep(0.01)
+        assert processed_prompts == ["0", "1", "2"]
+        assert (await job_queue.get_job(jobs[-1].job_id)).status == GenerationJobStatus.SUCCEEDED
+        await job_queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_jobs_are_not_timed_nor_traced_into_the_request_that_started_the_workers():
+    """Test that the workers, even when the first submitted job starts them, don't record into that request."""
+
+    async def scenario() -> None:
+        request_timings = RequestTimings()
+        request_trace = TraceRecording(trace_id="4bf92f3577b34da6a3ce929d0e0e4736", sampled=True)
+        contexts_seen_by_jobs = []
+
+        async def handler(params: GenerateFilesQueryParams) -> bool:
+            with measure("openai-speech"), start_span("openai.speech"):
+                contexts_seen_by_jobs.append((REQUEST_TIMINGS.get(), CURRENT_SPAN.get()))
+            return False
+
+        job_queue = InProcessJobQueue(handler=handler, maxsize=10, num_workers=1, job_ttl_seconds=60)
+        REQUEST_TIMINGS.set(request_timings)
+        CURRENT_SPAN.set(Span("POST /v1/generation-jobs/{file_path:path}", request_trace, parent_span_id=None))
+        await job_queue.submit(TEST_PARAMS)
+        await asyncio.sleep(0.01)
+
+        assert contexts_seen_by_jobs == [(None, None)]
+        assert not request_timings.records
+        assert not request_trace.spans
+        await job_queue.stop()
+
+    asyncio.run(scenario())
+
+
+def test_sqs_job_queue_stores_statuses_in_s3(mocked_aws: None):
+    """Test that jobs are sent to SQS, and that processing their messages updates their status in S3."""
+    queue_url = boto3.client("sqs").create_queue(QueueName="generation-jobs")["QueueUrl"]
+
+    async def handler(params: GenerateFilesQueryParams) -> bool:
+        if params.prompt == "fail":
+            raise RuntimeError("OpenAI is down")
+        return True
+
+    async def scenario() -> None:
+        job_queue = SQSJobQueue(
+            handler=handler,
+            queue_url=queue_url,
+            status_bucket_name=TEST_BUCKET_NAME,
+            job_ttl_seconds=60,
+            get_s3_client=lambda: boto3.client("s3"),
+        )
+        job = await job_queue.submit(TEST_PARAMS)
+        failing_job = await job_queue.submit(TEST_PARAMS.model_copy(update={"prompt": "fail"}))
+        assert (await job_queue.get_job(job.job_id)).status == GenerationJobStatus.QUEUED
+
+        messages = boto3.client("sqs").receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)["Messages"]
+        event = {
+            "Records": [
+                {"messageId": message["MessageId"], "body": message["Body"], "eventSource": "aws:sqs"}
+                for message in messages
+            ]
+        }
+        assert await job_queue.process_sqs_event(event) == {"batchItemFailures": []}
+
+        succeeded_job = await job_queue.get_job(job.job_id)
+        assert succeeded_job.status == GenerationJobStatus.SUCCEEDED
+        assert succeeded_job.generated_from_cache is True
+        assert succeeded_job.params == TEST_PARAMS
+        failed_job = await job_queue.get_job(failing_job.job_id)
+        assert (failed_job.status, failed_job.error) == (GenerationJobStatus.FAILED, "OpenAI is down")
+        assert await job_queue.get_job("does-not-exist") is None
+
+    asyncio.run(scenario())
+
+
+def test_generation_jobs_are_refused_on_lambda_without_a_queue(
+    mocked_aws: None, mocked_openai: None, monkeypatch: pytest.MonkeyPatch
+):
+    """Test that on Lambda, where jobs kept in memory would stall, jobs need an SQS queue."""
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "files-api")
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME))
+    with TestClient(app) as client:
+        response = client.post(
+            "/v1/generation-jobs/file.txt", params={"prompt": "Test Prompt", "file_type": GeneratedFileType.TEXT.value}
+        )
+        assert response.status_code == status.HTTP_501_NOT_IMPLEMENTED
+        assert client.get("/v1/generation-jobs/some-job").status_code == status.HTTP_501_NOT_IMPLEMENTED
@@ -0,0 +1,83 @@
+"""Test cases for `listing`."""
+
+import boto3
+import pytest
+
+from files_api.cache import TTLCache
+from files_api.listing import (
+    ListingPage,
+    ObjectHeadMetadata,
+    fetch_listing_page,
+    fetch_objects_head_metadata,
+    get_listing_page,
+    prefetch_listing_page,
+)
+from files_api.listing_cursors import ListingCursor
+from tests.consts import TEST_BUCKET_NAME
+
+
+def test_fetch_listing_page_stays_within_prefix(mocked_aws: None):
+    """Test that following cursors pages through a prefix without leaking into other prefixes."""
+    s3_client = boto3.client("s3")
+    for key in ["folder1/file1.txt", "folder1/file2.txt", "folder1/file3.txt", "folder2/file4.txt"]:
+        s3_client.put_object(Bucket=TEST_BUCKET_NAME, Key=key, Body=b"content")
+
+    page = fetch_listing_page(TEST_BUCKET_NAME, ListingCursor(prefix="folder1/", page_size=2))
+    assert [file["Key"] for file in page.files] == ["folder1/file1.txt", "folder1/file2.txt"]
+    assert page.next_cursor == ListingCursor(prefix="folder1/", page_size=2, start_after="folder1/file2.txt")
+
+    page = fetch_listing_page(TEST_BUCKET_NAME, page.next_cursor)
+    assert [file["Key"] for file in page.files] == ["folder1/file3.txt"]
+    assert page.next_cursor is None
+
+
+def test_prefetched_page_is_served_from_cache(mocked_aws: None):
+    """Test that a page read ahead of time is served without another S3 call."""
+    boto3.client("s3").put_object(Bucket=TEST_BUCKET_NAME, Key="file1.txt", Body=b"content")
+    page_cache: TTLCache[ListingPage] = TTLCache(maxsize=8, ttl_seconds=60)
+    cursor = ListingCursor(prefix="", page_size=10)
+
+    prefetch_listing_page(page_cache=page_cache, bucket_name=TEST_BUCKET_NAME, cursor=cursor)
+    boto3.client("s3").delete_object(Bucket=TEST_BUCKET_NAME, Key="file1.txt")
+
+    page = get_listing_page(page_cache=page_cache, bucket_name=TEST_BUCKET_NAME, cursor=cursor)
+    assert [file["Key"] for file in page.files] == ["file1.txt"]
+    assert page_cache.hits == 1
+
+
+def test_page_prefetched_across_a_clear_is_not_stored(mocked_aws: None, monkeypatch: pytest.MonkeyPatch):
+    """Test that a page fetched while the cache was cleared (e.g. by an upload) is discarded as stale."""
+    boto3.client("s3").put_object(Bucket=TEST_BUCKET_NAME, Key="file1.txt", Body=b"content")
+    page_cache: TTLCache[ListingPage] = TTLCache(maxsize=8, ttl_seconds=60)
+    cursor = ListingCursor(prefix="", page_size=10)
+
+    def fetch_while_a_file_changes(**kwargs):
+        page = fetch_listing_page(**kwargs)
+        page_cache.clear()
+        return page
+
+    monkeypatch.setattr("files_api.listing.fetch_listing_page", fetch_while_a_file_changes)
+    prefetch_listing_page(page_cache=page_cache, bucket_name=TEST_BUCKET_NAME, cursor=cursor)
+
+    assert page_cache.get((TEST_BUCKET_NAME, cursor)) is None
+
+
+def test_fetch_objects_head_metadata_is_cached_per_version(mocked_aws: None):
+    """Test that object metadata is served from cache until the object is overwritten."""
+    s3_client = boto3.client("s3")
+    s3_client.put_object(Bucket=TEST_BUCKET_NAME, Key="file1.txt", Body=b"v1", ContentType="text/plain")
+    s3_client.put_object(Bucket=TEST_BUCKET_NAME, Key="file2.csv", Body=b"v1", Metadata={"author": "someone"})
+    metadata_cache: TTLCache[ObjectHeadMetadata] = TTLCache(maxsize=8, ttl_seconds=60)
+
+    files = s3_client.list_objects_v2(Bucket=TEST_BUCKET_NAME)["Contents"]
+    head_metadata = fetch_objects_head_metadata(metadata_cache, TEST_BUCKET_NAME, files)
+    assert head_metadata["file1.txt"].content_type == "text/plain"
+    assert head_metadata["file2.csv"].metadata == {"author": "someone"}
+
+    fetch_objects_head_metadata(metadata_cache, TEST_BUCKET_NAME, files)
+    assert metadata_cache.hits == 2
+
+    s3_client.put_object(Bucket=TEST_BUCKET_NAME, Key="file1.txt", Body=b"v2", ContentType="text/csv")
+    files = s3_client.list_objects_v2(Bucket=TEST_BUCKET_NAME)["Contents"]
+    head_metadata = fetch_objects_head_metadata(metadata_cache, TEST_BUCKET_NAME, files)
+    assert head_metadata["file1.txt"].content_type == "text/csv"
@@ -0,0 +1,24 @@
+"""Test cases for `listing_cursors`."""
+
+import pytest
+
+from files_api.listing_cursors import (
+    ListingCursor,
+    decode_listing_cursor,
+    encode_listing_cursor,
+)
+
+
+def test_listing_cursor_round_trip():
+    """Test that a cursor survives being encoded into a page token and decoded back."""
+    cursor = ListingCursor(prefix="folder1/", page_size=25, start_after="folder1/file 7.txt")
+    page_token = encode_listing_cursor(cursor)
+    assert "=" not in page_token
+    assert decode_listing_cursor(page_token) == cursor
+
+
+@pytest.mark.parametrize("page_token", ["token", "", encode_listing_cursor(ListingCursor("", 0)), "eyJwIjoxfQ"])
+def test_decode_invalid_listing_cursor(page_token: str):
+    """Test that malformed page tokens are rejected."""
+    with pytest.raises(ValueError, match="not a valid page token"):
+        decode_listing_cursor(page_token)
@@ -0,0 +1,164 @@
+"""Test cases for `metrics`."""
+
+import threading
+from typing import Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+
+from files_api.cache import TTLCache
+from files_api.main import create_app
+from files_api.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    collect_cache_metrics,
+    format_emf_documents,
+    render_prometheus_text,
+)
+from files_api.settings import Settings
+from tests.consts import TEST_BUCKET_NAME
+
+METRICS_TOKEN = "secret-token"
+METRICS_HEADERS = {"Authorization": f"Bearer {METRICS_TOKEN}"}
+
+
+def make_client(**settings) -> Iterator[TestClient]:
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME, **settings))
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def metrics_client(mocked_aws, mocked_openai) -> Iterator[TestClient]:
+    """A client of an app whose `GET /metrics` is scraped with a token."""
+    yield from make_client(metrics_token=METRICS_TOKEN)
+
+
+def get_sample_value(metrics_text: str, sample: str) -> float:
+    """Return the value of a sample (name and labels) in the Prometheus text format, or 0 if it is missing."""
+    for line in metrics_text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_values_updated_from_many_threads_are_summed():
+    """Test that every thread counts in its own cells, and that collecting the metric adds them up."""
+    counter = Counter("requests_total", "Requests.", ("route",))
+
+    def count() -> None:
+        for _ in range(1000):
+            counter.inc(("/a",))
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.collect().values == {("/a",): [4000.0]}
+
+
+def test_histogram_in_prometheus_text_format():
+    """Test that a histogram is rendered with cumulative buckets, its sum and its count."""
+    histogram = Histogram("duration_seconds", "Durations.", ("route",), buckets=(0.1, 1.0))
+    for value in [0.05, 0.5, 0.5, 2.0]:
+        histogram.observe(('/"a"',), value)
+
+    assert render_prometheus_text([histogram.collect()]).splitlines() == [
+        "# HELP duration_seconds Durations.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{route="/\\"a\\"",le="0.1"} 1',
+        'duration_seconds_bucket{route="/\\"a\\"",le="1"} 3',
+        'duration_seconds_bucket{route="/\\"a\\"",le="+Inf"} 4',
+        'duration_seconds_sum{route="/\\"a\\""} 3.05',
+        'duration_seconds_count{route="/\\"a\\""} 4',
+    ]
+
+
+def test_metrics_endpoint_counts_requests_s3_operations_and_bytes(metrics_client: TestClient):
+    """Test that `GET /metrics` reports requests by route template, the S3 calls they made and the bytes sent."""
+    route = 'route="/v1/files/{file_path:path}"'
+    client = metrics_client
+    before = client.get("/metrics", headers=METRICS_HEADERS).text
+
+    client.put("/v1/files/file.txt", content=b"content", headers={"Content-Type": "text/plain"})
+    client.get("/v1/files/file.txt")
+    client.get("/v1/files/other.txt")
+
+    response = client.get("/metrics", headers=METRICS_HEADERS)
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    after = response.text
+
+    def increase(sample: str) -> float:
+        return get_sample_value(after, sample) - get_sample_value(before, sample)
+
+    assert increase(f'files_api_http_requests_total{{method="GET",{route},status="200"}}') == 1
+    assert increase(f'files_api_http_requests_total{{method="GET",{route},status="404"}}') == 1
+    assert increase(f'files_api_http_request_duration_seconds_count{{method="GET",{route}}}') == 2
+    assert increase(f'files_api_http_body_bytes_total{{{route},direction="in"}}') == len(b"content")
+    assert increase('files_api_s3_operations_total{operation="get",status="ok"}') == 1
+    assert increase('files_api_s3_operations_total{operation="upload",status="ok"}') == 1
+    assert get_sample_value(after, 'files_api_http_requests_in_flight{method="GET"}') == 1  # the scrape itself
+    # the requests above never listed files, so the metadata cache has no hit ratio yet
+    assert 'files_api_cache_hits_total{cache="object_metadata"}' in after
+    assert 'files_api_cache_hit_ratio{cache="object_metadata"}' not in after
+
+
+def test_metrics_endpoint_requires_the_token(mocked_aws, mocked_openai):
+    """Test that `GET /metrics` rejects scrapers without the token, and is not served without a token set."""
+    for client in make_client(metrics_token=METRICS_TOKEN):
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer wrong-token"}).status_code == 401
+
+    for client in make_client():
+        assert client.get("/metrics", headers=METRICS_HEADERS).status_code == 404
+
+
+def test_caches_never_looked_up_have_no_hit_ratio():
+    """Test that a cache without lookups reports its hits and misses, but no hit ratio."""
+    families = {
+        family.name: family for family in collect_cache_metrics({"listing": TTLCache(maxsize=8, ttl_seconds=60)})
+    }
+
+    assert families["files_api_cache_hits_total"].values == {("listing",): [0.0]}
+    assert families["files_api_cache_hit_ratio"].values == {}
+
+
+def test_emf_documents_report_what_changed_since_the_last_flush():
+    """Test that counters and histograms are flushed as their increase, grouped by labels as dimensions."""
+    counter = Counter("s3_operations_total", "S3 operations.", ("operation",))
+    histogram = Histogram("s3_operation_duration_seconds", "S3 durations.", ("operation",))
+    last_flushed_values: dict = {}
+
+    counter.inc(("get",), 3)
+    histogram.observe(("get",), 0.2)
+    format_emf_documents([counter.collect(), histogram.collect()], "FilesAPI", last_flushed_values)
+    counter.inc(("get",), 2)
+    histogram.observe(("get",), 0.4)
+    histogram.observe(("get",), 0.6)
+    counter.inc(("put",))
+
+    documents = format_emf_documents([counter.collect(), histogram.collect()], "FilesAPI", last_flushed_values)
+    documents_by_operation = {document["operation"]: document for document in documents}
+    get_document = documents_by_operation["get"]
+    assert get_document["s3_operations_total"] == 2
+    assert get_document["s3_operation_duration_seconds_count"] == 2
+    assert get_document["s3_operation_duration_seconds_average"] == pytest.approx(0.5)
+    assert get_document["_aws"]["CloudWatchMetrics"][0]["Namespace"] == "FilesAPI"
+    assert get_document["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["operation"]]
+    assert documents_by_operation["put"]["s3_operations_total"] == 1
+    assert "s3_operation_duration_seconds_count" not in documents_by_operation["put"]
+
+
+def test_emf_documents_report_gauges_only_when_they_changed():
+    """Test that a gauge is flushed the first time, and then only once its value changed."""
+    gauge = Gauge("http_requests_in_flight", "Requests in flight.", ("method",))
+    last_flushed_values: dict = {}
+
+    gauge.inc(("GET",))
+    assert format_emf_documents([gauge.collect()], "FilesAPI", last_flushed_values)[0]["http_requests_in_flight"] == 1
+    assert format_emf_documents([gauge.collect()], "FilesAPI", last_flushed_values) == []
+    gauge.dec(("GET",))
+    assert format_emf_documents([gauge.collect()], "FilesAPI", last_flushed_values)[0]["http_requests_in_flight"] == 0
@@ -0,0 +1,135 @@
+"""Test cases for `openai_scheduler`."""
+
+import asyncio
+import time
+
+import httpx
+import pytest
+from openai import (
+    BadRequestError,
+    RateLimitError,
+)
+
+from files_api.openai_scheduler import (
+    OpenAIScheduler,
+    SchedulerConfig,
+    TokenBucket,
+    parse_duration_seconds,
+    retry_delay_seconds,
+)
+
+MODEL = "gpt-test"
+
+
+def make_status_error(error_class, status_code: int, headers: dict):
+    """Build an error as the OpenAI client raises it for a response with the given status code and headers."""
+    request = httpx.Request("POST", "http://localhost:1080/chat/completions")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return error_class("error", response=response, body=None)
+
+
+def test_identical_calls_in_flight_are_coalesced():
+    """Test that concurrent calls with the same key share one call, and that later calls make a new one."""
+    scheduler = OpenAIScheduler(SchedulerConfig(max_concurrency=4))
+    calls = []
+
+    async def make_call() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def run() -> list:
+        results = await asyncio.gather(*(scheduler.call(MODEL, make_call, coalesce_key="prompt") for _ in range(5)))
+        results.append(await scheduler.call(MODEL, make_call, coalesce_key="prompt"))
+        return results
+
+    assert asyncio.run(run()) == ["result"] * 6
+    assert len(calls) == 2
+
+
+def test_concurrency_is_limited_per_model():
+    """Test that no more than `max_concurrency` calls to a model run at once, independently of other models."""
+    scheduler = OpenAIScheduler(SchedulerConfig(max_concurrency=2))
+    running = {"a": 0, "b": 0}
+    max_running = {"a": 0, "b": 0}
+
+    async def make_call(model: str) -> None:
+        running[model] += 1
+        max_running[model] = max(max_running[model], running[model])
+        await asyncio.sleep(0.01)
+        running[model] -= 1
+
+    async def run() -> None:
+        await asyncio.gather(
+            *(scheduler.call(model, lambda model=model: make_call(model)) for model in "ab" for _ in range(6))
+        )
+
+    asyncio.run(run())
+    assert max_running == {"a": 2, "b": 2}
+
+
+def test_rate_limited_calls_are_retried_after_the_delay_openai_asks_for():
+    """Test that a 429 pauses the model for its `retry-after-ms`, adopts the limits it reports, then retries."""
+    scheduler = OpenAIScheduler(SchedulerConfig(max_concurrency=4))
+    attempts = []
+    headers = {"retry-after-ms": "50", "x-ratelimit-limit-requests": "6000"}
+
+    async def make_call() -> str:
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise make_status_error(RateLimitError, 429, headers)
+        return "result"
+
+    assert asyncio.run(scheduler.call(MODEL, make_call)) == "result"
+    assert attempts[1] - attempts[0] >= 0.05
+    assert scheduler.limiter(MODEL).requests.rate_per_minute == 6000
+
+
+def test_errors_that_are_not_transient_are_raised_right_away():
+    """Test that a 400 or a bug is not retried, and that a 429 is raised once the attempts are exhausted."""
+    scheduler = OpenAIScheduler(SchedulerConfig(max_concurrency=4, max_attempts=2, backoff_base_seconds=0.001))
+    attempts = []
+
+    async def fail(error_class, status_code: int) -> None:
+        attempts.append(status_code)
+        raise make_status_error(error_class, status_code, headers={})
+
+    async def crash() -> None:
+        attempts.append(0)
+        raise ValueError("not an error of the OpenAI client")
+
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.call(MODEL, crash))
+    with pytest.raises(BadRequestError):
+        asyncio.run(scheduler.call(MODEL, lambda: fail(BadRequestError, 400)))
+    with pytest.raises(RateLimitError):
+        asyncio.run(scheduler.call(MODEL, lambda: fail(RateLimitError, 429)))
+    assert attempts == [0, 400, 429, 429]
+
+
+def test_token_bucket_paces_reservations():
+    """Test that reservations beyond the burst capacity wait for the bucket to refill, in order."""
+    bucket = TokenBucket(rate_per_minute=600, burst_seconds=1.0)  # 10 per second, bursts of 10
+    assert bucket.reserve(10) == 0
+    assert bucket.reserve(5) == pytest.approx(0.5, abs=0.01)
+    assert bucket.reserve(5) == pytest.approx(1.0, abs=0.01)
+
+
+def test_retry_delay_from_headers():
+    """Test that the delay is read from `retry-after(-ms)`, or from the reset of the exhausted limit."""
+    assert retry_delay_seconds({"retry-after-ms": "250", "retry-after": "1"}) == 0.25
+    assert retry_delay_seconds({"retry-after": "2"}) == 2
+    assert (
+        retry_delay_seconds(
+            {
+                "x-ratelimit-remaining-requests": "10",
+                "x-ratelimit-reset-requests": "1m0s",
+                "x-ratelimit-remaining-tokens": "0",
+                "x-ratelimit-reset-tokens": "1.5s",
+            }
+        )
+        == 1.5
+    )
+    assert retry_delay_seconds({}) is None
+    assert parse_duration_seconds("1h2m3.5s") == 3723.5
+    assert parse_duration_seconds("20ms") == pytest.approx(0.02)
@@ -0,0 +1,83 @@
+"""Test cases for `priming` and the shared clients it builds."""
+
+import asyncio
+
+from fastapi.testclient import TestClient
+from openai import Timeout
+
+from files_api.clients import (
+    get_shared_openai_client,
+    get_shared_s3_client,
+)
+from files_api.main import create_app
+from files_api.metrics import (
+    HTTP_REQUESTS,
+    S3_OPERATIONS,
+)
+from files_api.priming import (
+    WARMUP_REQUESTS,
+    prime_app,
+    send_warmup_request,
+)
+from files_api.settings import Settings
+from tests.consts import TEST_BUCKET_NAME
+
+
+def test_shared_s3_client_is_reused(mocked_aws: None):
+    """Test that every request of an app gets the same S3 client."""
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME))
+    assert get_shared_s3_client(app) is get_shared_s3_client(app)
+
+
+def test_prime_app(mocked_aws: None):
+    """Test that priming builds the shared S3 client and sends the warm-up requests."""
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME))
+
+    timings = prime_app(app)
+    assert app.state.s3_client is not None
+    assert set(timings) == {"s3_client", "warmup_requests"}
+
+
+def test_warmup_requests_are_not_counted_in_metrics(mocked_aws: None):
+    """Test that the metrics flushed after priming only count the requests that came after it."""
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME, metrics_enabled=True))
+
+    prime_app(app)
+    assert not HTTP_REQUESTS.collect().values
+    assert not S3_OPERATIONS.collect().values
+    assert app.state.listing_page_cache.misses == 0
+
+
+def test_warmup_requests_are_read_only_and_succeed(mocked_aws: None):
+    """Test that the warm-up requests go through the whole app without errors."""
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME))
+
+    for method, path, query_string in WARMUP_REQUESTS:
+        assert method in {"GET", "HEAD"}
+        status_code = asyncio.run(send_warmup_request(app, method=method, path=path, query_string=query_string))
+        assert status_code in {200, 404}
+
+
+def test_prime_app_does_not_raise_when_s3_is_unreachable(mocked_aws: None):
+    """Test that a failing warm-up is logged instead of failing the Lambda init phase."""
+    app = create_app(settings=Settings(s3_bucket_name="bucket-that-does-not-exist"))
+
+    timings = prime_app(app)
+    assert "warmup_requests" in timings
+
+
+def test_openai_client_lives_as_long_as_the_app(mocked_aws: None, mocked_openai: None):
+    """Test that the lifespan creates one tuned OpenAI client, shares it with the routes and closes it."""
+    app = create_app(
+        settings=Settings(s3_bucket_name=TEST_BUCKET_NAME, openai_max_retries=0, openai_timeout_seconds=12.0)
+    )
+    with TestClient(app):
+        openai_client = app.state.openai_client
+        assert get_shared_openai_client(app) is openai_client
+        assert openai_client.max_retries == 0
+        timeout = openai_client.timeout
+        assert isinstance(timeout, Timeout)
+        assert timeout.read == 12.0
+
+    assert app.state.openai_client is None
+    assert openai_client.is_closed()
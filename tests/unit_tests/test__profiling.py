@@ -0,0 +1,68 @@
+"""Test cases for `profiling`."""
+
+import json
+from typing import Iterator
+
+import boto3
+from fastapi.testclient import TestClient
+
+from files_api.main import create_app
+from files_api.settings import Settings
+from tests.consts import TEST_BUCKET_NAME
+
+PROFILING_TOKEN = "secret-token"
+FILE_SIZE_BYTES = 4 * 1024 * 1024
+
+
+def make_client(**settings) -> Iterator[TestClient]:
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME, **settings))
+    with TestClient(app) as client:
+        yield client
+
+
+def upload_file(client: TestClient, headers: dict):
+    """Upload a file as a form, whose content the route reads whole."""
+    files = {"file_content": ("file.bin", b"x" * FILE_SIZE_BYTES, "application/octet-stream")}
+    return client.put("/v1/files/file.bin", files=files, headers=headers)
+
+
+def test_profile_is_returned_instead_of_the_response(mocked_aws, mocked_openai):
+    """Test that a request with the token gets its CPU and memory profile, including the whole file read."""
+    for client in make_client(profiling_token=PROFILING_TOKEN, profiling_sample_interval_seconds=0.001):
+        response = upload_file(client, headers={"X-Profile": PROFILING_TOKEN})
+
+        assert response.status_code == 200
+        profile = response.json()
+        assert profile["response"]["status"] == 201
+        assert (profile["method"], profile["path"]) == ("PUT", "/v1/files/file.bin")
+        assert profile["cpu"]["num_samples"] > 0
+        assert profile["memory"]["peak_bytes"] >= FILE_SIZE_BYTES
+        # the file, held whole in memory, is traced back to the route
+        top_allocations = profile["memory"]["top_allocations"]
+        assert any(
+            frame.startswith("routes.py:") for allocation in top_allocations for frame in allocation["app_frames"]
+        )
+
+
+def test_profile_is_stored_in_s3(mocked_aws, mocked_openai):
+    """Test that with a bucket for profiles, the response is served as usual and the profile is uploaded."""
+    for client in make_client(profiling_token=PROFILING_TOKEN, profiling_s3_bucket_name=TEST_BUCKET_NAME):
+        response = upload_file(client, headers={"X-Profile": PROFILING_TOKEN})
+
+        assert response.status_code == 201
+        location = response.headers["X-Profile-Location"]
+        assert location.startswith(f"s3://{TEST_BUCKET_NAME}/profiles/")
+        object_key = location.split("/", 3)[3]
+        profile = json.loads(boto3.client("s3").get_object(Bucket=TEST_BUCKET_NAME, Key=object_key)["Body"].read())
+        assert set(profile) >= {"cpu", "memory", "duration_ms"}
+
+
+def test_requests_without_a_valid_token_are_not_profiled(mocked_aws, mocked_openai):
+    """Test that the header is ignored when its token is wrong, or when profiling is disabled."""
+    for client in make_client(profiling_token=PROFILING_TOKEN):
+        response = upload_file(client, headers={"X-Profile": "wrong-token"})
+        assert response.json()["file_path"] == "file.bin"
+
+    for client in make_client():
+        response = upload_file(client, headers={"X-Profile": PROFILING_TOKEN})
+        assert response.json()["file_path"] == "file.bin"
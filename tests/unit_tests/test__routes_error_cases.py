@@ -53,6 +53,29 @@ def test_get_files_page_token_is_mutually_exclusive_with_page_size_and_directory
     assert "mutually exclusive" in str(response.json())
 
 
+def test_get_files_invalid_page_token(client: TestClient):
+    """Test that a 422 Unprocessable Entity error is returned when the page token cannot be decoded."""
+    response = client.get("/v1/files?page_token=not-a-page-token")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert "not a valid page token" in str(response.json())
+
+
+def test_get_files_invalid_include(client: TestClient):
+    """Test that a 422 Unprocessable Entity error is returned when an unknown field is requested with include."""
+    response = client.get("/v1/files?include=content_type,owner")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_upload_file_as_url_encoded_form(client: TestClient):
+    """Test that a 415 Unsupported Media Type error is returned for a URL-encoded form, which cannot carry a file."""
+    # e.g. what `curl --data-binary @file.txt` sends, unless it is told the file's content type
+    response = client.put(
+        "/v1/files/file.txt", content=b"content", headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    assert client.get("/v1/files/file.txt").status_code == status.HTTP_404_NOT_FOUND
+
+
 def test_unforeseen_500_error(client: TestClient):
     """Test that a 500 Internal Server Error is returned when an unforeseen error occurs."""
     # Delete the S3 bucket and all objects inside name from the app state to force an unforeseen error
@@ -1,9 +1,14 @@
 """Unit tests for the main FastAPI application."""
 
+from typing import Iterator
+
 from fastapi import status
 from fastapi.testclient import TestClient
 
+from files_api.main import create_app
 from files_api.schemas import GeneratedFileType
+from files_api.settings import Settings
+from tests.consts import TEST_BUCKET_NAME
 
 TEST_FILE_PATH = "some/nested/path/file.txt"
 TEST_FILE_CONTENT = b"Hello, world!"
@@ -37,6 +42,42 @@ def test_upload_file(client: TestClient):
     }
 
 
+def test_upload_file_as_raw_body(client: TestClient):
+    """Test uploading a file sent as the raw request body, with its own content type."""
+    response = client.put(
+        f"/v1/files/{TEST_FILE_PATH}", content=TEST_FILE_CONTENT, headers={"Content-Type": "text/csv"}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["message"] == f"New file uploaded at path: {TEST_FILE_PATH}"
+
+    response = client.get(f"/v1/files/{TEST_FILE_PATH}")
+    assert response.content == TEST_FILE_CONTENT
+    assert response.headers["Content-Type"] == "text/csv"
+
+
+def iter_chunks(content: bytes, chunk_size: int) -> Iterator[bytes]:
+    """Yield ``content`` in chunks, like a client sending a body as it reads it."""
+    for start in range(0, len(content), chunk_size):
+        end = start + chunk_size
+        yield content[start:end]
+
+
+def test_upload_large_file_as_raw_body_in_parts(mocked_aws: None):
+    """Test that a raw body larger than a part is streamed to S3 as a multipart upload."""
+    file_content = bytes(range(256)) * (11 * 1024 * 1024 // 256)
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME, upload_part_size_bytes=5 * 1024 * 1024))
+    with TestClient(app) as client:
+        response = client.put(
+            "/v1/files/large.bin",
+            content=iter_chunks(file_content, chunk_size=65536),
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+        response = client.get("/v1/files/large.bin")
+        assert response.content == file_content
+
+
 def test_list_files_with_pagination(client: TestClient):
     """Test listing files with pagination using GET method."""
     # Upload files
@@ -53,6 +94,49 @@ def test_list_files_with_pagination(client: TestClient):
     assert "next_page_token" in data
 
 
+def test_list_files_in_directory_with_pagination(client: TestClient):
+    """Test that following page tokens stays within the requested directory."""
+    for path in ["dir1/file1.txt", "dir1/file2.txt", "dir1/file3.txt", "dir2/file4.txt"]:
+        client.put(f"/v1/files/{path}", files={"file_content": (path, TEST_FILE_CONTENT, TEST_FILE_CONTENT_TYPE)})
+
+    response = client.get("/v1/files", params={"directory": "dir1/", "page_size": 2})
+    data = response.json()
+    assert [file["file_path"] for file in data["files"]] == ["dir1/file1.txt", "dir1/file2.txt"]
+
+    response = client.get("/v1/files", params={"page_token": data["next_page_token"]})
+    data = response.json()
+    assert [file["file_path"] for file in data["files"]] == ["dir1/file3.txt"]
+    assert data["next_page_token"] is None
+
+
+def test_list_files_start_after(client: TestClient):
+    """Test starting a listing at an arbitrary file path."""
+    for i in range(5):
+        client.put(f"/v1/files/file{i}.txt", files={"file_content": (f"file{i}.txt", TEST_FILE_CONTENT)})
+
+    response = client.get("/v1/files", params={"start_after": "file2.txt", "page_size": 2})
+    data = response.json()
+    assert [file["file_path"] for file in data["files"]] == ["file3.txt", "file4.txt"]
+
+
+def test_list_files_with_include(client: TestClient):
+    """Test that optional file metadata is only returned when requested with `include`."""
+    client.put(
+        f"/v1/files/{TEST_FILE_PATH}",
+        files={"file_content": (TEST_FILE_PATH, TEST_FILE_CONTENT, TEST_FILE_CONTENT_TYPE)},
+    )
+
+    response = client.get("/v1/files")
+    assert set(response.json()["files"][0]) == {"file_path", "last_modified", "size_bytes"}
+
+    response = client.get("/v1/files", params={"include": "content_type,etag"})
+    assert response.status_code == status.HTTP_200_OK
+    file = response.json()["files"][0]
+    assert file["content_type"] == TEST_FILE_CONTENT_TYPE
+    assert file["etag"]
+    assert "metadata" not in file
+
+
 def test_get_file_metadata(client: TestClient):
     """Test getting metadata for a file using HEAD method."""
     # Create sample file
@@ -138,3 +222,20 @@ def test_generate_image(client: TestClient):
     assert response.status_code == status.HTTP_200_OK
     assert response.content is not None
     assert response.headers["Content-Type"] == "image/png"
+
+
+def test_generate_image_downloaded_from_url(mocked_aws: None, mocked_openai: None):
+    """Test generating an image that OpenAI returns as a URL instead of inline."""
+    IMAGE_FILE_PATH = "some/nested/path/image.png"  # pylint: disable=invalid-name
+    app = create_app(settings=Settings(s3_bucket_name=TEST_BUCKET_NAME, image_response_format="url"))
+    with TestClient(app) as client:
+        response = client.post(
+            url=f"/v1/files/generated/{IMAGE_FILE_PATH}",
+            params={"prompt": "Test Prompt", "file_type": GeneratedFileType.IMAGE.value},
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+        response = client.get(f"/v1/files/{IMAGE_FILE_PATH}")
+        assert response.status_code == status.HTTP_200_OK
+        assert response.content
+        assert response.headers["Content-Type"] == "image/png"
@@ -0,0 +1,81 @@
+"""Test cases for `serialization`."""
+
+import json
+from datetime import (
+    datetime,
+    timezone,
+)
+
+from dateutil.tz import (
+    tzlocal,
+    tzutc,
+)
+
+from files_api.listing import ObjectHeadMetadata
+from files_api.schemas import (
+    FileMetadata,
+    FileMetadataField,
+    GetFilesResponse,
+)
+from files_api.serialization import serialize_get_files_response
+
+TEST_FILES = [
+    {"Key": "file1.txt", "LastModified": datetime(2024, 1, 2, 3, 4, 5, tzinfo=tzutc()), "Size": 512, "ETag": '"a"'},
+    {"Key": "dir/ümlaut.txt", "LastModified": datetime(2024, 1, 2, 3, 4, 5, 6789, tzinfo=timezone.utc), "Size": 0},
+    {"Key": "file3.txt", "LastModified": datetime(2024, 1, 2, 3, 4, 5, tzinfo=tzlocal()), "Size": 1, "ETag": '"c"'},
+]
+
+
+def test_serialization_matches_pydantic_models():
+    """Test that the fast path produces the same JSON as the documented `GetFilesResponse` model."""
+    for next_page_token in ["next_page_token_value", None]:
+        expected = GetFilesResponse(
+            files=[
+                FileMetadata(file_path=file["Key"], last_modified=file["LastModified"], size_bytes=file["Size"])
+                for file in TEST_FILES
+            ],
+            next_page_token=next_page_token,
+        )
+        serialized = serialize_get_files_response(files=TEST_FILES, next_page_token=next_page_token)
+        assert serialized == expected.model_dump_json(exclude_unset=True).encode("utf-8")
+
+
+def test_serialization_of_included_fields():
+    """Test that optional fields are only serialized when requested."""
+    serialized = serialize_get_files_response(
+        files=TEST_FILES[:1],
+        next_page_token=None,
+        include_fields={FileMetadataField.ETAG, FileMetadataField.CONTENT_TYPE},
+        head_metadata={"file1.txt": ObjectHeadMetadata(content_type="text/plain", metadata={"author": "someone"})},
+    )
+    file = json.loads(serialized)["files"][0]
+    assert file["etag"] == '"a"'
+    assert file["content_type"] == "text/plain"
+    assert "metadata" not in file
+
+
+def test_serialization_omits_fields_that_were_not_requested():
+    """Test that requested fields are always present, even if unknown, and that the others are omitted."""
+    include_fields = {FileMetadataField.ETAG, FileMetadataField.CONTENT_TYPE}
+    head_metadata = {"file1.txt": ObjectHeadMetadata(content_type="text/plain", metadata={})}
+    expected = GetFilesResponse(
+        files=[
+            FileMetadata(
+                file_path=file["Key"],
+                last_modified=file["LastModified"],
+                size_bytes=file["Size"],
+                etag=file.get("ETag"),
+                content_type=head_metadata[file["Key"]].content_type if file["Key"] in head_metadata else None,
+            )
+            for file in TEST_FILES
+        ],
+        next_page_token=None,
+    )
+
+    serialized = serialize_get_files_response(
+        files=TEST_FILES, next_page_token=None, include_fields=include_fields, head_metadata=head_metadata
+    )
+    assert serialized == expected.model_dump_json(exclude_unset=True).encode("utf-8")
+    files = json.loads(serialized)["files"]
+    assert (files[1]["etag"], files[1]["content_type"]) == (None, None)
+    assert all("metadata" not in file for file in files)
@@ -0,0 +1,74 @@
+"""Test cases for `timing`."""
+
+import asyncio
+import json
+import logging
+
+from fastapi.testclient import TestClient
+
+from files_api.timing import (
+    REQUEST_TIMINGS,
+    RequestTimings,
+    format_server_timing,
+    timed,
+)
+
+
+@timed("sleep")
+async def sleep_a_bit() -> None:
+    await asyncio.sleep(0.01)
+
+
+@timed("work")
+def work() -> int:
+    return 42
+
+
+def test_phases_are_recorded_in_worker_threads_and_tasks():
+    """Test that phases are recorded for the current request, also from threads and concurrent tasks."""
+    timings = RequestTimings()
+
+    async def handle_request() -> None:
+        REQUEST_TIMINGS.set(timings)
+        assert await asyncio.to_thread(work) == 42
+        await asyncio.gather(sleep_a_bit(), sleep_a_bit())
+
+    asyncio.run(handle_request())
+    summary = timings.summarize()
+    assert list(summary) == ["work", "sleep"]
+    assert summary["sleep"][1] == 2
+    assert summary["sleep"][0] >= 0.02
+    assert format_server_timing(timings).startswith("work;dur=")
+    assert "sleep;dur=" in format_server_timing(timings) and ';desc="x2"' in format_server_timing(timings)
+
+
+def test_nothing_is_recorded_outside_of_a_request():
+    """Test that timed functions work as usual outside of a request."""
+    assert work() == 42
+    assert REQUEST_TIMINGS.get() is None
+
+
+def test_server_timing_header_and_log(client: TestClient, caplog):
+    """Test that a response reports the S3 calls it made, in its headers and in a JSON log line."""
+    client.put("/v1/files/file.txt", content=b"content", headers={"Content-Type": "text/plain"})
+
+    with caplog.at_level(logging.INFO, logger="files_api.timing"):
+        response = client.get("/v1/files/file.txt")
+
+    metrics = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+    assert metrics == ["s3-head", "s3-get", "total"]
+
+    record = json.loads(caplog.records[-1].getMessage())
+    assert (record["method"], record["path"], record["status"]) == ("GET", "/v1/files/file.txt", 200)
+    assert set(record["phases"]) == {"s3-head", "s3-get"}
+    assert record["duration_ms"] >= record["first_byte_ms"]
+
+
+def test_deletes_are_timed(client: TestClient):
+    """Test that deleting a file reports the S3 delete next to the existence check."""
+    client.put("/v1/files/file.txt", content=b"content", headers={"Content-Type": "text/plain"})
+
+    response = client.delete("/v1/files/file.txt")
+
+    metrics = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+    assert metrics == ["s3-head", "s3-delete", "total"]
@@ -0,0 +1,142 @@
+"""Test cases for `tracing`."""
+
+import asyncio
+import json
+from typing import (
+    Deque,
+    Iterator,
+)
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from files_api.main import create_app
+from files_api.settings import Settings
+from files_api.tracing import (
+    CURRENT_SPAN,
+    JSONLinesSpanExporter,
+    Span,
+    SpanContext,
+    TraceRecording,
+    format_traceparent,
+    inject_traceparent,
+    parse_traceparent,
+    start_span,
+)
+from tests.consts import TEST_BUCKET_NAME
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_SPAN_ID = "00f067aa0ba902b7"
+
+
+def make_traced_client(**settings) -> Iterator[TestClient]:
+    app = create_app(
+        settings=Settings(s3_bucket_name=TEST_BUCKET_NAME, tracing_enabled=True, tracing_exporter="memory", **settings)
+    )
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def traced_client(mocked_aws, mocked_openai) -> Iterator[TestClient]:
+    """A client of an app that traces every request, keeping the spans in memory."""
+    yield from make_traced_client(tracing_sample_ratio=1.0)
+
+
+def get_exported_spans(client: TestClient) -> Deque[Span]:
+    assert isinstance(client.app, FastAPI)
+    return client.app.state.tracer.exporter.spans
+
+
+def test_request_continues_the_callers_trace(traced_client: TestClient):
+    """Test that the spans of a request join the caller's trace, and nest S3 calls under the route's span."""
+    traced_client.put("/v1/files/file.txt", content=b"content", headers={"Content-Type": "text/plain"})
+    get_exported_spans(traced_client).clear()
+
+    response = traced_client.get("/v1/files/file.txt", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_SPAN_ID}-01"})
+    assert response.status_code == 200
+
+    spans = {span.name: span for span in get_exported_spans(traced_client)}
+    assert set(spans) == {"GET /v1/files/{file_path:path}", "s3.head_object", "s3.get_object"}
+    root_span = spans["GET /v1/files/{file_path:path}"]
+    assert {span.trace.trace_id for span in spans.values()} == {TRACE_ID}
+    assert root_span.parent_span_id == PARENT_SPAN_ID
+    assert root_span.attributes["status_code"] == 200
+    assert response.headers["traceresponse"] == f"00-{TRACE_ID}-{root_span.span_id}-01"
+
+    get_span = spans["s3.get_object"]
+    assert get_span.parent_span_id == root_span.span_id
+    assert get_span.status == "ok"
+    assert get_span.attributes == {"bucket": TEST_BUCKET_NAME, "key": "file.txt", "size": len(b"content")}
+
+
+def test_unsampled_requests_are_not_recorded(mocked_aws, mocked_openai):
+    """Test that requests neither the caller nor the sample ratio picked are not traced."""
+    for client in make_traced_client(tracing_sample_ratio=0.0):
+        response = client.get("/v1/files")
+        assert "traceresponse" not in response.headers
+        assert not get_exported_spans(client)
+
+        # the caller's decision wins over the sample ratio
+        client.get("/v1/files", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_SPAN_ID}-01"})
+        assert {span.name for span in get_exported_spans(client)} == {"GET /v1/files", "s3.list_objects"}
+
+
+def test_slow_requests_are_exported_even_if_not_sampled(mocked_aws, mocked_openai):
+    """Test that with a slow request threshold, requests that are not sampled but slow are exported anyway."""
+    for client in make_traced_client(tracing_sample_ratio=0.0, tracing_slow_request_seconds=0.0):
+        response = client.get("/v1/files")
+        assert response.headers["traceresponse"].endswith("-00")
+        assert {span.name for span in get_exported_spans(client)} == {"GET /v1/files", "s3.list_objects"}
+
+
+def test_parse_traceparent():
+    """Test that valid `traceparent` headers round-trip, and that invalid ones are ignored."""
+    context = SpanContext(trace_id=TRACE_ID, span_id=PARENT_SPAN_ID, sampled=True)
+    assert parse_traceparent(format_traceparent(context)) == context
+    assert parse_traceparent(f"00-{TRACE_ID}-{PARENT_SPAN_ID}-00").sampled is False
+    assert parse_traceparent(f"00-{'0' * 32}-{PARENT_SPAN_ID}-01") is None
+    assert parse_traceparent(f"00-{TRACE_ID.upper()}-{PARENT_SPAN_ID}-01") is None
+    assert parse_traceparent("not a traceparent") is None
+
+
+def test_jsonl_exporter_appends_one_span_per_line(tmp_path):
+    """Test that exported spans are appended to the file as JSON objects."""
+    exporter = JSONLinesSpanExporter(str(tmp_path / "traces.jsonl"))
+    trace = TraceRecording(trace_id=TRACE_ID, sampled=True)
+    for name in ["s3.head_object", "s3.get_object"]:
+        Span(name, trace, parent_span_id=PARENT_SPAN_ID, attributes={"key": "file.txt"}).end()
+    exporter.export(trace.spans[:1])
+    exporter.export(trace.spans[1:])
+    exporter.close()
+
+    lines = (tmp_path / "traces.jsonl").read_text().splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["s3.head_object", "s3.get_object"]
+    assert json.loads(lines[0])["trace_id"] == TRACE_ID
+    assert json.loads(lines[0])["attributes"] == {"key": "file.txt"}
+
+
+def test_outbound_requests_carry_the_current_span():
+    """Test that requests sent with the `traceparent` event hook tell the called service which span called it."""
+    received_headers = []
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        received_headers.append(request.headers.get("traceparent"))
+        return httpx.Response(200)
+
+    async def scenario() -> SpanContext:
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(handle), event_hooks={"request": [inject_traceparent]}
+        ) as http_client:
+            # outside of a traced request
+            await http_client.get("https://example.com/image.png")
+
+            CURRENT_SPAN.set(Span("POST /v1/files/generated", TraceRecording(trace_id=TRACE_ID, sampled=True), None))
+            with start_span("openai.images.generate") as span:
+                await http_client.get("https://example.com/image.png")
+            return span.context
+
+    span_context = asyncio.run(scenario())
+    assert received_headers == [None, format_traceparent(span_context)]